@@ -1,15 +1,37 @@
+import argparse
+import csv
+import hashlib
+import io
 import os
+from collections import Counter, defaultdict
+from concurrent.futures import (FIRST_COMPLETED, ProcessPoolExecutor,
+                                wait)
+from datetime import datetime
+from functools import lru_cache
+from itertools import islice
 from typing import List
 
 import json
 from dateutil.parser import parse
 import re
 
-from sqlalchemy.orm import Session
+from psycopg2.extras import execute_values
+from pydantic import TypeAdapter
+from sqlalchemy import create_engine, text
+from sqlalchemy.dialects.postgresql import Range
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.schema import CreateIndex, CreateTable
 
+from api.crud import report_cache_crud, transaction_crud
 from api.database.database import SessionLocal
 import api.database.db_models as db_mod
+from api.enums import MaskCountBackend
 from api.schemas import input_schema as in_sch
+from api.utils.price_snapshot import build_price_snapshot
+from api.utils.tools import (get_unit_price, parse_mask_name,
+                             week_minute_ranges)
+from config.config import (MASK_COUNT_BACKEND, PRICE_SNAPSHOT_PATH,
+                           TRANSACTION_PARTITION_MONTHS_AHEAD)
 
 
 def load_data(path):
@@ -17,68 +39,177 @@ def load_data(path):
         return json.load(f)
 
 
-def parse_pharmacies(data):
-    full_days = ['Mon', 'Tue', 'Wed', 'Thur', 'Fri', 'Sat', 'Sun']
+def iter_json_array(path, read_size=1 << 16):
+    """
+    Yield the elements of a top-level JSON array one at a time.
 
-    def expand_days(_days_part):
-        if '-' in _days_part:
-            start_day, end_day = list(
-                map(lambda x: x.strip(), _days_part.split('-'))
-            )
-            start_idx = full_days.index(start_day)
-            end_idx = full_days.index(end_day)
-            return full_days[start_idx:end_idx + 1]
+    The file is read in chunks and each element is decoded as soon as it is
+    complete, so memory is bounded by the largest element rather than by the
+    size of the file.
+    """
+    decoder = json.JSONDecoder()
+    with open(path, 'r') as f:
+        buffer = ''
+        while not buffer and (chunk := f.read(read_size)):
+            buffer = chunk.lstrip()
+        if not buffer.startswith('['):
+            raise ValueError(f'{path} does not contain a JSON array')
+
+        position = 1
+        eof = False
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+            if position < len(buffer) and buffer[position] == ']':
+                return
+
+            item, end, following = None, None, len(buffer)
+            if position < len(buffer):
+                try:
+                    item, end = decoder.raw_decode(buffer, position)
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                else:
+                    following = end
+                    while following < len(buffer) \
+                            and buffer[following] in ' \t\r\n':
+                        following += 1
+                    if following < len(buffer) \
+                            and buffer[following] not in ',]' and eof:
+                        raise json.JSONDecodeError("Expecting ',' delimiter",
+                                                   buffer, following)
+
+            # The element may be cut off at the end of the buffer, a number
+            # such as "1.5" even decoding early as 1, so only trust a decode
+            # that is followed by the next separator.
+            if end is None or following == len(buffer) \
+                    or buffer[following] not in ',]':
+                if eof:
+                    raise ValueError(f'{path}: unexpected end of JSON array')
+                buffer = buffer[position:]
+                chunk = f.read(max(read_size, len(buffer)))
+                eof = not chunk
+                buffer += chunk
+                position = 0
+                continue
+
+            yield item
+            position = end
+
+
+def iter_batches(items, batch_size):
+    """
+    Group an iterable into lists of at most ``batch_size`` items.
+    """
+    iterator = iter(items)
+    while batch := list(islice(iterator, batch_size)):
+        yield batch
+
+
+FULL_DAYS = ['Mon', 'Tue', 'Wed', 'Thur', 'Fri', 'Sat', 'Sun']
+
+_pharmacy_adapter = TypeAdapter(List[in_sch.PharmacyCreate])
+_pharmacy_hour_adapter = TypeAdapter(List[in_sch.PharmacyHourCreate])
+_price_adapter = TypeAdapter(List[in_sch.PharmacyMaskCreate])
+_user_adapter = TypeAdapter(List[in_sch.UserCreate])
+_transaction_adapter = TypeAdapter(List[in_sch.TransactionCreate])
+
+
+def expand_days(days_part):
+    """
+    Expand a day range such as "Mon - Fri" or a list such as "Tue, Thur".
+    """
+    if '-' in days_part:
+        start_day, end_day = [day.strip() for day in days_part.split('-')]
+        start_idx = FULL_DAYS.index(start_day)
+        end_idx = FULL_DAYS.index(end_day)
+        return FULL_DAYS[start_idx:end_idx + 1]
+
+    return [day.strip() for day in days_part.split(',')]
 
-        return list(map(lambda x: x.strip(), _days_part.split(',')))
 
+@lru_cache(maxsize=1024)
+def parse_opening_hours(opening_hours):
+    """
+    Parse an openingHours string into (day, open_time, close_time) tuples.
+
+    Many pharmacies share the same string, so results are memoized.
+    """
+    hours = []
+    for segment in opening_hours.split('/'):
+        match = re.match(r'(.+?) (\d{2}:\d{2}) - (\d{2}:\d{2})', segment)
+        days_part, open_time, close_time = match.groups()
+        for day in expand_days(days_part):
+            hours.append((day, open_time, close_time))
+    return tuple(hours)
+
+
+def parse_date(value):
+    """
+    Parse a transaction date, taking the fast path for the usual
+    "YYYY-MM-DD HH:MM:SS" format and falling back to dateutil otherwise.
+    """
+    if len(value) == 19 and value[10] == ' ':
+        try:
+            return datetime.fromisoformat(value)
+        except ValueError:
+            pass
+    return parse(value)
+
+
+def parse_pharmacies(data):
     pharmacies = []
     masks = {}
     prices = []
     pharmacy_hours = []
     for pharmacy in data:
-        pharmacies.append(in_sch.PharmacyCreate(
-            name=pharmacy.get('name'),
-            cash_balance=pharmacy.get('cashBalance')
-        ))
+        name = pharmacy.get('name')
+        pharmacies.append({
+            'name': name,
+            'cash_balance': pharmacy.get('cashBalance')
+        })
         for mask in pharmacy.get('masks'):
             masks[mask.get('name')] = 1
-            prices.append(in_sch.PharmacyMaskCreate(
-                pharmacy=pharmacy.get('name'),
-                mask=mask.get('name'),
-                price=mask.get('price')
-            ))
+            prices.append({
+                'pharmacy': name,
+                'mask': mask.get('name'),
+                'price': mask.get('price')
+            })
 
-        segments = pharmacy.get('openingHours').split('/')
-        for segment in segments:
-            match = re.match(r'(.+?) (\d{2}:\d{2}) - (\d{2}:\d{2})', segment)
-            days_part, open_time, close_time = match.groups()
-            days = expand_days(days_part)
-            for day in days:
-                pharmacy_hours.append(in_sch.PharmacyHourCreate(
-                    pharmacy=pharmacy.get('name'),
-                    day_of_week=day,
-                    open_time=open_time,
-                    close_time=close_time))
-    return pharmacies, pharmacy_hours, list(masks.keys()), prices
+        for day, open_time, close_time in parse_opening_hours(
+                pharmacy.get('openingHours')):
+            pharmacy_hours.append({
+                'pharmacy': name,
+                'day_of_week': day,
+                'open_time': open_time,
+                'close_time': close_time
+            })
+    return (_pharmacy_adapter.validate_python(pharmacies),
+            _pharmacy_hour_adapter.validate_python(pharmacy_hours),
+            list(masks.keys()),
+            _price_adapter.validate_python(prices))
 
 
 def parse_users(data):
     users = []
     transactions = []
     for user in data:
-        users.append(in_sch.UserCreate(
-            name=user.get('name'),
-            cash_balance=user.get('cashBalance')
-        ))
+        name = user.get('name')
+        users.append({
+            'name': name,
+            'cash_balance': user.get('cashBalance')
+        })
         for transaction in user.get('purchaseHistories'):
-            transactions.append(in_sch.TransactionCreate(
-                user=user.get('name'),
-                pharmacy=transaction.get('pharmacyName'),
-                mask=transaction.get('maskName'),
-                transaction_amount=transaction.get('transactionAmount'),
-                date=parse(transaction.get('transactionDate')),
-            ))
-    return users, transactions
+            transactions.append({
+                'user': name,
+                'pharmacy': transaction.get('pharmacyName'),
+                'mask': transaction.get('maskName'),
+                'transaction_amount': transaction.get('transactionAmount'),
+                'date': parse_date(transaction.get('transactionDate')),
+            })
+    return (_user_adapter.validate_python(users),
+            _transaction_adapter.validate_python(transactions))
 
 
 def insert_data(
@@ -98,6 +229,7 @@ def insert_data(
         for mask in masks:
             _db.add(db_mod.Mask(
                 name=mask,
+                **parse_mask_name(mask)._asdict()
             ))
 
         for user in users:
@@ -115,6 +247,7 @@ def insert_data(
                 pharmacy_id=pharmacy_dict[price.pharmacy],
                 mask_id=mask_dict[price.mask],
                 price=price.price,
+                unit_price=get_unit_price(price.price, price.mask),
             ))
 
         for hours in pharmacy_hours:
@@ -124,6 +257,12 @@ def insert_data(
                 open_time=hours.open_time,
                 close_time=hours.close_time,
             ))
+            for start, stop in week_minute_ranges(
+                    hours.day_of_week, hours.open_time, hours.close_time):
+                _db.add(db_mod.PharmacyOpenInterval(
+                    pharmacy_id=pharmacy_dict[hours.pharmacy],
+                    minutes=Range(start, stop),
+                ))
 
         for transaction in transactions:
             _db.add(db_mod.Transaction(
@@ -142,20 +281,992 @@ def insert_data(
         _db.close()
 
 
-def run(db):
+MASK_COLUMNS = ['name', 'brand', 'color', 'pack_size']
+
+
+class _CopyStream:
+    """
+    Minimal file-like object that renders rows as CSV on demand, so COPY can
+    stream them without materializing the whole payload in memory.
+    """
+
+    def __init__(self, rows):
+        self._rows = iter(rows)
+        self._buffer = io.StringIO()
+        self._writer = csv.writer(self._buffer, lineterminator='\n')
+
+    def read(self, size=-1):
+        while size < 0 or self._buffer.tell() < size:
+            row = next(self._rows, None)
+            if row is None:
+                break
+            self._writer.writerow(row)
+
+        chunk = self._buffer.getvalue()
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        return chunk
+
+
+def _copy_rows(cursor, table: str, columns: List[str], rows):
+    """
+    Stream rows into a table with COPY FROM STDIN.
+    """
+    cursor.copy_expert(
+        f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)",
+        _CopyStream(rows)
+    )
+
+
+def _insert_returning_ids(cursor, table: str, columns: List[str], rows,
+                          page_size: int = 1000):
+    """
+    Insert rows with multi-row INSERT ... RETURNING and map the first column
+    (the natural key) to the generated id.
+    """
+    returned = execute_values(
+        cursor,
+        f"INSERT INTO {table} ({', '.join(columns)}) VALUES %s "
+        f"RETURNING {columns[0]}, id",
+        rows,
+        page_size=page_size,
+        fetch=True
+    )
+    return dict(returned)
+
+
+def _load_pharmacy_batch(
+        cursor,
+        pharmacies: List[in_sch.PharmacyCreate],
+        pharmacy_hours: List[in_sch.PharmacyHourCreate],
+        masks: list[str],
+        prices: List[in_sch.PharmacyMaskCreate],
+        mask_dict: dict
+):
+    """
+    Load one batch of parsed pharmacies with their hours and prices.
+
+    Only masks missing from ``mask_dict`` are inserted; their ids are added to
+    it so later batches can resolve them. Returns the name-to-id map of the
+    pharmacies in the batch.
+    """
+    pharmacy_dict = _insert_returning_ids(
+        cursor, db_mod.Pharmacy.__tablename__, ['name', 'cash_balance'],
+        [(pharmacy.name, pharmacy.cash_balance) for pharmacy in pharmacies]
+    )
+    new_masks = [(mask, *parse_mask_name(mask)) for mask in masks
+                 if mask not in mask_dict]
+    if new_masks:
+        mask_dict.update(_insert_returning_ids(
+            cursor, db_mod.Mask.__tablename__, MASK_COLUMNS, new_masks
+        ))
+
+    _copy_pharmacy_details(cursor, pharmacy_hours, prices, pharmacy_dict,
+                           mask_dict)
+    return pharmacy_dict
+
+
+def _copy_pharmacy_details(
+        cursor,
+        pharmacy_hours: List[in_sch.PharmacyHourCreate],
+        prices: List[in_sch.PharmacyMaskCreate],
+        pharmacy_dict: dict,
+        mask_dict: dict
+):
+    """
+    Stream the prices and opening hours of already inserted pharmacies.
+    """
+    _copy_rows(
+        cursor, db_mod.PharmacyMask.__tablename__,
+        ['pharmacy_id', 'mask_id', 'price', 'unit_price'],
+        ((pharmacy_dict[price.pharmacy], mask_dict[price.mask],
+          price.price, get_unit_price(price.price, price.mask))
+         for price in prices)
+    )
+    _copy_rows(
+        cursor, db_mod.PharmacyHour.__tablename__,
+        ['pharmacy_id', 'day_of_week', 'open_time', 'close_time'],
+        ((pharmacy_dict[hours.pharmacy], hours.day_of_week,
+          hours.open_time, hours.close_time) for hours in pharmacy_hours)
+    )
+    _copy_rows(
+        cursor, db_mod.PharmacyOpenInterval.__tablename__,
+        ['pharmacy_id', 'minutes'],
+        ((pharmacy_dict[hours.pharmacy], f'[{start},{stop})')
+         for hours in pharmacy_hours
+         for start, stop in week_minute_ranges(
+            hours.day_of_week, hours.open_time, hours.close_time))
+    )
+
+
+def _load_user_batch(
+        cursor,
+        users: List[in_sch.UserCreate],
+        transactions: List[in_sch.TransactionCreate],
+        pharmacy_dict: dict,
+        mask_dict: dict
+):
+    """
+    Load one batch of parsed users and their purchase histories.
+    """
+    user_dict = _insert_returning_ids(
+        cursor, db_mod.User.__tablename__, ['name', 'cash_balance'],
+        [(user.name, user.cash_balance) for user in users]
+    )
+    _copy_transactions(cursor, transactions, user_dict, pharmacy_dict,
+                       mask_dict)
+
+
+def _copy_transactions(
+        cursor,
+        transactions: List[in_sch.TransactionCreate],
+        user_dict: dict,
+        pharmacy_dict: dict,
+        mask_dict: dict
+):
+    """
+    Stream purchase histories, resolving names through the id maps.
+    """
+    _copy_rows(
+        cursor, db_mod.Transaction.__tablename__,
+        ['user_id', 'pharmacy_id', 'mask_id', 'transaction_amount', 'date'],
+        ((user_dict[transaction.user],
+          pharmacy_dict[transaction.pharmacy],
+          mask_dict[transaction.mask],
+          transaction.transaction_amount,
+          transaction.date) for transaction in transactions)
+    )
+
+
+def bulk_insert_data(
+        _db: Session,
+        pharmacies: List[in_sch.PharmacyCreate],
+        pharmacy_hours: List[in_sch.PharmacyHourCreate],
+        masks: list[str],
+        prices: List[in_sch.PharmacyMaskCreate],
+        users: List[in_sch.UserCreate],
+        transactions: List[in_sch.TransactionCreate]
+):
+    """
+    Load the parsed data with multi-row INSERT ... RETURNING for pharmacies,
+    masks and users, and COPY FROM STDIN for prices, hours and transactions.
+
+    Foreign keys are resolved from the ids returned by the inserts instead of
+    reading the tables back, and the whole load is committed or rolled back
+    as a single database transaction.
+    """
+    try:
+        cursor = _db.connection().connection.cursor()
+        mask_dict = {}
+        pharmacy_dict = _load_pharmacy_batch(
+            cursor, pharmacies, pharmacy_hours, masks, prices, mask_dict
+        )
+        _load_user_batch(cursor, users, transactions, pharmacy_dict,
+                         mask_dict)
+        _db.commit()
+    except Exception as e:
+        _db.rollback()
+        raise e
+    finally:
+        _db.close()
+
+
+def stream_insert_data(
+        _db: Session,
+        pharmacies_path: str,
+        users_path: str,
+        batch_size: int = 1000,
+        record_hashes: bool = False
+):
+    """
+    Stream both data files through the parsers and the bulk loader in batches
+    of ``batch_size`` records, so memory stays flat as the files grow.
+
+    Only the pharmacy and mask name-to-id maps are kept for the whole run.
+    The load is still committed or rolled back as a single transaction.
+    With ``record_hashes`` the records are also hashed into ``etl_records``
+    as an incremental run would, so that the next one only loads changes.
+    """
+    try:
+        cursor = _db.connection().connection.cursor()
+        pharmacy_dict = {}
+        mask_dict = {}
+        for batch in iter_batches(iter_json_array(pharmacies_path),
+                                  batch_size):
+            pharmacy_dict.update(_load_pharmacy_batch(
+                cursor, *parse_pharmacies(batch), mask_dict
+            ))
+            if record_hashes:
+                _save_record_hashes(cursor, 'pharmacy',
+                                    _pharmacy_records(batch))
+
+        for batch in iter_batches(iter_json_array(users_path), batch_size):
+            _load_user_batch(cursor, *parse_users(batch), pharmacy_dict,
+                             mask_dict)
+            if record_hashes:
+                _save_record_hashes(cursor, 'user', _user_records(batch))
+                _insert_history_keys(cursor, _history_keys(batch))
+
+        _db.commit()
+    except Exception as e:
+        _db.rollback()
+        raise e
+    finally:
+        _db.close()
+
+
+_worker_session = sessionmaker()
+_worker_pharmacy_dict = {}
+_worker_mask_dict = {}
+
+
+def _init_load_worker(database_url: str, pharmacy_dict: dict,
+                      mask_dict: dict):
+    """
+    Prepare a loader process: open its own engine on the target database and
+    keep the dimension maps for resolving foreign keys.
+    """
+    _worker_session.configure(bind=create_engine(database_url, pool_size=1))
+    _worker_pharmacy_dict.update(pharmacy_dict)
+    _worker_mask_dict.update(mask_dict)
+
+
+def _parse_and_load_user_batch(batch):
+    """
+    Parse one batch of raw users and load it on the worker's own connection.
+    """
+    users, transactions = parse_users(batch)
+    _db = _worker_session()
+    try:
+        cursor = _db.connection().connection.cursor()
+        _load_user_batch(cursor, users, transactions, _worker_pharmacy_dict,
+                         _worker_mask_dict)
+        _db.commit()
+    except Exception as e:
+        _db.rollback()
+        raise e
+    finally:
+        _db.close()
+
+
+def parallel_insert_data(
+        _db: Session,
+        pharmacies_path: str,
+        users_path: str,
+        workers: int,
+        batch_size: int = 1000
+):
+    """
+    Load both data files with ``workers`` processes.
+
+    Pharmacy batches are parsed in a process pool and loaded, together with
+    the masks, on ``_db`` in one transaction, in the order they are parsed. Once that has committed, user
+    batches are parsed and loaded by the pool workers, each on its own
+    connection. A user batch and its purchase histories are committed
+    together, so a failure leaves whole batches loaded rather than partial
+    ones. At most two batches per worker are in flight at a time.
+    """
+    database_url = _db.get_bind().url.render_as_string(hide_password=False)
+    try:
+        cursor = _db.connection().connection.cursor()
+        pharmacy_dict = {}
+        mask_dict = {}
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            # Submit as batches are read rather than through pool.map, which
+            # would read the whole file up front.
+            pending = set()
+
+            def load_parsed(futures):
+                for future in futures:
+                    pharmacy_dict.update(_load_pharmacy_batch(
+                        cursor, *future.result(), mask_dict
+                    ))
+
+            for batch in iter_batches(iter_json_array(pharmacies_path),
+                                      batch_size):
+                if len(pending) >= workers * 2:
+                    done, pending = wait(pending,
+                                         return_when=FIRST_COMPLETED)
+                    load_parsed(done)
+                pending.add(pool.submit(parse_pharmacies, batch))
+            load_parsed(wait(pending).done)
+        _db.commit()
+    except Exception as e:
+        _db.rollback()
+        raise e
+    finally:
+        _db.close()
+
+    with ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_load_worker,
+            initargs=(database_url, pharmacy_dict, mask_dict)
+    ) as pool:
+        pending = set()
+        try:
+            for batch in iter_batches(iter_json_array(users_path),
+                                      batch_size):
+                if len(pending) >= workers * 2:
+                    done, pending = wait(pending,
+                                         return_when=FIRST_COMPLETED)
+                    for future in done:
+                        future.result()
+                pending.add(pool.submit(_parse_and_load_user_batch, batch))
+
+            for future in wait(pending).done:
+                future.result()
+        except Exception as e:
+            pool.shutdown(cancel_futures=True)
+            raise e
+
+
+def _record_hash(record) -> str:
+    """
+    Hash a raw source record independently of its key order.
+    """
+    return hashlib.sha1(
+        json.dumps(record, sort_keys=True).encode()
+    ).hexdigest()
+
+
+def _select_ids(cursor, table: str, names=None):
+    """
+    Map names to ids for the given names, or for the whole table.
+    """
+    if names is None:
+        cursor.execute(f"SELECT name, id FROM {table}")
+    else:
+        cursor.execute(f"SELECT name, id FROM {table} WHERE name = ANY(%s)",
+                       (list(names),))
+    return dict(cursor.fetchall())
+
+
+def _changed_records(cursor, kind: str, records, counts: Counter):
+    """
+    Keep the (key, hash, record) tuples whose hash differs from the one
+    stored by the previous run, counting the rest as unchanged. Of a key
+    repeated within the batch only the last record is kept.
+    """
+    records = list({key: (key, record_hash, record)
+                    for key, record_hash, record in records}.values())
+    cursor.execute(
+        f"SELECT source_key, record_hash FROM "
+        f"{db_mod.EtlRecord.__tablename__} "
+        f"WHERE kind = %s AND source_key = ANY(%s)",
+        (kind, [key for key, _, _ in records])
+    )
+    known = dict(cursor.fetchall())
+    changed = [(key, record_hash, record)
+               for key, record_hash, record in records
+               if known.get(key) != record_hash]
+    counts['unchanged'] += len(records) - len(changed)
+    return changed
+
+
+def _pharmacy_records(batch):
+    """
+    List the (key, hash, record) tuples of a batch of raw pharmacies.
+    """
+    return [(pharmacy.get('name'), _record_hash(pharmacy), pharmacy)
+            for pharmacy in batch]
+
+
+def _user_records(batch):
+    """
+    List the (key, hash, record) tuples of a batch of raw users, hashing
+    only the user's own fields.
+    """
+    return [(user.get('name'),
+             _record_hash([user.get('name'), user.get('cashBalance')]),
+             user) for user in batch]
+
+
+def _history_keys(batch):
+    """
+    List the (key, hash) of the purchase histories of a batch of raw users.
+
+    A purchase history is identified by the hash of its content and user,
+    plus its occurrence number for identical entries of the same user.
+    """
+    keys = []
+    for user in batch:
+        occurrences = Counter()
+        for history in user.get('purchaseHistories'):
+            record_hash = _record_hash([user.get('name'), history])
+            occurrences[record_hash] += 1
+            key = record_hash
+            if occurrences[record_hash] > 1:
+                key = f'{record_hash}:{occurrences[record_hash]}'
+            keys.append((key, record_hash))
+    return keys
+
+
+def _insert_history_keys(cursor, keys):
+    """
+    Store the (key, hash) of purchase histories not stored before, and
+    return the set of their keys.
+    """
+    if not keys:
+        return set()
+    return {key for key, in execute_values(
+        cursor,
+        f"INSERT INTO {db_mod.EtlRecord.__tablename__} "
+        f"(kind, source_key, record_hash) VALUES %s "
+        f"ON CONFLICT (kind, source_key) DO NOTHING "
+        f"RETURNING source_key",
+        [('transaction', key, record_hash) for key, record_hash in keys],
+        page_size=1000,
+        fetch=True
+    )}
+
+
+def _save_record_hashes(cursor, kind: str, records):
+    """
+    Store the hashes of the given (key, hash, record) tuples. Of a key
+    repeated within them only the last hash is stored.
+    """
+    records = {key: (key, record_hash, record)
+               for key, record_hash, record in records}.values()
+    execute_values(
+        cursor,
+        f"INSERT INTO {db_mod.EtlRecord.__tablename__} "
+        f"(kind, source_key, record_hash) VALUES %s "
+        f"ON CONFLICT (kind, source_key) "
+        f"DO UPDATE SET record_hash = EXCLUDED.record_hash",
+        [(kind, key, record_hash) for key, record_hash, _ in records],
+        page_size=1000
+    )
+
+
+def _upsert_returning_ids(cursor, table: str, columns: List[str], rows,
+                          counts: Counter):
+    """
+    Insert rows, or update the existing row with the same natural key (the
+    first column), and map the key to the id. Counts inserted and updated
+    rows separately.
+
+    A statement cannot update the same row twice, so of a key repeated
+    within the rows only the last row is written.
+    """
+    rows = list({row[0]: row for row in rows}.values())
+    updates = ', '.join(f'{column} = EXCLUDED.{column}'
+                        for column in columns[1:])
+    returned = execute_values(
+        cursor,
+        f"INSERT INTO {table} ({', '.join(columns)}) VALUES %s "
+        f"ON CONFLICT ({columns[0]}) DO UPDATE SET {updates} "
+        f"RETURNING {columns[0]}, id, (xmax = 0)",
+        rows,
+        page_size=1000,
+        fetch=True
+    )
+    inserted = sum(1 for _, _, is_insert in returned if is_insert)
+    counts['inserted'] += inserted
+    counts['updated'] += len(returned) - inserted
+    return {key: row_id for key, row_id, _ in returned}
+
+
+def _upsert_pharmacy_batch(cursor, batch, mask_dict: dict, stats):
+    """
+    Upsert the new or changed pharmacies of a batch and replace their prices
+    and opening hours. Masks not seen before are inserted.
+    """
+    changed = _changed_records(cursor, 'pharmacy', _pharmacy_records(batch),
+                               stats['pharmacies'])
+    if not changed:
+        return
+
+    pharmacies, pharmacy_hours, masks, prices = parse_pharmacies(
+        [record for _, _, record in changed])
+    pharmacy_dict = _upsert_returning_ids(
+        cursor, db_mod.Pharmacy.__tablename__, ['name', 'cash_balance'],
+        [(pharmacy.name, pharmacy.cash_balance) for pharmacy in pharmacies],
+        stats['pharmacies']
+    )
+
+    new_masks = [(mask, *parse_mask_name(mask)) for mask in masks
+                 if mask not in mask_dict]
+    if new_masks:
+        mask_dict.update(_insert_returning_ids(
+            cursor, db_mod.Mask.__tablename__, MASK_COLUMNS, new_masks
+        ))
+        stats['masks']['inserted'] += len(new_masks)
+
+    pharmacy_ids = list(pharmacy_dict.values())
+    for model in (db_mod.PharmacyMask, db_mod.PharmacyHour,
+                  db_mod.PharmacyOpenInterval):
+        cursor.execute(
+            f"DELETE FROM {model.__tablename__} "
+            f"WHERE pharmacy_id = ANY(%s)",
+            (pharmacy_ids,)
+        )
+    _copy_pharmacy_details(cursor, pharmacy_hours, prices, pharmacy_dict,
+                           mask_dict)
+    _save_record_hashes(cursor, 'pharmacy', changed)
+
+
+def _upsert_user_batch(cursor, batch, pharmacy_dict: dict, mask_dict: dict,
+                       stats):
+    """
+    Upsert the new or changed users of a batch and insert the purchase
+    histories that have not been loaded before.
+    """
+    users, transactions = parse_users(batch)
+
+    changed = _changed_records(cursor, 'user', _user_records(batch),
+                               stats['users'])
+    if changed:
+        changed_names = {key for key, _, _ in changed}
+        _upsert_returning_ids(
+            cursor, db_mod.User.__tablename__, ['name', 'cash_balance'],
+            [(user.name, user.cash_balance) for user in users
+             if user.name in changed_names],
+            stats['users']
+        )
+        _save_record_hashes(cursor, 'user', changed)
+
+    keys = _history_keys(batch)
+    new_keys = _insert_history_keys(cursor, keys)
+    stats['transactions']['inserted'] += len(new_keys)
+    stats['transactions']['unchanged'] += len(keys) - len(new_keys)
+
+    if new_keys:
+        user_dict = _select_ids(cursor, db_mod.User.__tablename__,
+                                {user.name for user in users})
+        _copy_transactions(
+            cursor,
+            [transaction for (key, _), transaction in zip(keys, transactions)
+             if key in new_keys],
+            user_dict, pharmacy_dict, mask_dict
+        )
+
+
+def incremental_insert_data(
+        _db: Session,
+        pharmacies_path: str,
+        users_path: str,
+        batch_size: int = 1000,
+        force: bool = False
+):
+    """
+    Load only the records that are new or changed since the previous
+    incremental run, streaming both files in batches.
+
+    Every source record is hashed and compared with the hash stored in
+    ``etl_records``. Changed pharmacies and users are upserted on their
+    unique names, and purchase histories that were already loaded are
+    skipped. The run is committed or rolled back as a single transaction.
+    Returns inserted/updated/unchanged counts per table.
+
+    Only incremental and shadow runs record hashes, so purchase histories
+    loaded by the other loaders are not known here and would be inserted
+    again. The run is refused when transactions exist but no purchase
+    history hash does, unless ``force`` is set.
+    """
+    stats = defaultdict(Counter)
+    try:
+        cursor = _db.connection().connection.cursor()
+        cursor.execute(
+            f"SELECT EXISTS (SELECT FROM {db_mod.Transaction.__tablename__}) "
+            f"AND NOT EXISTS (SELECT FROM {db_mod.EtlRecord.__tablename__} "
+            f"WHERE kind = 'transaction')")
+        if cursor.fetchone()[0] and not force:
+            raise RuntimeError(
+                'transactions were loaded without recording their hashes, so '
+                'an incremental run would load them again; reload with '
+                '--shadow first, or pass --force')
+        mask_dict = _select_ids(cursor, db_mod.Mask.__tablename__)
+        for batch in iter_batches(iter_json_array(pharmacies_path),
+                                  batch_size):
+            _upsert_pharmacy_batch(cursor, batch, mask_dict, stats)
+
+        pharmacy_dict = _select_ids(cursor, db_mod.Pharmacy.__tablename__)
+        for batch in iter_batches(iter_json_array(users_path), batch_size):
+            _upsert_user_batch(cursor, batch, pharmacy_dict, mask_dict,
+                               stats)
+
+        _db.commit()
+    except Exception as e:
+        _db.rollback()
+        raise e
+    finally:
+        _db.close()
+
+    return stats
+
+
+def _read_checkpoint(cursor, source_file: str):
+    """
+    Return the (record_index, batch_id) reached in a source file.
+    """
+    cursor.execute(
+        f"SELECT record_index, batch_id FROM "
+        f"{db_mod.EtlCheckpoint.__tablename__} WHERE source_file = %s",
+        (source_file,)
+    )
+    return cursor.fetchone() or (0, 0)
+
+
+def _save_checkpoint(cursor, source_file: str, record_index: int,
+                     batch_id: int):
+    """
+    Record the position reached in a source file.
+    """
+    cursor.execute(
+        f"INSERT INTO {db_mod.EtlCheckpoint.__tablename__} "
+        f"(source_file, record_index, batch_id, updated_at) "
+        f"VALUES (%s, %s, %s, now()) "
+        f"ON CONFLICT (source_file) DO UPDATE SET "
+        f"record_index = EXCLUDED.record_index, "
+        f"batch_id = EXCLUDED.batch_id, "
+        f"updated_at = EXCLUDED.updated_at",
+        (source_file, record_index, batch_id)
+    )
+
+
+def _load_checkpointed_batches(_db: Session, path: str, batch_size: int,
+                               load_batch):
+    """
+    Load the records of a file after its last checkpoint in batches.
+
+    Each batch is committed together with its checkpoint, so a batch is
+    either loaded and recorded or neither.
+    """
+    source_file = os.path.abspath(path)
+    cursor = _db.connection().connection.cursor()
+    record_index, batch_id = _read_checkpoint(cursor, source_file)
+    records = islice(iter_json_array(path), record_index, None)
+    for batch in iter_batches(records, batch_size):
+        load_batch(cursor, batch)
+        record_index += len(batch)
+        batch_id += 1
+        _save_checkpoint(cursor, source_file, record_index, batch_id)
+        _db.commit()
+        cursor = _db.connection().connection.cursor()
+
+
+def resumable_insert_data(
+        _db: Session,
+        pharmacies_path: str,
+        users_path: str,
+        batch_size: int = 1000,
+        resume: bool = False
+):
+    """
+    Stream both files and commit every batch together with a checkpoint in
+    ``etl_checkpoints``.
+
+    With ``resume`` the load continues after the last committed batch of
+    each file, resolving names loaded by the earlier run from the database.
+    Without it, checkpoints left by a previous run of these files are
+    discarded first.
+    """
+    try:
+        if not resume:
+            _db.query(db_mod.EtlCheckpoint).filter(
+                db_mod.EtlCheckpoint.source_file.in_(
+                    [os.path.abspath(pharmacies_path),
+                     os.path.abspath(users_path)])
+            ).delete(synchronize_session=False)
+            _db.commit()
+
+        cursor = _db.connection().connection.cursor()
+        mask_dict = _select_ids(cursor, db_mod.Mask.__tablename__)
+        pharmacy_dict = _select_ids(cursor, db_mod.Pharmacy.__tablename__)
+
+        def load_pharmacies(_cursor, batch):
+            pharmacy_dict.update(_load_pharmacy_batch(
+                _cursor, *parse_pharmacies(batch), mask_dict
+            ))
+
+        def load_users(_cursor, batch):
+            _load_user_batch(_cursor, *parse_users(batch), pharmacy_dict,
+                             mask_dict)
+
+        _load_checkpointed_batches(_db, pharmacies_path, batch_size,
+                                   load_pharmacies)
+        _load_checkpointed_batches(_db, users_path, batch_size, load_users)
+    except Exception as e:
+        _db.rollback()
+        raise e
+    finally:
+        _db.close()
+
+
+STAGING_SCHEMA = 'etl_staging'
+RETIRED_SCHEMA = 'etl_retired'
+SHADOW_MODELS = [db_mod.Pharmacy, db_mod.Mask, db_mod.User,
+                 db_mod.PharmacyHour, db_mod.PharmacyOpenInterval,
+                 db_mod.PharmacyMask, db_mod.Transaction, db_mod.EtlRecord,
+                 *transaction_crud.DAILY_ROLLUPS.values()]
+
+
+def _create_staging_tables(staging_engine):
+    """
+    Recreate the staging schema with empty copies of the shadowed tables.
+
+    Only the tables themselves are created; their indexes are built after
+    the load.
+    """
+    with staging_engine.begin() as connection:
+        connection.execute(
+            text(f'DROP SCHEMA IF EXISTS {STAGING_SCHEMA} CASCADE'))
+        connection.execute(text(f'CREATE SCHEMA {STAGING_SCHEMA}'))
+        for model in SHADOW_MODELS:
+            connection.execute(CreateTable(model.__table__))
+        connection.execute(text(
+            f'CREATE TABLE {STAGING_SCHEMA}.{transaction_crud.DEFAULT_PARTITION} '
+            f'PARTITION OF {STAGING_SCHEMA}.{transaction_crud.TRANSACTIONS} '
+            f'DEFAULT'))
+
+
+def _create_staging_partitions(staging_engine, live_schema: str):
+    """
+    Move the staged transactions out of the default partition into monthly
+    partitions, before their indexes are built.
+    """
+    with staging_engine.begin() as connection:
+        connection.execute(text(
+            f'SET LOCAL search_path TO {STAGING_SCHEMA}, {live_schema}'))
+        transaction_crud.create_partitions(Session(bind=connection),
+                                           TRANSACTION_PARTITION_MONTHS_AHEAD)
+
+
+def _fill_staging_rollups(staging_engine):
+    """
+    Compute the daily rollups of the staged transactions, so that they are
+    swapped in together.
+    """
+    with staging_engine.begin() as connection:
+        transaction_crud.fill_daily_rollups(Session(bind=connection))
+
+
+def _partitions(connection, schema: str, table: str):
+    """
+    List the partitions of a table, if it is partitioned.
+    """
+    return connection.execute(text(
+        'SELECT relname FROM pg_inherits '
+        'JOIN pg_class ON pg_class.oid = inhrelid '
+        'WHERE inhparent = CAST(:table AS regclass)'
+    ), {'table': f'{schema}.{table}'}).scalars().all()
+
+
+def _build_staging_indexes(staging_engine):
+    """
+    Build the indexes of the staging tables and refresh their statistics.
+    """
+    with staging_engine.begin() as connection:
+        for model in SHADOW_MODELS:
+            for index in model.__table__.indexes:
+                connection.execute(CreateIndex(index))
+            connection.execute(
+                text(f'ANALYZE {STAGING_SCHEMA}.{model.__tablename__}'))
+
+
+def _check_staging_tables(connection, live_schema: str, min_ratio: float):
+    """
+    Refuse to swap when a core staging table is empty or has shrunk below
+    ``min_ratio`` of the live row count, which usually means a truncated
+    source file.
+    """
+    for model in (db_mod.Pharmacy, db_mod.Mask, db_mod.User,
+                  db_mod.Transaction):
+        table = model.__tablename__
+        staged = connection.execute(
+            text(f'SELECT count(*) FROM {STAGING_SCHEMA}.{table}')).scalar()
+        live = connection.execute(
+            text(f'SELECT count(*) FROM {live_schema}.{table}')).scalar()
+        if staged == 0 or staged < live * min_ratio:
+            raise RuntimeError(
+                f'Sanity check failed for {table}: {staged} staged rows, '
+                f'{live} live rows'
+            )
+
+
+def _swap_staging_tables(connection, live_schema: str, lock_timeout: str):
+    """
+    Move the live tables out and the staging tables in, drop the cached
+    reports and bump the rollup version.
+
+    Moving a table to another schema only renames it in the catalog, so this
+    holds its locks for a moment regardless of table size. Indexes,
+    constraints and owned sequences move along with their tables.
+    """
+    connection.execute(text(f"SET LOCAL lock_timeout = '{lock_timeout}'"))
+    # The cached reports and the rollup version describe the live
+    # transactions, so they change in the same transaction as them.
+    session = Session(bind=connection)
+    report_cache_crud.invalidate_all(session)
+    transaction_crud.bump_rollup_version(session)
+    connection.execute(text(f'DROP SCHEMA IF EXISTS {RETIRED_SCHEMA} CASCADE'))
+    connection.execute(text(f'CREATE SCHEMA {RETIRED_SCHEMA}'))
+    for model in SHADOW_MODELS:
+        table = model.__tablename__
+        for schema, target in ((live_schema, RETIRED_SCHEMA),
+                               (STAGING_SCHEMA, live_schema)):
+            # Partitions stay attached but move schema on their own.
+            for name in [table, *_partitions(connection, schema, table)]:
+                connection.execute(text(
+                    f'ALTER TABLE {schema}.{name} SET SCHEMA {target}'))
+
+
+def shadow_insert_data(
+        _db: Session,
+        pharmacies_path: str,
+        users_path: str,
+        batch_size: int = 1000,
+        min_ratio: float = 0.5,
+        lock_timeout: str = '5s'
+):
+    """
+    Load both files into staging tables and swap them in atomically, so
+    readers never see partial data or wait behind the bulk load.
+
+    The staging tables live in their own schema with the same names as the
+    live ones and are filled by the streaming loader, which also records
+    the hashes later incremental runs compare against, with the daily
+    rollups computed from the staged transactions. Their indexes are built
+    afterwards and sanity checks run before the swap. The swap then moves
+    the live tables out and the staging tables in and drops the cached
+    reports, all inside one short transaction. The previous data is dropped
+    after the swap commits.
+    """
+    engine = _db.get_bind()
+    staging_engine = engine.execution_options(
+        schema_translate_map={None: STAGING_SCHEMA})
+    try:
+        _create_staging_tables(staging_engine)
+
+        # The loader uses unqualified table names, so point its transaction
+        # at the staging schema; functions still resolve in the live one.
+        live_schema = _db.execute(text('SELECT current_schema()')).scalar()
+        _db.execute(text(
+            f'SET LOCAL search_path TO {STAGING_SCHEMA}, {live_schema}'))
+        stream_insert_data(_db, pharmacies_path, users_path, batch_size,
+                           record_hashes=True)
+
+        _create_staging_partitions(staging_engine, live_schema)
+        _fill_staging_rollups(staging_engine)
+        _build_staging_indexes(staging_engine)
+        with engine.begin() as connection:
+            _check_staging_tables(connection, live_schema, min_ratio)
+            _swap_staging_tables(connection, live_schema, lock_timeout)
+    finally:
+        with engine.begin() as connection:
+            connection.execute(
+                text(f'DROP SCHEMA IF EXISTS {RETIRED_SCHEMA} CASCADE'))
+            connection.execute(
+                text(f'DROP SCHEMA IF EXISTS {STAGING_SCHEMA} CASCADE'))
+
+
+def run(db, bulk=False, stream=False, batch_size=1000, workers=1,
+        incremental=False, shadow=False, checkpoint=False, resume=False,
+        force=False):
     current_dir = os.path.dirname(os.path.abspath(__file__))
     pharmacies_path = os.path.join(current_dir, 'data/pharmacies.json')
+    users_path = os.path.join(current_dir, 'data/users.json')
+    if checkpoint or resume:
+        resumable_insert_data(db, pharmacies_path, users_path, batch_size,
+                              resume)
+        return
+
+    if shadow:
+        shadow_insert_data(db, pharmacies_path, users_path, batch_size)
+        return
+
+    if incremental:
+        return incremental_insert_data(db, pharmacies_path, users_path,
+                                       batch_size, force)
+
+    if workers > 1:
+        parallel_insert_data(db, pharmacies_path, users_path, workers,
+                             batch_size)
+        return
+
+    if stream:
+        stream_insert_data(db, pharmacies_path, users_path, batch_size)
+        return
+
     pharmacy_raw = load_data(pharmacies_path)
     pharmacies, pharmacy_hours, masks, prices = parse_pharmacies(pharmacy_raw)
 
-    users_path = os.path.join(current_dir, 'data/users.json')
     user_raw = load_data(users_path)
     users, transactions = parse_users(user_raw)
 
-    insert_data(db, pharmacies, pharmacy_hours, masks, prices, users,
-                transactions)
+    loader = bulk_insert_data if bulk else insert_data
+    loader(db, pharmacies, pharmacy_hours, masks, prices, users, transactions)
 
 
 if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(
+        description='Load data/pharmacies.json and data/users.json into the '
+                    'database.'
+    )
+    arg_parser.add_argument(
+        '--bulk', action='store_true',
+        help='Load with COPY and multi-row INSERT instead of the ORM.'
+    )
+    arg_parser.add_argument(
+        '--stream', action='store_true',
+        help='Read the data files incrementally and load them in batches '
+             'with the bulk loader, keeping memory flat.'
+    )
+    arg_parser.add_argument(
+        '--batch-size', type=int, default=1000,
+        help='Number of source records per batch when streaming.'
+    )
+    arg_parser.add_argument(
+        '--workers', type=int, default=1,
+        help='Parse and load in this many processes, each with its own '
+             'database connection. Implies streaming and the bulk loader.'
+    )
+    arg_parser.add_argument(
+        '--incremental', action='store_true',
+        help='Only load records that are new or changed since the previous '
+             'incremental run, and report the counts per table.'
+    )
+    arg_parser.add_argument(
+        '--force', action='store_true',
+        help='With --incremental, load even though the existing transactions '
+             'were not loaded by an incremental or shadow run.'
+    )
+    arg_parser.add_argument(
+        '--shadow', action='store_true',
+        help='Stream into staging tables, index and check them, then swap '
+             'them in atomically so readers never see a partial load.'
+    )
+    arg_parser.add_argument(
+        '--checkpoint', action='store_true',
+        help='Stream and commit every batch together with a checkpoint, so '
+             'an interrupted load can be resumed.'
+    )
+    arg_parser.add_argument(
+        '--resume', action='store_true',
+        help='Continue a --checkpoint load after its last committed batch.'
+    )
+    args = arg_parser.parse_args()
+
     db: Session = SessionLocal()
-    run(db)
+    last_transaction_id = transaction_crud.get_last_transaction_id(db)
+    db.close()
+    stats = run(db, bulk=args.bulk, stream=args.stream,
+                batch_size=args.batch_size, workers=args.workers,
+                incremental=args.incremental, shadow=args.shadow,
+                checkpoint=args.checkpoint, resume=args.resume,
+                force=args.force)
+    # Transactions are loaded around the API, so move those that landed in
+    # the default partition to monthly ones and recount the daily rollups
+    # of the days loaded. A shadow load swapped its own rollups in.
+    transaction_crud.create_partitions(db, TRANSACTION_PARTITION_MONTHS_AHEAD)
+    if not args.shadow:
+        transaction_crud.rebuild_daily_rollups(
+            db, transaction_crud.get_days_after(db, last_transaction_id))
+    if MaskCountBackend(MASK_COUNT_BACKEND) == MaskCountBackend.SNAPSHOT:
+        # The API workers map the new file on their next count.
+        build_price_snapshot(db, PRICE_SNAPSHOT_PATH)
+    db.close()
+    for table, counts in (stats or {}).items():
+        print(f"{table}: {counts['inserted']} inserted, "
+              f"{counts['updated']} updated, "
+              f"{counts['unchanged']} unchanged")
@@ -6,6 +6,7 @@ from sqlalchemy import pool
 from alembic import context
 
 from config.config import DATABASE_URL
+from api.crud import transaction_crud
 from api.database import db_models
 
 # this is the Alembic Config object, which provides
@@ -24,6 +25,16 @@ if config.config_file_name is not None:
 # from myapp import mymodel
 target_metadata = db_models.Base.metadata
 
+
+def include_object(obj, name, type_, reflected, compare_to):
+    """
+    Leave the transactions partitions out of autogenerate; they are created
+    at runtime and have no model.
+    """
+    return not (type_ == 'table' and reflected
+                and transaction_crud.is_partition(name))
+
+
 # other values from the config, defined by the needs of env.py,
 # can be acquired:
 # my_important_option = config.get_main_option("my_important_option")
@@ -48,6 +59,7 @@ def run_migrations_offline() -> None:
         target_metadata=target_metadata,
         literal_binds=True,
         dialect_opts={"paramstyle": "named"},
+        include_object=include_object,
     )
 
     with context.begin_transaction():
@@ -61,6 +73,12 @@ def run_migrations_online() -> None:
     and associate a connection with the context.
 
     """
+    # A caller such as the migration tests may pass its own connection.
+    connection = config.attributes.get('connection')
+    if connection is not None:
+        _run_migrations(connection)
+        return
+
     connectable = engine_from_config(
         config.get_section(config.config_ini_section, {}),
         prefix="sqlalchemy.",
@@ -68,12 +86,17 @@ def run_migrations_online() -> None:
     )
 
     with connectable.connect() as connection:
-        context.configure(
-            connection=connection, target_metadata=target_metadata
-        )
+        _run_migrations(connection)
 
-        with context.begin_transaction():
-            context.run_migrations()
+
+def _run_migrations(connection) -> None:
+    context.configure(
+        connection=connection, target_metadata=target_metadata,
+        include_object=include_object
+    )
+
+    with context.begin_transaction():
+        context.run_migrations()
 
 
 if context.is_offline_mode():
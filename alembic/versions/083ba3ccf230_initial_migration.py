@@ -20,11 +20,100 @@ depends_on: Union[str, Sequence[str], None] = None
 
 def upgrade() -> None:
     # ### commands auto generated by Alembic - please adjust! ###
-    pass
+    op.create_table(
+        'masks',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_masks_id'), 'masks', ['id'], unique=False)
+    op.create_index(op.f('ix_masks_name'), 'masks', ['name'], unique=False)
+    op.create_table(
+        'pharmacies',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(), nullable=False),
+        sa.Column('cash_balance', sa.Numeric(precision=10, scale=2),
+                  nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_pharmacies_id'), 'pharmacies', ['id'],
+                    unique=False)
+    op.create_index(op.f('ix_pharmacies_name'), 'pharmacies', ['name'],
+                    unique=False)
+    op.create_table(
+        'users',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(), nullable=False),
+        sa.Column('cash_balance', sa.Numeric(precision=10, scale=2),
+                  nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_users_id'), 'users', ['id'], unique=False)
+    op.create_index(op.f('ix_users_name'), 'users', ['name'], unique=False)
+    op.create_table(
+        'pharmacy_hours',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('pharmacy_id', sa.Integer(), nullable=True),
+        sa.Column('day_of_week', sa.String(length=10), nullable=False),
+        sa.Column('open_time', sa.Time(), nullable=False),
+        sa.Column('close_time', sa.Time(), nullable=False),
+        sa.ForeignKeyConstraint(['pharmacy_id'], ['pharmacies.id']),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_pharmacy_hours_id'), 'pharmacy_hours', ['id'],
+                    unique=False)
+    op.create_index(op.f('ix_pharmacy_hours_pharmacy_id'), 'pharmacy_hours',
+                    ['pharmacy_id'], unique=False)
+    op.create_table(
+        'pharmacy_masks',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('pharmacy_id', sa.Integer(), nullable=True),
+        sa.Column('mask_id', sa.Integer(), nullable=True),
+        sa.Column('price', sa.Numeric(precision=10, scale=2),
+                  nullable=False),
+        sa.ForeignKeyConstraint(['mask_id'], ['masks.id']),
+        sa.ForeignKeyConstraint(['pharmacy_id'], ['pharmacies.id']),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_pharmacy_masks_id'), 'pharmacy_masks', ['id'],
+                    unique=False)
+    op.create_index(op.f('ix_pharmacy_masks_mask_id'), 'pharmacy_masks',
+                    ['mask_id'], unique=False)
+    op.create_index(op.f('ix_pharmacy_masks_pharmacy_id'), 'pharmacy_masks',
+                    ['pharmacy_id'], unique=False)
+    op.create_table(
+        'transactions',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('pharmacy_id', sa.Integer(), nullable=False),
+        sa.Column('mask_id', sa.Integer(), nullable=False),
+        sa.Column('transaction_amount', sa.Numeric(precision=10, scale=2),
+                  nullable=False),
+        sa.Column('date', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['mask_id'], ['masks.id']),
+        sa.ForeignKeyConstraint(['pharmacy_id'], ['pharmacies.id']),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id']),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_transactions_date'), 'transactions', ['date'],
+                    unique=False)
+    op.create_index(op.f('ix_transactions_id'), 'transactions', ['id'],
+                    unique=False)
+    op.create_index(op.f('ix_transactions_mask_id'), 'transactions',
+                    ['mask_id'], unique=False)
+    op.create_index(op.f('ix_transactions_pharmacy_id'), 'transactions',
+                    ['pharmacy_id'], unique=False)
+    op.create_index(op.f('ix_transactions_user_id'), 'transactions',
+                    ['user_id'], unique=False)
     # ### end Alembic commands ###
 
 
 def downgrade() -> None:
     # ### commands auto generated by Alembic - please adjust! ###
-    pass
+    op.drop_table('transactions')
+    op.drop_table('pharmacy_masks')
+    op.drop_table('pharmacy_hours')
+    op.drop_table('users')
+    op.drop_table('pharmacies')
+    op.drop_table('masks')
     # ### end Alembic commands ###
@@ -0,0 +1,77 @@
+"""Add pharmacy open intervals
+
+Revision ID: 3f6a9d2c5e18
+Revises: e7d15a3f8b02
+Create Date: 2026-10-18 15:21:09.364470
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f6a9d2c5e18'
+down_revision: Union[str, None] = 'e7d15a3f8b02'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'pharmacy_open_intervals',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('pharmacy_id', sa.Integer(), nullable=False),
+        sa.Column('minutes', postgresql.INT4RANGE(), nullable=False),
+        sa.ForeignKeyConstraint(['pharmacy_id'], ['pharmacies.id']),
+        sa.PrimaryKeyConstraint('id')
+    )
+
+    # Same spans as api.utils.tools.week_minute_ranges: the close time is
+    # included, an earlier close time is on the next day and a span running
+    # past Sunday midnight continues from Monday 00:00.
+    op.execute("""
+        WITH hours AS (
+            SELECT pharmacy_id,
+                   (array_position(
+                       ARRAY['Mon', 'Tue', 'Wed', 'Thur', 'Fri', 'Sat', 'Sun'],
+                       day_of_week::text) - 1) * 1440
+                   + extract(hour FROM open_time)::int * 60
+                   + extract(minute FROM open_time)::int AS start,
+                   extract(hour FROM open_time)::int * 60
+                   + extract(minute FROM open_time)::int AS open_minute,
+                   extract(hour FROM close_time)::int * 60
+                   + extract(minute FROM close_time)::int AS close_minute
+            FROM pharmacy_hours
+        ), spans AS (
+            SELECT pharmacy_id, start,
+                   start + (close_minute - open_minute + 1440) % 1440 + 1
+                       AS stop
+            FROM hours
+        )
+        INSERT INTO pharmacy_open_intervals (pharmacy_id, minutes)
+        SELECT pharmacy_id, int4range(start, least(stop, 10080)) FROM spans
+        UNION ALL
+        SELECT pharmacy_id, int4range(0, stop - 10080) FROM spans
+        WHERE stop > 10080
+    """)
+
+    op.create_index('ix_pharmacy_open_intervals_id',
+                    'pharmacy_open_intervals', ['id'])
+    op.create_index('ix_pharmacy_open_intervals_pharmacy_id',
+                    'pharmacy_open_intervals', ['pharmacy_id'])
+    op.create_index('ix_pharmacy_open_intervals_minutes',
+                    'pharmacy_open_intervals', ['minutes'],
+                    postgresql_using='gist')
+
+
+def downgrade() -> None:
+    op.drop_index('ix_pharmacy_open_intervals_minutes',
+                  table_name='pharmacy_open_intervals')
+    op.drop_index('ix_pharmacy_open_intervals_pharmacy_id',
+                  table_name='pharmacy_open_intervals')
+    op.drop_index('ix_pharmacy_open_intervals_id',
+                  table_name='pharmacy_open_intervals')
+    op.drop_table('pharmacy_open_intervals')
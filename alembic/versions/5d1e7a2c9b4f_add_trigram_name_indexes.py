@@ -0,0 +1,39 @@
+"""Add trigram name indexes
+
+Revision ID: 5d1e7a2c9b4f
+Revises: 083ba3ccf230
+Create Date: 2026-10-18 10:12:41.503118
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5d1e7a2c9b4f'
+down_revision: Union[str, None] = '083ba3ccf230'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    # Build without blocking writes to the searched tables.
+    with op.get_context().autocommit_block():
+        op.create_index('ix_pharmacies_name_trgm', 'pharmacies', ['name'],
+                        postgresql_using='gin',
+                        postgresql_ops={'name': 'gin_trgm_ops'},
+                        postgresql_concurrently=True, if_not_exists=True)
+        op.create_index('ix_masks_name_trgm', 'masks', ['name'],
+                        postgresql_using='gin',
+                        postgresql_ops={'name': 'gin_trgm_ops'},
+                        postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_masks_name_trgm', table_name='masks',
+                      postgresql_concurrently=True, if_exists=True)
+        op.drop_index('ix_pharmacies_name_trgm', table_name='pharmacies',
+                      postgresql_concurrently=True, if_exists=True)
@@ -0,0 +1,79 @@
+"""Add covering indexes and unique pharmacy masks
+
+Revision ID: 6d2a8e4b1f97
+Revises: b81c4f0a7d53
+Create Date: 2026-10-18 17:25:10.738264
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '6d2a8e4b1f97'
+down_revision: Union[str, None] = 'b81c4f0a7d53'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Each index answers one range query from the index alone: the mask counts
+# per pharmacy in a price range, the amounts per user and the counts and
+# amounts per mask in a date range. (pharmacy_id, price) is already served
+# by ix_pharmacy_masks_pharmacy_price_id.
+INDEXES = [
+    ('ix_pharmacy_masks_price_pharmacy', 'pharmacy_masks',
+     ['price', 'pharmacy_id'], []),
+    ('ix_transactions_date_user_amount', 'transactions',
+     ['date', 'user_id', 'transaction_amount'], []),
+    ('ix_transactions_date_mask', 'transactions',
+     ['date', 'mask_id'], ['transaction_amount']),
+]
+UNIQUE_PHARMACY_MASK = 'uq_pharmacy_masks_pharmacy_mask'
+# Prefixes of the indexes above and of the unique constraint.
+SUPERSEDED = [
+    ('ix_pharmacy_masks_pharmacy_id', 'pharmacy_masks', 'pharmacy_id'),
+    ('ix_transactions_date', 'transactions', 'date'),
+]
+
+
+def upgrade() -> None:
+    duplicates = op.get_bind().execute(sa.text(
+        'SELECT count(*) FROM (SELECT 1 FROM pharmacy_masks '
+        'GROUP BY pharmacy_id, mask_id HAVING count(*) > 1) AS duplicates'
+    )).scalar()
+    if duplicates:
+        raise RuntimeError(
+            f'pharmacy_masks has {duplicates} masks priced more than once '
+            f'by the same pharmacy; remove them before upgrading')
+
+    with op.get_context().autocommit_block():
+        for name, table, columns, include in INDEXES:
+            op.create_index(name, table, columns,
+                            postgresql_include=include,
+                            postgresql_concurrently=True, if_not_exists=True)
+        # Build the unique index without blocking writes, then attach the
+        # constraint to it, which only takes a brief lock.
+        op.create_index(UNIQUE_PHARMACY_MASK, 'pharmacy_masks',
+                        ['pharmacy_id', 'mask_id'], unique=True,
+                        postgresql_concurrently=True, if_not_exists=True)
+    op.execute(f'ALTER TABLE pharmacy_masks ADD CONSTRAINT '
+               f'{UNIQUE_PHARMACY_MASK} UNIQUE USING INDEX '
+               f'{UNIQUE_PHARMACY_MASK}')
+    with op.get_context().autocommit_block():
+        for name, table, _ in SUPERSEDED:
+            op.drop_index(name, table_name=table,
+                          postgresql_concurrently=True, if_exists=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, table, column in SUPERSEDED:
+            op.create_index(name, table, [column],
+                            postgresql_concurrently=True, if_not_exists=True)
+    op.drop_constraint(UNIQUE_PHARMACY_MASK, 'pharmacy_masks',
+                       type_='unique')
+    with op.get_context().autocommit_block():
+        for name, table, _, _ in reversed(INDEXES):
+            op.drop_index(name, table_name=table,
+                          postgresql_concurrently=True, if_exists=True)
@@ -0,0 +1,37 @@
+"""Add name prefix indexes
+
+Revision ID: 9a3f0c6e1d27
+Revises: 5d1e7a2c9b4f
+Create Date: 2026-10-18 11:02:17.284930
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9a3f0c6e1d27'
+down_revision: Union[str, None] = '5d1e7a2c9b4f'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # "C" collation lets the btree serve LIKE 'prefix%' and name ordering.
+    with op.get_context().autocommit_block():
+        op.create_index('ix_pharmacies_name_prefix', 'pharmacies',
+                        [sa.text('lower(name) COLLATE "C"')],
+                        postgresql_concurrently=True, if_not_exists=True)
+        op.create_index('ix_masks_name_prefix', 'masks',
+                        [sa.text('lower(name) COLLATE "C"')],
+                        postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_masks_name_prefix', table_name='masks',
+                      postgresql_concurrently=True, if_exists=True)
+        op.drop_index('ix_pharmacies_name_prefix', table_name='pharmacies',
+                      postgresql_concurrently=True, if_exists=True)
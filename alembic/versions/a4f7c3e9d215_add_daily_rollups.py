@@ -0,0 +1,53 @@
+"""Add daily transaction rollups
+
+Revision ID: a4f7c3e9d215
+Revises: 6d2a8e4b1f97
+Create Date: 2026-10-18 18:40:27.615092
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a4f7c3e9d215'
+down_revision: Union[str, None] = '6d2a8e4b1f97'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Rollup table and the transactions column it groups by.
+ROLLUPS = [
+    ('mask_daily_rollups', 'mask_id'),
+    ('user_daily_rollups', 'user_id'),
+    ('pharmacy_daily_rollups', 'pharmacy_id'),
+]
+
+
+def upgrade() -> None:
+    for table, key in ROLLUPS:
+        op.create_table(
+            table,
+            sa.Column('day', sa.Date(), nullable=False),
+            sa.Column(key, sa.Integer(), nullable=False),
+            sa.Column('transaction_count', sa.Integer(), nullable=False),
+            sa.Column('total_amount', sa.Numeric(precision=14, scale=2),
+                      nullable=False),
+            sa.PrimaryKeyConstraint('day', key)
+        )
+
+    # Same rows as api.crud.transaction_crud.rebuild_daily_rollups.
+    op.execute('LOCK TABLE transactions IN SHARE MODE')
+    for table, key in ROLLUPS:
+        op.execute(f"""
+            INSERT INTO {table} (day, {key}, transaction_count, total_amount)
+            SELECT date::date, {key}, count(*), sum(transaction_amount)
+            FROM transactions
+            GROUP BY date::date, {key}
+        """)
+
+
+def downgrade() -> None:
+    for table, _ in reversed(ROLLUPS):
+        op.drop_table(table)
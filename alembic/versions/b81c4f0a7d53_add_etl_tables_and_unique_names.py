@@ -0,0 +1,88 @@
+"""Add ETL tables and unique names
+
+Revision ID: b81c4f0a7d53
+Revises: 3f6a9d2c5e18
+Create Date: 2026-10-18 17:02:44.190527
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b81c4f0a7d53'
+down_revision: Union[str, None] = '3f6a9d2c5e18'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Incremental ETL runs upsert pharmacies, masks and users on their names.
+NAMED_TABLES = ['pharmacies', 'masks', 'users']
+
+
+def _replace_name_index(table: str, unique: bool):
+    """
+    Rebuild ix_<table>_name without blocking writes: build the new index
+    under a temporary name, drop the old one and take over its name.
+    """
+    name = f'ix_{table}_name'
+    op.create_index(f'{name}_new', table, ['name'], unique=unique,
+                    postgresql_concurrently=True, if_not_exists=True)
+    op.drop_index(name, table_name=table, postgresql_concurrently=True,
+                  if_exists=True)
+    op.execute(f'ALTER INDEX {name}_new RENAME TO {name}')
+
+
+def _create_etl_records():
+    op.create_table(
+        'etl_records',
+        sa.Column('kind', sa.String(length=20), nullable=False),
+        sa.Column('source_key', sa.String(), nullable=False),
+        sa.Column('record_hash', sa.String(length=40), nullable=False),
+        sa.PrimaryKeyConstraint('kind', 'source_key')
+    )
+
+
+def _create_etl_checkpoints():
+    op.create_table(
+        'etl_checkpoints',
+        sa.Column('source_file', sa.String(), nullable=False),
+        sa.Column('record_index', sa.Integer(), nullable=False),
+        sa.Column('batch_id', sa.Integer(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('source_file')
+    )
+
+
+def upgrade() -> None:
+    # Databases set up before these migrations already have the ETL tables
+    # from Base.metadata.create_all.
+    existing = sa.inspect(op.get_bind()).get_table_names()
+    if 'etl_records' not in existing:
+        _create_etl_records()
+    if 'etl_checkpoints' not in existing:
+        _create_etl_checkpoints()
+
+    connection = op.get_bind()
+    for table in NAMED_TABLES:
+        duplicates = connection.execute(sa.text(
+            f'SELECT count(*) FROM (SELECT name FROM {table} '
+            f'GROUP BY name HAVING count(*) > 1) AS duplicates'
+        )).scalar()
+        if duplicates:
+            raise RuntimeError(
+                f'{table} has {duplicates} duplicated names; merge them '
+                f'before upgrading')
+
+    with op.get_context().autocommit_block():
+        for table in NAMED_TABLES:
+            _replace_name_index(table, unique=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for table in reversed(NAMED_TABLES):
+            _replace_name_index(table, unique=False)
+    op.drop_table('etl_checkpoints')
+    op.drop_table('etl_records')
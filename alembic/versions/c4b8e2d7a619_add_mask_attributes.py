@@ -0,0 +1,68 @@
+"""Add mask attributes and unit prices
+
+Revision ID: c4b8e2d7a619
+Revises: 9a3f0c6e1d27
+Create Date: 2026-10-18 11:48:52.917304
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c4b8e2d7a619'
+down_revision: Union[str, None] = '9a3f0c6e1d27'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('masks', sa.Column('brand', sa.String(), nullable=True))
+    op.add_column('masks', sa.Column('color', sa.String(), nullable=True))
+    op.add_column('masks', sa.Column('pack_size', sa.Integer(),
+                                     nullable=True))
+    op.add_column('pharmacy_masks', sa.Column('unit_price',
+                                              sa.Numeric(10, 4),
+                                              nullable=True))
+
+    # Same pattern as api.utils.tools.MASK_NAME_PATTERN.
+    op.execute(r"""
+        UPDATE masks
+        SET brand = parts[1], color = parts[2], pack_size = parts[3]::int
+        FROM (
+            SELECT id, regexp_match(
+                name, '^(.+?) \(([^()]+)\) \((\d+) per pack\)$') AS parts
+            FROM masks
+        ) AS parsed
+        WHERE masks.id = parsed.id AND parsed.parts IS NOT NULL
+    """)
+    op.execute("""
+        UPDATE pharmacy_masks
+        SET unit_price = round(pharmacy_masks.price / masks.pack_size, 4)
+        FROM masks
+        WHERE masks.id = pharmacy_masks.mask_id AND masks.pack_size > 0
+    """)
+
+    with op.get_context().autocommit_block():
+        for column in ('brand', 'color', 'pack_size'):
+            op.create_index(f'ix_masks_{column}', 'masks', [column],
+                            postgresql_concurrently=True, if_not_exists=True)
+        op.create_index('ix_pharmacy_masks_pharmacy_unit_price',
+                        'pharmacy_masks', ['pharmacy_id', 'unit_price'],
+                        postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_pharmacy_masks_pharmacy_unit_price',
+                      table_name='pharmacy_masks',
+                      postgresql_concurrently=True, if_exists=True)
+        for column in ('pack_size', 'color', 'brand'):
+            op.drop_index(f'ix_masks_{column}', table_name='masks',
+                          postgresql_concurrently=True, if_exists=True)
+    op.drop_column('pharmacy_masks', 'unit_price')
+    op.drop_column('masks', 'pack_size')
+    op.drop_column('masks', 'color')
+    op.drop_column('masks', 'brand')
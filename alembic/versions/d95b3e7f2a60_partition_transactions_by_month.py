@@ -0,0 +1,185 @@
+"""Partition transactions by month
+
+Revision ID: d95b3e7f2a60
+Revises: a4f7c3e9d215
+Create Date: 2026-10-18 20:12:48.301957
+
+"""
+from datetime import date
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd95b3e7f2a60'
+down_revision: Union[str, None] = 'a4f7c3e9d215'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+COPY = 'transactions_copy'
+LEGACY = 'transactions_legacy'
+COLUMNS = ['id', 'user_id', 'pharmacy_id', 'mask_id', 'transaction_amount',
+           'date']
+INDEXES = [
+    ('ix_transactions_id', ['id'], []),
+    ('ix_transactions_user_id', ['user_id'], []),
+    ('ix_transactions_pharmacy_id', ['pharmacy_id'], []),
+    ('ix_transactions_mask_id', ['mask_id'], []),
+    ('ix_transactions_date_user_amount',
+     ['date', 'user_id', 'transaction_amount'], []),
+    ('ix_transactions_date_mask', ['date', 'mask_id'],
+     ['transaction_amount']),
+]
+# Months created past the current one; the app creates later ones as it
+# starts.
+MONTHS_AHEAD = 3
+
+
+def _next_month(month: date) -> date:
+    return date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def _months_ahead():
+    """
+    List the current month and those just after it.
+    """
+    months = [date.today().replace(day=1)]
+    for _ in range(MONTHS_AHEAD):
+        months.append(_next_month(months[-1]))
+    return months
+
+
+def _months():
+    """
+    List the months holding transactions, and the current month and those
+    just after it.
+    """
+    months = set(op.get_bind().execute(sa.text(
+        "SELECT DISTINCT CAST(date_trunc('month', date) AS date) "
+        "FROM transactions")).scalars())
+    return sorted(months.union(_months_ahead()))
+
+
+def _create_table(name: str, partitioned: bool):
+    """
+    Create an empty transactions table, partitioned by month or not.
+    """
+    primary_key = ['id', 'date'] if partitioned else ['id']
+    op.create_table(
+        name,
+        sa.Column('id', sa.Integer(), nullable=False, server_default=sa.text(
+            "nextval('transactions_id_seq'::regclass)")),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('pharmacy_id', sa.Integer(), nullable=False),
+        sa.Column('mask_id', sa.Integer(), nullable=False),
+        sa.Column('transaction_amount', sa.Numeric(precision=10, scale=2),
+                  nullable=False),
+        sa.Column('date', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['mask_id'], ['masks.id'],
+                                name='transactions_mask_id_fkey'),
+        sa.ForeignKeyConstraint(['pharmacy_id'], ['pharmacies.id'],
+                                name='transactions_pharmacy_id_fkey'),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'],
+                                name='transactions_user_id_fkey'),
+        sa.PrimaryKeyConstraint(*primary_key, name=f'{name}_pkey'),
+        **({'postgresql_partition_by': 'RANGE (date)'} if partitioned
+           else {})
+    )
+
+
+def _create_partitions(table: str, months):
+    op.execute(f'CREATE TABLE transactions_default PARTITION OF {table} '
+               f'DEFAULT')
+    for month in months:
+        op.execute(
+            f"CREATE TABLE transactions_y{month.year}m{month.month:02d} "
+            f"PARTITION OF {table} FOR VALUES FROM ('{month}') "
+            f"TO ('{_next_month(month)}')")
+
+
+def _replace_table(partitioned: bool):
+    """
+    Copy transactions into a new table, partitioned by month or not, and
+    put it in the place of the old one with the same sequence and indexes.
+
+    The copy rewrites the whole table under an exclusive lock.
+    """
+    op.execute('LOCK TABLE transactions IN ACCESS EXCLUSIVE MODE')
+    _create_table(COPY, partitioned)
+    if partitioned:
+        _create_partitions(COPY, _months())
+
+    columns = ', '.join(COLUMNS)
+    op.execute(f'INSERT INTO {COPY} ({columns}) '
+               f'SELECT {columns} FROM transactions')
+    op.execute(f'ALTER SEQUENCE transactions_id_seq OWNED BY {COPY}.id')
+    op.drop_table('transactions')
+    op.rename_table(COPY, 'transactions')
+    op.execute(f'ALTER TABLE transactions '
+               f'RENAME CONSTRAINT {COPY}_pkey TO transactions_pkey')
+    # Indexes on a partitioned table are built on every partition.
+    for name, columns, include in INDEXES:
+        op.create_index(name, 'transactions', columns,
+                        postgresql_include=include)
+
+
+def _attach_legacy(end: date):
+    """
+    Put a partitioned table in the place of transactions, with the old
+    table attached as its partition of the dates before ``end``.
+
+    The unique index and the date bound are built and checked while writes
+    go on; the swap itself only changes the catalog, under a brief
+    exclusive lock, and no row is copied.
+    """
+    with op.get_context().autocommit_block():
+        op.create_index(f'{LEGACY}_id_date', 'transactions', ['id', 'date'],
+                        unique=True, postgresql_concurrently=True,
+                        if_not_exists=True)
+        op.execute(f"ALTER TABLE transactions ADD CONSTRAINT {LEGACY}_bounds "
+                   f"CHECK (date < '{end}') NOT VALID")
+        op.execute(f'ALTER TABLE transactions '
+                   f'VALIDATE CONSTRAINT {LEGACY}_bounds')
+
+    op.execute('LOCK TABLE transactions IN ACCESS EXCLUSIVE MODE')
+    op.rename_table('transactions', LEGACY)
+    # The partition's key must match the partitioned table's (id, date).
+    op.execute(f'ALTER TABLE {LEGACY} DROP CONSTRAINT transactions_pkey, '
+               f'ADD CONSTRAINT {LEGACY}_pkey PRIMARY KEY '
+               f'USING INDEX {LEGACY}_id_date')
+    for name, _, _ in INDEXES:
+        op.execute(f'ALTER INDEX {name} RENAME TO '
+                   f"{name.replace('transactions', LEGACY, 1)}")
+
+    _create_table('transactions', partitioned=True)
+    # The validated bound lets Postgres skip scanning the rows.
+    op.execute(f"ALTER TABLE transactions ATTACH PARTITION {LEGACY} "
+               f"FOR VALUES FROM (MINVALUE) TO ('{end}')")
+    op.execute(f'ALTER TABLE {LEGACY} DROP CONSTRAINT {LEGACY}_bounds')
+    _create_partitions('transactions', [month for month in _months_ahead()
+                                        if month >= end])
+    op.execute('ALTER SEQUENCE transactions_id_seq OWNED BY transactions.id')
+    # The legacy partition's indexes are attached rather than rebuilt.
+    for name, columns, include in INDEXES:
+        op.create_index(name, 'transactions', columns,
+                        postgresql_include=include)
+
+
+def upgrade() -> None:
+    last = op.get_bind().execute(sa.text(
+        "SELECT CAST(date_trunc('month', max(date)) AS date) "
+        "FROM transactions")).scalar()
+    if last is None:
+        _replace_table(partitioned=True)
+    else:
+        # Purchases keep coming in until the swap, so the bound leaves
+        # room for the current month.
+        _attach_legacy(_next_month(max(last, date.today().replace(day=1))))
+
+
+def downgrade() -> None:
+    # Partitions detached since the upgrade are left as they are. This
+    # copies the rows back under an exclusive lock.
+    _replace_table(partitioned=False)
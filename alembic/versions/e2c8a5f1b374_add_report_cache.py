@@ -0,0 +1,41 @@
+"""Add report cache
+
+Revision ID: e2c8a5f1b374
+Revises: d95b3e7f2a60
+Create Date: 2026-10-18 21:03:16.552810
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e2c8a5f1b374'
+down_revision: Union[str, None] = 'd95b3e7f2a60'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'report_cache',
+        sa.Column('report', sa.String(length=40), nullable=False),
+        sa.Column('start_date', sa.DateTime(), nullable=False),
+        sa.Column('end_date', sa.DateTime(), nullable=False),
+        sa.Column('params', sa.String(), nullable=False),
+        sa.Column('result', postgresql.JSONB(astext_type=sa.Text()),
+                  nullable=False),
+        sa.Column('expires_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('report', 'start_date', 'end_date', 'params')
+    )
+    op.create_index(op.f('ix_report_cache_expires_at'), 'report_cache',
+                    ['expires_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_report_cache_expires_at'),
+                  table_name='report_cache')
+    op.drop_table('report_cache')
@@ -0,0 +1,47 @@
+"""Add keyset pagination indexes
+
+Revision ID: e7d15a3f8b02
+Revises: c4b8e2d7a619
+Create Date: 2026-10-18 14:06:31.508212
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e7d15a3f8b02'
+down_revision: Union[str, None] = 'c4b8e2d7a619'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# One index per price sort of a pharmacy's masks, ending with the id
+# tie-breaker. The name sorts are served by the unique name indexes.
+INDEXES = [
+    ('ix_pharmacy_masks_pharmacy_price_id', 'pharmacy_masks',
+     ['pharmacy_id', 'price', 'id']),
+    ('ix_pharmacy_masks_pharmacy_unit_price_id', 'pharmacy_masks',
+     ['pharmacy_id', 'unit_price', 'id']),
+]
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            op.create_index(name, table, columns,
+                            postgresql_concurrently=True, if_not_exists=True)
+        # Superseded by the index with the id tie-breaker.
+        op.drop_index('ix_pharmacy_masks_pharmacy_unit_price',
+                      table_name='pharmacy_masks',
+                      postgresql_concurrently=True, if_exists=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index('ix_pharmacy_masks_pharmacy_unit_price',
+                        'pharmacy_masks', ['pharmacy_id', 'unit_price'],
+                        postgresql_concurrently=True, if_not_exists=True)
+        for name, table, _ in reversed(INDEXES):
+            op.drop_index(name, table_name=table,
+                          postgresql_concurrently=True, if_exists=True)
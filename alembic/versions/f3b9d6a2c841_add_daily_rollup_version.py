@@ -0,0 +1,31 @@
+"""Add daily rollup version
+
+Revision ID: f3b9d6a2c841
+Revises: e2c8a5f1b374
+Create Date: 2026-10-18 23:41:07.118402
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f3b9d6a2c841'
+down_revision: Union[str, None] = 'e2c8a5f1b374'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'daily_rollup_version',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('version', sa.BigInteger(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('daily_rollup_version')
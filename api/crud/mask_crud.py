@@ -9,11 +9,26 @@ in the database.
 from sqlalchemy import func, literal
 from sqlalchemy.orm import Session
 
+from api.crud import transaction_crud
 from api.database import db_models as db_mod
 from api.enums import SortType
 from api.schemas import input_schema as in_sch, output_schema as out_sch
+from api.utils.tools import escape_like
+from api.utils.pagination import paginate
 from config.config import SIMILARITY_THRESHOLD
 
+# Sort keys of a pharmacy's masks. The price sorts are served by the
+# (pharmacy_id, price, id) and (pharmacy_id, unit_price, id) indexes.
+PHARMACY_MASK_SORT_KEYS = {
+    SortType.NAME: {'name': db_mod.Mask.name, 'id': db_mod.PharmacyMask.id},
+    SortType.PRICE: {'price': db_mod.PharmacyMask.price,
+                     'id': db_mod.PharmacyMask.id},
+    SortType.UNIT_PRICE: {'unit_price': db_mod.PharmacyMask.unit_price,
+                          'id': db_mod.PharmacyMask.id},
+}
+# Names are unique, so the name index alone serves the sort.
+MASK_SORT_KEYS = {'name': db_mod.Mask.name}
+
 
 def get_mask(db: Session, mask_id: int):
     """
@@ -39,47 +54,93 @@ def list_pharmacy_masks(
         paging: in_sch.PagingParams,
 ):
     """
-    List all masks sold by a given pharmacy, sorted by mask name or price.
+    List all masks sold by a given pharmacy, sorted by mask name, price or
+    price per mask.
     """
     query = (
         db.query(
             db_mod.PharmacyMask.id,
             db_mod.Mask.name,
-            db_mod.PharmacyMask.price
+            db_mod.PharmacyMask.price,
+            db_mod.PharmacyMask.unit_price
         ).filter(
             db_mod.PharmacyMask.pharmacy_id == pharmacy_id
         ).join(db_mod.Mask)
     )
 
-    if sort_by == SortType.NAME:
-        query = query.order_by(db_mod.Mask.name)
-    elif sort_by == SortType.PRICE:
-        query = query.order_by(db_mod.PharmacyMask.price)
+    return paginate(query, PHARMACY_MASK_SORT_KEYS[sort_by], paging)
+
+
+def _filter_masks(query, filters: in_sch.MaskFilterParams):
+    """
+    Restrict a mask query to the given brand, color and pack size.
+    """
+    for column, value in ((db_mod.Mask.brand, filters.brand),
+                          (db_mod.Mask.color, filters.color),
+                          (db_mod.Mask.pack_size, filters.pack_size)):
+        if value is not None:
+            query = query.filter(column == value)
+    return query
+
 
-    return query.offset(paging.skip).limit(paging.limit)
+def list_masks(
+        db: Session,
+        filters: in_sch.MaskFilterParams,
+        paging: in_sch.PagingParams
+):
+    """
+    List the masks matching the attribute filters, sorted by name.
+    """
+    query = _filter_masks(db.query(db_mod.Mask), filters)
+    return paginate(query, MASK_SORT_KEYS, paging)
+
+
+def count_mask_facets(db: Session, filters: in_sch.MaskFilterParams):
+    """
+    Count the masks matching the filters per brand, per color and per pack
+    size, in one query grouped by grouping sets.
+    """
+    attributes = {'brand': db_mod.Mask.brand, 'color': db_mod.Mask.color,
+                  'pack_size': db_mod.Mask.pack_size}
+    query = db.query(
+        *attributes.values(),
+        *(func.grouping(column).label(f'{name}_grouping')
+          for name, column in attributes.items()),
+        func.count(db_mod.Mask.id).label('count')
+    ).group_by(func.grouping_sets(*attributes.values()))
+
+    facets = {name: [] for name in attributes}
+    for row in _filter_masks(query, filters):
+        for name in attributes:
+            value = getattr(row, name)
+            if not getattr(row, f'{name}_grouping') and value is not None:
+                facets[name].append(
+                    out_sch.FacetCount(value=value, count=row.count))
+    for counts in facets.values():
+        counts.sort(key=lambda facet: (-facet.count, str(facet.value)))
+    return out_sch.MaskFacets(**facets)
 
 
 def get_mask_summary(
         db: Session,
-        date_range: in_sch.DateRange
+        date_range: in_sch.DateRange,
+        rollups: bool = True
 ):
     """
     Retrieve the total amount of masks and dollar value of transactions
-    within a date range, grouped by mask.
+    within a date range, grouped by mask. Whole days are read from the
+    daily rollups unless ``rollups`` is off.
     """
+    totals = transaction_crud.daily_totals(db, 'mask_id', date_range,
+                                           rollups)
     result = db.query(
         db_mod.Mask.id.label('mask_id'),
         db_mod.Mask.name.label('mask_name'),
-        func.count(db_mod.Transaction.id).label('mask_count'),
-        func.sum(db_mod.Transaction.transaction_amount).label('total_value')
-    ).filter(
-        db_mod.Transaction.date.between(
-            date_range.start_date,
-            date_range.end_date
-        )
+        totals.c.transaction_count.label('mask_count'),
+        totals.c.total_amount.label('total_value')
     ).join(
-        db_mod.Transaction
-    ).group_by(
+        totals, db_mod.Mask.id == totals.c.key
+    ).order_by(
         db_mod.Mask.id
     ).all()
 
@@ -104,6 +165,27 @@ def search_masks(db: Session, search_term: str, ):
             ).label('similarity'),
             literal("mask").label('type')
         ).filter(
+            # % is served by the trigram index; the similarity check keeps
+            # the threshold strict
+            db_mod.Mask.name.op('%')(search_term),
             func.similarity(db_mod.Mask.name, search_term) > SIMILARITY_THRESHOLD
         )
     )
+
+
+def autocomplete_masks(db: Session, prefix: str, limit: int):
+    """
+    Find masks whose name starts with the prefix, ignoring case, ordered
+    by name in "C" collation so the prefix index serves the lookup.
+    """
+    sort_name = func.lower(db_mod.Mask.name).collate('C')
+    return (
+        db.query(
+            db_mod.Mask.id.label('id'),
+            db_mod.Mask.name.label('name'),
+            literal("mask").label('type'),
+            sort_name.label('sort_name')
+        ).filter(
+            sort_name.like(escape_like(prefix.lower()) + '%')
+        ).order_by(sort_name, db_mod.Mask.id).limit(limit)
+    )
@@ -6,32 +6,70 @@ This module contains CRUD operations for managing pharmacy records
 in the database.
 """
 from datetime import time
+from typing import List, Type
 
-from sqlalchemy import func, and_, literal
+from pydantic import BaseModel
+from sqlalchemy import and_, any_, func, literal, or_
+from sqlalchemy.dialects.postgresql import Range
 from sqlalchemy.orm import Session
 
 import api.database.db_models as db_mod
 from api.enums import DayOfWeek, ComparisonType
-from api.schemas import input_schema as in_sch
+from api.schemas import input_schema as in_sch, output_schema as out_sch
+from api.utils.loading import eager_load
+from api.utils.pagination import Page, encode_cursor, paginate
+from api.utils.tools import (escape_like, is_past_minute, minutes_open_at,
+                             minutes_open_during)
 from config.config import SIMILARITY_THRESHOLD
 
 
-def get_pharmacy(db: Session, pharmacy_id: int):
+# Names are unique, so the name index alone serves the sort.
+PHARMACY_SORT_KEYS = {'name': db_mod.Pharmacy.name}
+
+
+def get_pharmacy(db: Session, pharmacy_id: int,
+                 schema: Type[BaseModel] = out_sch.PharmacyDetail):
     """
-    Retrieve a pharmacy by its ID.
+    Retrieve a pharmacy by its ID, with the relations the schema shows.
     """
     return (
         db.query(db_mod.Pharmacy)
+        .options(*eager_load(db_mod.Pharmacy, schema))
         .filter(db_mod.Pharmacy.id == pharmacy_id)
         .first()
     )
 
 
-def list_pharmacies(db: Session, paging: in_sch.PagingParams):
+def list_pharmacies(db: Session, paging: in_sch.PagingParams,
+                    schema: Type[BaseModel] = out_sch.Pharmacy):
+    """
+    Retrieve a list of pharmacies with pagination, sorted by name, with the
+    relations the schema shows.
+    """
+    query = db.query(db_mod.Pharmacy).options(
+        *eager_load(db_mod.Pharmacy, schema))
+    return paginate(query, PHARMACY_SORT_KEYS, paging)
+
+
+def _has_interval(db: Session, condition):
     """
-    Retrieve a list of pharmacies with pagination.
+    Select the pharmacies having an open interval that matches the
+    condition, which the GiST index on the intervals serves.
     """
-    return db.query(db_mod.Pharmacy).offset(paging.skip).limit(paging.limit)
+    return db_mod.Pharmacy.id.in_(
+        db.query(db_mod.PharmacyOpenInterval.pharmacy_id).filter(
+            condition).scalar_subquery())
+
+
+def _open_at(db: Session, day_of_week: DayOfWeek, at: time):
+    """
+    Select the pharmacies open at a time of a day of the week.
+    """
+    return and_(*(
+        _has_interval(db, db_mod.PharmacyOpenInterval.minutes.contains(
+            Range(first, stop)))
+        for first, stop in minutes_open_at(day_of_week, at)
+    ))
 
 
 def list_pharmacies_open_at(
@@ -39,17 +77,62 @@ def list_pharmacies_open_at(
         query_time: time,
         day_of_week: DayOfWeek,
         paging: in_sch.PagingParams,
+        schema: Type[BaseModel] = out_sch.Pharmacy,
 ):
     """
-    Retrieve pharmacies open at a specific time and day of the week.
+    Retrieve pharmacies open at a specific time and day of the week, sorted
+    by name. A pharmacy is open up to the start of its closing minute.
     """
-    return db.query(db_mod.Pharmacy).join(db_mod.PharmacyHour).filter(
-        and_(
-            db_mod.PharmacyHour.day_of_week == day_of_week,
-            db_mod.PharmacyHour.open_time <= query_time,
-            db_mod.PharmacyHour.close_time >= query_time
-        )
-    ).offset(paging.skip).limit(paging.limit)
+    return _list_pharmacies_open(
+        db, _open_at(db, day_of_week, query_time), paging, schema)
+
+
+def list_pharmacies_open_during(
+        db: Session,
+        day_of_week: DayOfWeek,
+        time_range: in_sch.TimeRange,
+        paging: in_sch.PagingParams,
+        schema: Type[BaseModel] = out_sch.Pharmacy,
+):
+    """
+    Retrieve pharmacies open at any moment between two times of a day of the
+    week, sorted by name. An end time before the start time is on the next
+    day.
+    """
+    start = time_range.start_time
+    ranges = minutes_open_during(day_of_week, start, time_range.end_time)
+    conditions = [_has_interval(db, or_(*(
+        db_mod.PharmacyOpenInterval.minutes.overlaps(Range(first, stop))
+        for first, stop in ranges
+    )))] if ranges else []
+    if is_past_minute(start):
+        conditions.append(_open_at(db, day_of_week, start))
+    return _list_pharmacies_open(db, or_(*conditions), paging, schema)
+
+
+def _list_pharmacies_open(db: Session, condition,
+                          paging: in_sch.PagingParams,
+                          schema: Type[BaseModel]):
+    """
+    Page through the pharmacies matching a condition on their open
+    intervals.
+    """
+    query = db.query(db_mod.Pharmacy).options(
+        *eager_load(db_mod.Pharmacy, schema)
+    ).filter(condition)
+    return paginate(query, PHARMACY_SORT_KEYS, paging)
+
+
+def list_open_intervals(db: Session, pharmacy_ids: List[int]):
+    """
+    Retrieve the (pharmacy_id, minutes) open intervals of some pharmacies.
+    """
+    return db.query(
+        db_mod.PharmacyOpenInterval.pharmacy_id,
+        db_mod.PharmacyOpenInterval.minutes
+    ).filter(
+        db_mod.PharmacyOpenInterval.pharmacy_id.in_(pharmacy_ids)
+    ).all()
 
 
 def list_pharmacies_by_mask_count(
@@ -64,7 +147,8 @@ def list_pharmacies_by_mask_count(
     """
     subquery = db.query(
         db_mod.PharmacyMask.pharmacy_id,
-        func.count(db_mod.PharmacyMask.id).label("mask_count")
+        # count(*) lets the (price, pharmacy_id) index answer on its own
+        func.count().label("mask_count")
     ).filter(
         # Includes both min_price and max_price
         db_mod.PharmacyMask.price.between(
@@ -89,7 +173,40 @@ def list_pharmacies_by_mask_count(
     elif comparison == ComparisonType.LESS:
         query = query.filter(subquery.c.mask_count < count)
 
-    return query.offset(paging.skip).limit(paging.limit)
+    return paginate(query, PHARMACY_SORT_KEYS, paging)
+
+
+def list_pharmacies_with_mask_counts(
+        db: Session,
+        mask_counts: List[tuple],
+        limit: int
+):
+    """
+    Retrieve the pharmacies of one page of precomputed (pharmacy_id,
+    mask_count) pairs, in the order of the pairs. A full page of ``limit``
+    pairs links to the next one.
+    """
+    counts = dict(mask_counts)
+    names = dict(db.query(db_mod.Pharmacy.id, db_mod.Pharmacy.name).filter(
+        db_mod.Pharmacy.id == any_(list(counts))
+    ).all())
+    rows = [out_sch.PharmacyWithCount(id=pharmacy_id, name=names[pharmacy_id],
+                                      mask_count=mask_count)
+            for pharmacy_id, mask_count in mask_counts
+            if pharmacy_id in names]
+    next_cursor = None
+    if rows and len(mask_counts) == limit:
+        next_cursor = encode_cursor(
+            {name: getattr(rows[-1], name) for name in PHARMACY_SORT_KEYS})
+    return Page(rows, next_cursor)
+
+
+def get_pharmacy_id_by_name(db: Session, name: str):
+    """
+    Retrieve the ID of the pharmacy with the given name, or None.
+    """
+    return db.query(db_mod.Pharmacy.id).filter(
+        db_mod.Pharmacy.name == name).scalar()
 
 
 def create_pharmacy(db: Session, pharmacy: db_mod.Pharmacy):
@@ -116,6 +233,27 @@ def search_pharmacies(db: Session, search_term: str,):
             ).label('similarity'),
             literal("pharmacy").label('type')
         ).filter(
+            # % is served by the trigram index; the similarity check keeps
+            # the threshold strict
+            db_mod.Pharmacy.name.op('%')(search_term),
             func.similarity(db_mod.Pharmacy.name, search_term) > SIMILARITY_THRESHOLD
         )
     )
+
+
+def autocomplete_pharmacies(db: Session, prefix: str, limit: int):
+    """
+    Find pharmacies whose name starts with the prefix, ignoring case, ordered
+    by name in "C" collation so the prefix index serves the lookup.
+    """
+    sort_name = func.lower(db_mod.Pharmacy.name).collate('C')
+    return (
+        db.query(
+            db_mod.Pharmacy.id.label('id'),
+            db_mod.Pharmacy.name.label('name'),
+            literal("pharmacy").label('type'),
+            sort_name.label('sort_name')
+        ).filter(
+            sort_name.like(escape_like(prefix.lower()) + '%')
+        ).order_by(sort_name, db_mod.Pharmacy.id).limit(limit)
+    )
@@ -0,0 +1,97 @@
+"""
+report_cache_crud.py
+--------------------
+
+This module contains CRUD operations for the cached results of date-range
+reports.
+"""
+from datetime import date, datetime, time, timedelta
+from typing import List
+
+from sqlalchemy import or_, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+import api.database.db_models as db_mod
+from api.utils.tools import day_spans
+
+# Advisory lock taken shared while caching a result that never expires, and
+# exclusively while invalidating, so that no result computed from the old
+# transactions is stored after they change.
+REPORT_CACHE_LOCK_KEY = 0x72657074
+
+
+def lock_for_caching(db: Session):
+    """
+    Hold off invalidations until the current transaction ends.
+    """
+    db.execute(text('SELECT pg_advisory_xact_lock_shared(:key)'),
+               {'key': REPORT_CACHE_LOCK_KEY})
+
+
+def get_report(db: Session, report: str, start_date: datetime,
+               end_date: datetime, params: str, now: datetime):
+    """
+    Retrieve the cached result of a report, or None if it is missing or
+    has expired.
+    """
+    cache = db_mod.ReportCache
+    return db.query(cache.result).filter(
+        cache.report == report,
+        cache.start_date == start_date,
+        cache.end_date == end_date,
+        cache.params == params,
+        or_(cache.expires_at.is_(None), cache.expires_at > now)
+    ).scalar()
+
+
+def save_report(db: Session, report: str, start_date: datetime,
+                end_date: datetime, params: str, result,
+                expires_at: datetime = None):
+    """
+    Store the result of a report, replacing any earlier one, without
+    committing. Results that expire also purge the expired ones.
+    """
+    cache = db_mod.ReportCache
+    if expires_at is not None:
+        db.query(cache).filter(
+            cache.expires_at <= datetime.now()
+        ).delete(synchronize_session=False)
+    statement = insert(cache).values(
+        report=report, start_date=start_date, end_date=end_date,
+        params=params, result=result, expires_at=expires_at)
+    db.execute(statement.on_conflict_do_update(
+        index_elements=['report', 'start_date', 'end_date', 'params'],
+        set_={'result': statement.excluded.result,
+              'expires_at': statement.excluded.expires_at}
+    ))
+
+
+def invalidate_days(db: Session, days: List[date], lock: bool = True):
+    """
+    Remove the cached results whose date range overlaps any of the days,
+    without committing. ``lock`` waits for the results being cached from
+    the previous transactions, which is only needed for days before today.
+    """
+    if not days:
+        return
+    if lock:
+        db.execute(text('SELECT pg_advisory_xact_lock(:key)'),
+                   {'key': REPORT_CACHE_LOCK_KEY})
+    cache = db_mod.ReportCache
+    overlaps = [
+        (cache.start_date < datetime.combine(last + timedelta(days=1), time()))
+        & (cache.end_date >= datetime.combine(first, time()))
+        for first, last in day_spans(days)
+    ]
+    db.query(cache).filter(or_(*overlaps)).delete(synchronize_session=False)
+
+
+def invalidate_all(db: Session):
+    """
+    Remove every cached result, without committing, for when all the
+    transactions are replaced.
+    """
+    db.execute(text('SELECT pg_advisory_xact_lock(:key)'),
+               {'key': REPORT_CACHE_LOCK_KEY})
+    db.query(db_mod.ReportCache).delete(synchronize_session=False)
@@ -5,26 +5,416 @@ transaction_crud.py
 This module contains CRUD operations for managing transaction records
 in the database.
 """
+import re
+from datetime import date, timedelta
+from typing import Type
+
+from pydantic import BaseModel
+from sqlalchemy import (Date, Integer, and_, cast, func, or_, select, text,
+                        union_all)
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.orm import Session
 
 import api.database.db_models as db_mod
+from api.crud import report_cache_crud
+from api.schemas import input_schema as in_sch, output_schema as out_sch
+from api.utils.loading import eager_load
+from api.utils.tools import day_spans, whole_days
+
+# Daily rollup of the transactions per value of a transaction column.
+DAILY_ROLLUPS = {
+    'mask_id': db_mod.MaskDailyRollup,
+    'user_id': db_mod.UserDailyRollup,
+    'pharmacy_id': db_mod.PharmacyDailyRollup,
+}
+TRANSACTIONS = db_mod.Transaction.__tablename__
+DEFAULT_PARTITION = f'{TRANSACTIONS}_default'
+# The table from before partitioning, holding the dates before some month.
+LEGACY_PARTITION = f'{TRANSACTIONS}_legacy'
+MONTH_PARTITION = re.compile(rf'{TRANSACTIONS}_y(\d{{4}})m(\d{{2}})')
+# Advisory lock serializing partition changes across processes.
+PARTITION_LOCK_KEY = 0x7472616e
 
 
-def get_transaction(db: Session, transaction_id: int):
+def get_transaction(db: Session, transaction_id: int,
+                    schema: Type[BaseModel] = out_sch.Transaction):
     """
-    Retrieve a transaction by its ID.
+    Retrieve a transaction by its ID, with the relations the schema shows.
     """
     return (
         db.query(db_mod.Transaction)
+        .options(*eager_load(db_mod.Transaction, schema))
         .filter(db_mod.Transaction.id == transaction_id).first()
     )
 
 
 def create_transaction(db: Session, transaction: db_mod.Transaction):
     """
-    Create a new transaction in the database.
+    Create a new transaction in the database, counting it in the daily
+    rollups and dropping the cached reports of its day in the same database
+    transaction. Return the transaction and the new version of the rollups.
     """
     db.add(transaction)
+    db.flush()
+    add_to_daily_rollups(db, transaction)
+    day = transaction.date.date()
+    report_cache_crud.invalidate_days(db, [day], lock=day < date.today())
+    # Last, since the version row stays locked until the commit.
+    version = bump_rollup_version(db)
     db.commit()
     db.refresh(transaction)
-    return transaction
+    return transaction, version
+
+
+def list_transactions_for_export(
+        db: Session,
+        date_range: in_sch.DateRange,
+        filters: in_sch.TransactionFilterParams,
+        batch_size: int
+):
+    """
+    Query the transactions within a date range, both ends included, in date
+    order. Rows are fetched ``batch_size`` at a time from a server-side
+    cursor, so the whole result is never held in memory.
+    """
+    transaction = db_mod.Transaction
+    query = db.query(
+        transaction.id, transaction.user_id, transaction.pharmacy_id,
+        transaction.mask_id, transaction.transaction_amount, transaction.date
+    ).filter(
+        transaction.date.between(date_range.start_date, date_range.end_date)
+    )
+    for key, value in filters.model_dump(exclude_none=True).items():
+        query = query.filter(getattr(transaction, key) == value)
+    return query.order_by(transaction.date, transaction.id) \
+        .yield_per(batch_size)
+
+
+def get_date_range(db: Session):
+    """
+    Retrieve the dates of the first and last transactions, or Nones when
+    there is none.
+    """
+    return db.query(func.min(db_mod.Transaction.date),
+                    func.max(db_mod.Transaction.date)).one()
+
+
+def get_last_transaction_id(db: Session) -> int:
+    """
+    Retrieve the highest transaction id, 0 when there is no transaction.
+    """
+    return db.query(func.max(db_mod.Transaction.id)).scalar() or 0
+
+
+def get_days_after(db: Session, transaction_id: int):
+    """
+    Retrieve the days of the transactions with an id above the given one.
+    Ids come from one sequence, so these are the transactions written since
+    that id was the highest.
+    """
+    return set(db.execute(select(
+        cast(db_mod.Transaction.date, Date).distinct()
+    ).filter(db_mod.Transaction.id > transaction_id)).scalars())
+
+
+def get_rollup_version(db: Session) -> int:
+    """
+    Retrieve the version of the daily rollups, 0 before their first change.
+    """
+    return db.query(db_mod.DailyRollupVersion.version).scalar() or 0
+
+
+def bump_rollup_version(db: Session) -> int:
+    """
+    Count a change to the daily rollups, without committing, and return the
+    new version. The version row stays locked until the commit, so a version
+    covers exactly the changes committed before it.
+    """
+    version = db_mod.DailyRollupVersion
+    statement = insert(version).values(id=1, version=1)
+    return db.execute(statement.on_conflict_do_update(
+        index_elements=['id'], set_={'version': version.version + 1}
+    ).returning(version.version)).scalar()
+
+
+def _in_days(column, days):
+    """
+    Build a condition selecting the values of a date or datetime column that
+    fall on any of the days, as one range per run of consecutive days.
+    """
+    return or_(*(and_(column >= first, column < last + timedelta(days=1))
+                 for first, last in day_spans(days)))
+
+
+def _rollup_rows(key: str, days=None):
+    """
+    Select the (day, key, count, amount) rows of the transactions, grouped
+    by day and by the key column, of the given days or of all days.
+    """
+    column = getattr(db_mod.Transaction, key)
+    day = cast(db_mod.Transaction.date, Date)
+    rows = select(
+        day, column, func.count(),
+        func.sum(db_mod.Transaction.transaction_amount)
+    ).group_by(day, column)
+    if days is not None:
+        rows = rows.filter(_in_days(db_mod.Transaction.date, days))
+    return rows
+
+
+def fill_daily_rollups(db: Session, days=None):
+    """
+    Insert the rollups of the transactions of the given days, or of all
+    transactions, into rollup tables empty for those days, without
+    committing.
+    """
+    for key, model in DAILY_ROLLUPS.items():
+        db.execute(insert(model).from_select(
+            ['day', key, 'transaction_count', 'total_amount'],
+            _rollup_rows(key, days)))
+
+
+def add_to_daily_rollups(db: Session, transaction: db_mod.Transaction):
+    """
+    Add a stored transaction to its day's rollups, without committing.
+    """
+    for key, model in DAILY_ROLLUPS.items():
+        statement = insert(model).values({
+            'day': transaction.date.date(),
+            key: getattr(transaction, key),
+            'transaction_count': 1,
+            'total_amount': transaction.transaction_amount,
+        })
+        db.execute(statement.on_conflict_do_update(
+            index_elements=['day', key],
+            set_={
+                'transaction_count': model.transaction_count
+                + statement.excluded.transaction_count,
+                'total_amount': model.total_amount
+                + statement.excluded.total_amount,
+            }
+        ))
+
+
+def rebuild_daily_rollups(db: Session, days=None):
+    """
+    Recompute the daily rollups of the given days, or of all days, from the
+    transactions, for transactions written around create_transaction, such
+    as by ETL. The cached reports of the days whose rollups changed are
+    dropped.
+    """
+    if days is not None and not days:
+        return
+    # Hold off new transactions until the rebuild commits, so that none is
+    # lost or counted twice. Readers keep seeing the previous rollups.
+    db.execute(text(f'LOCK TABLE {TRANSACTIONS} IN SHARE MODE'))
+    if days is not None:
+        # Rows were written on every one of the days, so they all change.
+        for model in DAILY_ROLLUPS.values():
+            db.query(model).filter(_in_days(model.day, days)).delete(
+                synchronize_session=False)
+        fill_daily_rollups(db, days)
+        report_cache_crud.invalidate_days(db, days)
+        bump_rollup_version(db)
+        db.commit()
+        return
+
+    changed_days = set()
+    for model in DAILY_ROLLUPS.values():
+        table = model.__tablename__
+        db.execute(text(f'CREATE TEMPORARY TABLE previous_{table} '
+                        f'ON COMMIT DROP AS TABLE {table}'))
+        db.query(model).delete(synchronize_session=False)
+    fill_daily_rollups(db)
+    for model in DAILY_ROLLUPS.values():
+        table = model.__tablename__
+        changed_days.update(db.execute(text(
+            f'SELECT day FROM ((TABLE previous_{table} EXCEPT TABLE {table}) '
+            f'UNION (TABLE {table} EXCEPT TABLE previous_{table})) AS changed'
+        )).scalars())
+    report_cache_crud.invalidate_days(db, changed_days)
+    bump_rollup_version(db)
+    db.commit()
+
+
+def daily_totals(db: Session, key: str, date_range: in_sch.DateRange,
+                 rollups: bool = True):
+    """
+    Build a subquery of the transaction count and total amount per value of
+    the ``key`` column within a date range, both ends included.
+
+    Whole days are read from the daily rollups and only the partial days at
+    either end from the transactions. Without ``rollups``, every
+    transaction in the range is read.
+    """
+    start, end = date_range.start_date, date_range.end_date
+    date = db_mod.Transaction.date
+    days = whole_days(start, end) if rollups else None
+    parts = []
+    if days is None:
+        raw_ranges = [date.between(start, end)]
+    else:
+        first, stop = days
+        model = DAILY_ROLLUPS[key]
+        parts.append(select(
+            getattr(model, key).label('key'),
+            model.transaction_count,
+            model.total_amount
+        ).filter(model.day >= first.date(), model.day < stop.date()))
+        # The partial days, if any, each read as one range of the date index.
+        raw_ranges = [condition for condition, partial in (
+            (and_(date >= start, date < first), start < first),
+            (and_(date >= stop, date <= end), stop <= end),
+        ) if partial]
+
+    column = getattr(db_mod.Transaction, key)
+    parts.extend(select(
+        column.label('key'),
+        func.count().label('transaction_count'),
+        func.sum(db_mod.Transaction.transaction_amount).label('total_amount')
+    ).filter(condition).group_by(column) for condition in raw_ranges)
+
+    totals = union_all(*parts).subquery()
+    return db.query(
+        totals.c.key,
+        cast(func.sum(totals.c.transaction_count),
+             Integer).label('transaction_count'),
+        func.sum(totals.c.total_amount).label('total_amount')
+    ).group_by(totals.c.key).subquery('totals')
+
+
+def partition_name(month: date) -> str:
+    """
+    Name the partition holding the transactions of a month.
+    """
+    return f'{TRANSACTIONS}_y{month.year}m{month.month:02d}'
+
+
+def next_month(month: date) -> date:
+    """
+    Return the first day of the month after a month.
+    """
+    return date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def is_partition(name: str) -> bool:
+    """
+    Tell whether a table name is one of the transactions partitions.
+    """
+    return name in (DEFAULT_PARTITION, LEGACY_PARTITION) \
+        or bool(MONTH_PARTITION.fullmatch(name))
+
+
+def list_partitions(db: Session):
+    """
+    Map the first day of each month with a partition to its name.
+    """
+    names = db.execute(text(
+        'SELECT child.relname FROM pg_inherits '
+        'JOIN pg_class child ON child.oid = inhrelid '
+        'WHERE inhparent = CAST(:table AS regclass)'
+    ), {'table': TRANSACTIONS}).scalars()
+    partitions = {}
+    for name in names:
+        match = MONTH_PARTITION.fullmatch(name)
+        if match:
+            partitions[date(int(match[1]), int(match[2]), 1)] = name
+    return partitions
+
+
+def get_legacy_partition_end(db: Session):
+    """
+    Return the first day after the dates of the legacy partition, or None
+    if it is not attached.
+    """
+    bound = db.execute(text(
+        'SELECT pg_get_expr(child.relpartbound, child.oid) FROM pg_inherits '
+        'JOIN pg_class child ON child.oid = inhrelid '
+        'WHERE inhparent = CAST(:table AS regclass) AND child.relname = :name'
+    ), {'table': TRANSACTIONS, 'name': LEGACY_PARTITION}).scalar()
+    if bound is None:
+        return None
+    return date.fromisoformat(re.search(r"TO \('([\d-]+)", bound)[1])
+
+
+def _create_partition(db: Session, month: date):
+    """
+    Create the partition of a month, moving its rows out of the default
+    partition, without committing.
+    """
+    name = partition_name(month)
+    bounds = {'start': month, 'stop': next_month(month)}
+    db.execute(text(f'CREATE TABLE {name} (LIKE {TRANSACTIONS})'))
+    db.execute(text(
+        f'WITH moved AS (DELETE FROM {DEFAULT_PARTITION} '
+        f'WHERE date >= :start AND date < :stop RETURNING *) '
+        f'INSERT INTO {name} SELECT * FROM moved'
+    ), bounds)
+    db.execute(text(
+        f"ALTER TABLE {TRANSACTIONS} ATTACH PARTITION {name} "
+        f"FOR VALUES FROM ('{bounds['start']}') TO ('{bounds['stop']}')"))
+    return name
+
+
+def create_partitions(db: Session, months_ahead: int, today: date = None):
+    """
+    Create the monthly partitions from this month to ``months_ahead`` months
+    later, and those of the months found in the default partition. Return
+    the names of the new partitions.
+    """
+    db.execute(text('SELECT pg_advisory_xact_lock(:key)'),
+               {'key': PARTITION_LOCK_KEY})
+    month = (today or date.today()).replace(day=1)
+    months = set()
+    for _ in range(months_ahead + 1):
+        months.add(month)
+        month = next_month(month)
+    months.update(db.execute(text(
+        f"SELECT DISTINCT CAST(date_trunc('month', date) AS date) "
+        f"FROM {DEFAULT_PARTITION}")).scalars())
+
+    legacy_end = get_legacy_partition_end(db)
+    if legacy_end:
+        months = {month for month in months if month >= legacy_end}
+    created = [_create_partition(db, month)
+               for month in sorted(months - set(list_partitions(db)))]
+    db.commit()
+    return created
+
+
+def detach_partitions(db: Session, before: date, drop: bool = False):
+    """
+    Detach the monthly partitions, and the legacy one, that end on or
+    before a day, and remove their days from the daily rollups. The
+    detached tables are kept, unless ``drop`` is set. Return their names.
+    """
+    db.execute(text('SELECT pg_advisory_xact_lock(:key)'),
+               {'key': PARTITION_LOCK_KEY})
+    spans = [(month, next_month(month), name)
+             for month, name in list_partitions(db).items()]
+    legacy_end = get_legacy_partition_end(db)
+    if legacy_end:
+        first = db.execute(text(
+            f'SELECT CAST(min(date) AS date) FROM {LEGACY_PARTITION}'
+        )).scalar()
+        spans.append((first or legacy_end, legacy_end, LEGACY_PARTITION))
+    detached = []
+    for first, end, name in sorted(spans):
+        if end > before:
+            continue
+        db.execute(text(
+            f'ALTER TABLE {TRANSACTIONS} DETACH PARTITION {name}'))
+        for model in DAILY_ROLLUPS.values():
+            db.query(model).filter(
+                model.day >= first, model.day < end
+            ).delete(synchronize_session=False)
+        report_cache_crud.invalidate_days(db, [
+            first + timedelta(days=offset)
+            for offset in range((end - first).days)])
+        if drop:
+            db.execute(text(f'DROP TABLE {name}'))
+        detached.append(name)
+    if detached:
+        bump_rollup_version(db)
+    db.commit()
+    return detached
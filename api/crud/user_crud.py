@@ -6,9 +6,12 @@ This module contains CRUD operations for managing user records
 in the database.
 """
 
-from sqlalchemy import func
+from datetime import date
+
+from sqlalchemy import Integer, cast, func
 from sqlalchemy.orm import Session
 
+from api.crud import transaction_crud
 from api.database import db_models as db_mod
 from api.schemas import input_schema as in_sch, output_schema as out_sch
 
@@ -16,27 +19,24 @@ from api.schemas import input_schema as in_sch, output_schema as out_sch
 def list_top_users_by_transaction_amount(
         db: Session,
         date_range: in_sch.DateRange,
-        limit: int
+        limit: int,
+        rollups: bool = True
 ):
     """
     Retrieve the top x users by total transaction amount of masks within
-    a date range.
+    a date range. Whole days are read from the daily rollups unless
+    ``rollups`` is off.
     """
+    totals = transaction_crud.daily_totals(db, 'user_id', date_range,
+                                           rollups)
     result = db.query(
         db_mod.User.id,
         db_mod.User.name,
-        func.sum(db_mod.Transaction.transaction_amount).label('total_amount')
+        totals.c.total_amount
     ).join(
-        db_mod.Transaction
-    ).filter(
-        db_mod.Transaction.date.between(
-            date_range.start_date,
-            date_range.end_date
-        )
-    ).group_by(
-        db_mod.User.id
+        totals, db_mod.User.id == totals.c.key
     ).order_by(
-        func.sum(db_mod.Transaction.transaction_amount).desc()
+        totals.c.total_amount.desc(), db_mod.User.id
     ).limit(limit)
 
     return [out_sch.UserTransactionSummary(
@@ -44,3 +44,36 @@ def list_top_users_by_transaction_amount(
         name=row.name,
         total_amount=row.total_amount)
         for row in result]
+
+
+def get_user_names(db: Session, user_ids):
+    """
+    Retrieve the names of users by their IDs, as a map from ID to name.
+    """
+    return dict(db.query(db_mod.User.id, db_mod.User.name)
+                .filter(db_mod.User.id.in_(user_ids)).all())
+
+
+def list_user_totals(db: Session):
+    """
+    List the (user_id, transaction count, total amount) of every user with
+    transactions, summed from the daily rollups.
+    """
+    rollup = db_mod.UserDailyRollup
+    return db.query(
+        rollup.user_id,
+        cast(func.sum(rollup.transaction_count), Integer),
+        func.sum(rollup.total_amount)
+    ).group_by(rollup.user_id).all()
+
+
+def list_user_daily_totals(db: Session, first_day: date):
+    """
+    List the (day, user_id, transaction count, total amount) daily rollups
+    of users from a day on.
+    """
+    rollup = db_mod.UserDailyRollup
+    return db.query(
+        rollup.day, rollup.user_id, rollup.transaction_count,
+        rollup.total_amount
+    ).filter(rollup.day >= first_day).all()
@@ -6,12 +6,17 @@ This module is responsible for setting up the database engine and
 session management.
 """
 
-from sqlalchemy import create_engine
+from pathlib import Path
+
+from alembic import command
+from alembic.config import Config
+from sqlalchemy import create_engine, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
 from config.config import DATABASE_URL
 
+ALEMBIC_DIR = Path(__file__).resolve().parents[2] / 'alembic'
 
 engine = create_engine(DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
@@ -28,3 +33,21 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+def recreate_schema(bind, upgrade: bool = True):
+    """
+    Empty the public schema of a database and, with ``upgrade``, build it
+    with the migrations, as a deployment does, rather than from the models.
+    Meant for test and benchmark databases only.
+    """
+    with bind.connect() as connection:
+        connection.execute(text('DROP SCHEMA public CASCADE'))
+        connection.execute(text('CREATE SCHEMA public'))
+        connection.commit()
+        if upgrade:
+            config = Config()
+            config.set_main_option('script_location', str(ALEMBIC_DIR))
+            config.attributes['connection'] = connection
+            command.upgrade(config, 'head')
+            connection.commit()
@@ -8,8 +8,10 @@ Each model represents a table in the database with relationships and attributes
 required for the application's functionality.
 """
 
-from sqlalchemy import (Column, Integer, String, ForeignKey, Numeric, Time,
-                        DateTime)
+from sqlalchemy import (DDL, BigInteger, Column, Integer, String, ForeignKey,
+                        Numeric, Time, Date, DateTime, Index, UniqueConstraint,
+                        event, func)
+from sqlalchemy.dialects.postgresql import INT4RANGE, JSONB
 from sqlalchemy.orm import relationship
 
 from api.database.database import Base
@@ -21,15 +23,25 @@ class Pharmacy(Base):
     """
     __tablename__ = 'pharmacies'
     id = Column(Integer, primary_key=True, index=True)
-    name = Column(String, nullable=False, index=True)
+    name = Column(String, nullable=False, unique=True, index=True)
     cash_balance = Column(Numeric(10, 2), nullable=False)
     opening_hours = relationship(
         "PharmacyHour",
         back_populates="pharmacy",
         cascade="all, delete-orphan"
     )
+    open_intervals = relationship(
+        "PharmacyOpenInterval",
+        back_populates="pharmacy",
+        cascade="all, delete-orphan"
+    )
     pharmacy_masks = relationship("PharmacyMask", back_populates="pharmacy")
     transactions = relationship("Transaction", back_populates="pharmacy")
+    __table_args__ = (
+        Index('ix_pharmacies_name_trgm', 'name', postgresql_using='gin',
+              postgresql_ops={'name': 'gin_trgm_ops'}),
+        Index('ix_pharmacies_name_prefix', func.lower(name).collate('C')),
+    )
 
 
 class PharmacyHour(Base):
@@ -45,15 +57,41 @@ class PharmacyHour(Base):
     pharmacy = relationship("Pharmacy", back_populates="opening_hours")
 
 
+class PharmacyOpenInterval(Base):
+    """
+    Represents a span of a pharmacy's opening hours as a range of minutes
+    counted from Monday 00:00. Hours running past Sunday midnight are
+    stored as two spans.
+    """
+    __tablename__ = 'pharmacy_open_intervals'
+    id = Column(Integer, primary_key=True, index=True)
+    pharmacy_id = Column(Integer, ForeignKey('pharmacies.id'), nullable=False,
+                         index=True)
+    minutes = Column(INT4RANGE, nullable=False)
+    pharmacy = relationship("Pharmacy", back_populates="open_intervals")
+    __table_args__ = (
+        Index('ix_pharmacy_open_intervals_minutes', 'minutes',
+              postgresql_using='gist'),
+    )
+
+
 class Mask(Base):
     """
     Represents a mask.
     """
     __tablename__ = 'masks'
     id = Column(Integer, primary_key=True, index=True)
-    name = Column(String, nullable=False, index=True)
+    name = Column(String, nullable=False, unique=True, index=True)
+    brand = Column(String, index=True)
+    color = Column(String, index=True)
+    pack_size = Column(Integer, index=True)
     prices = relationship("PharmacyMask", back_populates="mask")
     transactions = relationship("Transaction", back_populates="mask")
+    __table_args__ = (
+        Index('ix_masks_name_trgm', 'name', postgresql_using='gin',
+              postgresql_ops={'name': 'gin_trgm_ops'}),
+        Index('ix_masks_name_prefix', func.lower(name).collate('C')),
+    )
 
 
 class PharmacyMask(Base):
@@ -62,11 +100,22 @@ class PharmacyMask(Base):
     """
     __tablename__ = 'pharmacy_masks'
     id = Column(Integer, primary_key=True, index=True)
-    pharmacy_id = Column(Integer, ForeignKey('pharmacies.id'), index=True)
+    # Lookups by pharmacy are served by the indexes starting with it.
+    pharmacy_id = Column(Integer, ForeignKey('pharmacies.id'))
     mask_id = Column(Integer, ForeignKey('masks.id'), index=True)
     price = Column(Numeric(10, 2), nullable=False)
+    unit_price = Column(Numeric(10, 4))
     pharmacy = relationship("Pharmacy", back_populates="pharmacy_masks")
     mask = relationship("Mask", back_populates="prices")
+    __table_args__ = (
+        Index('ix_pharmacy_masks_pharmacy_price_id', 'pharmacy_id', 'price',
+              'id'),
+        Index('ix_pharmacy_masks_pharmacy_unit_price_id', 'pharmacy_id',
+              'unit_price', 'id'),
+        Index('ix_pharmacy_masks_price_pharmacy', 'price', 'pharmacy_id'),
+        UniqueConstraint('pharmacy_id', 'mask_id',
+                         name='uq_pharmacy_masks_pharmacy_mask'),
+    )
 
 
 class User(Base):
@@ -75,7 +124,7 @@ class User(Base):
     """
     __tablename__ = 'users'
     id = Column(Integer, primary_key=True, index=True)
-    name = Column(String, nullable=False, index=True)
+    name = Column(String, nullable=False, unique=True, index=True)
     cash_balance = Column(Numeric(10, 2), nullable=False)
     transactions = relationship("Transaction", back_populates="user")
 
@@ -83,9 +132,12 @@ class User(Base):
 class Transaction(Base):
     """
     Represents a transaction.
+
+    The table is partitioned by month of ``date``, so the primary key has to
+    include it. Rows outside the monthly partitions land in the default one.
     """
     __tablename__ = 'transactions'
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True, autoincrement=True, index=True)
     user_id = Column(Integer, ForeignKey('users.id'), nullable=False,
                      index=True)
     pharmacy_id = Column(Integer, ForeignKey('pharmacies.id'), nullable=False,
@@ -93,7 +145,101 @@ class Transaction(Base):
     mask_id = Column(Integer, ForeignKey('masks.id'), nullable=False,
                      index=True)
     transaction_amount = Column(Numeric(10, 2), nullable=False)
-    date = Column(DateTime, nullable=False, index=True)
+    date = Column(DateTime, primary_key=True)
     user = relationship("User", back_populates="transactions")
     pharmacy = relationship("Pharmacy", back_populates="transactions")
     mask = relationship("Mask", back_populates="transactions")
+    __table_args__ = (
+        Index('ix_transactions_date_user_amount', 'date', 'user_id',
+              'transaction_amount'),
+        Index('ix_transactions_date_mask', 'date', 'mask_id',
+              postgresql_include=['transaction_amount']),
+        {'postgresql_partition_by': 'RANGE (date)'},
+    )
+
+
+event.listen(Transaction.__table__, 'after_create', DDL(
+    'CREATE TABLE %(table)s_default PARTITION OF %(table)s DEFAULT'))
+
+
+class MaskDailyRollup(Base):
+    """
+    Represents the number and total amount of a mask's transactions on one
+    day. Rollups are derived from transactions and can be rebuilt, so they
+    have no foreign keys.
+    """
+    __tablename__ = 'mask_daily_rollups'
+    day = Column(Date, primary_key=True)
+    mask_id = Column(Integer, primary_key=True)
+    transaction_count = Column(Integer, nullable=False)
+    total_amount = Column(Numeric(14, 2), nullable=False)
+
+
+class UserDailyRollup(Base):
+    """
+    Represents the number and total amount of a user's transactions on one
+    day.
+    """
+    __tablename__ = 'user_daily_rollups'
+    day = Column(Date, primary_key=True)
+    user_id = Column(Integer, primary_key=True)
+    transaction_count = Column(Integer, nullable=False)
+    total_amount = Column(Numeric(14, 2), nullable=False)
+
+
+class PharmacyDailyRollup(Base):
+    """
+    Represents the number and total amount of a pharmacy's transactions on
+    one day.
+    """
+    __tablename__ = 'pharmacy_daily_rollups'
+    day = Column(Date, primary_key=True)
+    pharmacy_id = Column(Integer, primary_key=True)
+    transaction_count = Column(Integer, nullable=False)
+    total_amount = Column(Numeric(14, 2), nullable=False)
+
+
+class DailyRollupVersion(Base):
+    """
+    Represents the version of the daily rollups, a single row counting their
+    changes, so that copies of them held in memory can tell they are stale.
+    """
+    __tablename__ = 'daily_rollup_version'
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    version = Column(BigInteger, nullable=False)
+
+
+class ReportCache(Base):
+    """
+    Represents the cached result of a report over a date range. Entries
+    without an expiry are kept until the transactions of their dates change.
+    """
+    __tablename__ = 'report_cache'
+    report = Column(String(40), primary_key=True)
+    start_date = Column(DateTime, primary_key=True)
+    end_date = Column(DateTime, primary_key=True)
+    params = Column(String, primary_key=True)
+    result = Column(JSONB, nullable=False)
+    expires_at = Column(DateTime, index=True)
+
+
+class EtlRecord(Base):
+    """
+    Represents the content hash of a source record loaded by the ETL, used to
+    detect new and changed records on incremental runs.
+    """
+    __tablename__ = 'etl_records'
+    kind = Column(String(20), primary_key=True)
+    source_key = Column(String, primary_key=True)
+    record_hash = Column(String(40), nullable=False)
+
+
+class EtlCheckpoint(Base):
+    """
+    Represents how far a resumable ETL run got through a source file.
+    """
+    __tablename__ = 'etl_checkpoints'
+    source_file = Column(String, primary_key=True)
+    record_index = Column(Integer, nullable=False)
+    batch_id = Column(Integer, nullable=False)
+    updated_at = Column(DateTime, nullable=False)
@@ -19,12 +19,20 @@ class DayOfWeek(str, Enum):
     SUN = "Sun"
 
 
+class PharmacyInclude(str, Enum):
+    """
+    An enumeration representing the optional relations of listed pharmacies.
+    """
+    OPENING_HOURS = "opening_hours"
+
+
 class SortType(str, Enum):
     """
     An enumeration representing sorting options.
     """
     NAME = "name"
     PRICE = "price"
+    UNIT_PRICE = "unit_price"
 
 
 class ComparisonType(str, Enum):
@@ -42,3 +50,37 @@ class SearchType(str, Enum):
     PHARMACY = "pharmacy"
     MASK = "mask"
     ALL = "all"
+
+
+class MaskCountBackend(str, Enum):
+    """
+    An enumeration representing the backends that can count masks per
+    pharmacy.
+    """
+    POSTGRES = "postgres"
+    SNAPSHOT = "snapshot"
+
+
+class TopUsersBackend(str, Enum):
+    """
+    An enumeration representing the backends that can rank users by
+    transaction amount.
+    """
+    POSTGRES = "postgres"
+    LEADERBOARD = "leaderboard"
+
+
+class SearchBackend(str, Enum):
+    """
+    An enumeration representing the backends that can serve searches.
+    """
+    POSTGRES = "postgres"
+    MEMORY = "memory"
+
+
+class ExportFormat(str, Enum):
+    """
+    An enumeration representing the file formats of exported transactions.
+    """
+    CSV = "csv"
+    NDJSON = "ndjson"
@@ -6,17 +6,44 @@ This module defines the API endpoints for managing masks.
 """
 from typing import List
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Response
 from sqlalchemy.orm import Session
 
 from api.database.database import get_db
 from api.enums import SortType
 from api.schemas import input_schema as in_sch, output_schema as out_sch
 from api.services import mask_service
+from api.utils.pagination import set_next_cursor
 
 router = APIRouter(tags=['Masks'])
 
 
+@router.get("/masks", response_model=List[out_sch.Mask])
+def list_masks(
+        response: Response,
+        filters: in_sch.MaskFilterParams = Depends(),
+        paging: in_sch.PagingParams = Depends(),
+        db: Session = Depends(get_db)
+):
+    """
+    List masks filtered by brand, color and pack size, sorted by name.
+    """
+    page = mask_service.list_masks(db, filters, paging)
+    set_next_cursor(response, page)
+    return page
+
+
+@router.get("/masks/facets", response_model=out_sch.MaskFacets)
+def get_mask_facets(
+        filters: in_sch.MaskFilterParams = Depends(),
+        db: Session = Depends(get_db)
+):
+    """
+    Count the masks matching the filters per brand, color and pack size.
+    """
+    return mask_service.get_mask_facets(db, filters)
+
+
 @router.get("/masks/{mask_id}", response_model=out_sch.Mask)
 def read_mask(mask_id: int, db: Session = Depends(get_db)):
     """
@@ -36,16 +63,19 @@ def create_mask(mask: in_sch.MaskCreate, db: Session = Depends(get_db)):
 @router.get("/masks/pharmacies/{pharmacy_id}",
             response_model=List[out_sch.MaskWithPrice])
 def list_pharmacy_masks(
+        response: Response,
         pharmacy_id: int,
         sort_by: SortType = SortType.NAME,
         paging: in_sch.PagingParams = Depends(),
         db: Session = Depends(get_db)
 ):
     """
-    List all masks sold by a given pharmacy, sorted by mask name or price.
+    List all masks sold by a given pharmacy, sorted by mask name, price or
+    price per mask.
     """
-    return mask_service.list_pharmacy_masks(db, pharmacy_id,
-                                                         sort_by, paging)
+    page = mask_service.list_pharmacy_masks(db, pharmacy_id, sort_by, paging)
+    set_next_cursor(response, page)
+    return page
 
 
 @router.get("/masks/transactions/summary",
@@ -7,13 +7,14 @@ This module provides API endpoints for interacting with pharmacies.
 
 from typing import List
 
-from fastapi import Depends, APIRouter
+from fastapi import Depends, APIRouter, Query, Response
 from sqlalchemy.orm import Session
 
 from api.database.database import get_db
-from api.enums import DayOfWeek, ComparisonType
+from api.enums import DayOfWeek, ComparisonType, PharmacyInclude
 from api.schemas import input_schema as in_sch, output_schema as out_sch
 from api.services import pharmacy_service
+from api.utils.pagination import set_next_cursor
 
 router = APIRouter(tags=['Pharmacies'])
 
@@ -26,32 +27,80 @@ def get_pharmacy(pharmacy_id: int, db: Session = Depends(get_db)):
     return pharmacy_service.get_pharmacy_details(db, pharmacy_id)
 
 
-@router.get("/pharmacies", response_model=List[out_sch.Pharmacy])
-def list_pharmacies(paging: in_sch.PagingParams,
+@router.get("/pharmacies", response_model=List[out_sch.PharmacyWithHours],
+            response_model_exclude_unset=True)
+def list_pharmacies(response: Response,
+                    paging: in_sch.PagingParams = Depends(),
+                    include: List[PharmacyInclude] = Query(default=[]),
                     db: Session = Depends(get_db)):
     """
-    Retrieve a list of pharmacies with pagination.
+    Retrieve a list of pharmacies with pagination, sorted by name.
     """
-    return pharmacy_service.list_pharmacies(db, paging)
+    page = pharmacy_service.list_pharmacies(db, paging, include)
+    set_next_cursor(response, page)
+    return page
 
 
-@router.get("/pharmacies/open/at", response_model=List[out_sch.Pharmacy])
+@router.get("/pharmacies/open/at",
+            response_model=List[out_sch.PharmacyWithHours],
+            response_model_exclude_unset=True)
 def list_pharmacies_open_at(
+        response: Response,
         query_time: in_sch.TimeQuery = Depends(in_sch.get_time),
         day_of_week: DayOfWeek = DayOfWeek.MON,
         paging: in_sch.PagingParams = Depends(),
+        include: List[PharmacyInclude] = Query(default=[]),
         db: Session = Depends(get_db)
 ):
     """
     Retrieve pharmacies open at a specific time and day of the week.
     """
-    return pharmacy_service.list_pharmacies_open_at(db, query_time.query_time,
-                                                    day_of_week, paging)
+    page = pharmacy_service.list_pharmacies_open_at(db, query_time.query_time,
+                                                    day_of_week, paging,
+                                                    include)
+    set_next_cursor(response, page)
+    return page
+
+
+@router.get("/pharmacies/open/during",
+            response_model=List[out_sch.PharmacyWithHours],
+            response_model_exclude_unset=True)
+def list_pharmacies_open_during(
+        response: Response,
+        time_range: in_sch.TimeRange = Depends(in_sch.get_time_range),
+        day_of_week: DayOfWeek = DayOfWeek.MON,
+        paging: in_sch.PagingParams = Depends(),
+        include: List[PharmacyInclude] = Query(default=[]),
+        db: Session = Depends(get_db)
+):
+    """
+    Retrieve pharmacies open at any moment between two times of a day of the
+    week. An end time before the start time is on the next day.
+    """
+    page = pharmacy_service.list_pharmacies_open_during(db, day_of_week,
+                                                        time_range, paging,
+                                                        include)
+    set_next_cursor(response, page)
+    return page
+
+
+@router.post("/pharmacies/open/status",
+             response_model=List[out_sch.OpenStatus])
+def get_open_statuses(
+        status_request: in_sch.OpenStatusRequest,
+        db: Session = Depends(get_db)
+):
+    """
+    Tell for each pharmacy whether it is open at a time, and when it next
+    closes or opens. Opening hours are read as local times of ``at``.
+    """
+    return pharmacy_service.get_open_statuses(db, status_request)
 
 
 @router.get("/pharmacies/filters/masks/count",
             response_model=List[out_sch.PharmacyWithCount])
 def list_pharmacies_by_mask_count(
+        response: Response,
         comparison: ComparisonType = ComparisonType.LESS,
         count: int = 10,
         price_range: in_sch.PriceRangeParams = Depends(),
@@ -61,9 +110,11 @@ def list_pharmacies_by_mask_count(
     """
     List all pharmacies with more or less than x mask products within a price range.
     """
-    return pharmacy_service.list_pharmacies_by_mask_count(db, comparison,
+    page = pharmacy_service.list_pharmacies_by_mask_count(db, comparison,
                                                           count, price_range,
                                                           paging)
+    set_next_cursor(response, page)
+    return page
 
 
 @router.post("/pharmacies", response_model=out_sch.Pharmacy)
@@ -7,19 +7,21 @@ This module provides API endpoints for interacting with search.
 
 from typing import List
 
-from fastapi import Depends, APIRouter, Query
+from fastapi import Depends, APIRouter, Query, Response
 from sqlalchemy.orm import Session
 
 from api.database.database import get_db
 from api.enums import SearchType
 from api.schemas import input_schema as in_sch, output_schema as out_sch
 from api.services import search_service
+from api.utils.pagination import set_next_cursor
 
 router = APIRouter(tags=['Search'])
 
 
 @router.get("/search", response_model=List[out_sch.SearchResult])
 def search_entities(
+        response: Response,
         search_term: str,
         search_type: SearchType = Query(
             SearchType.ALL,
@@ -32,4 +34,47 @@ def search_entities(
     Search for pharmacies and masks by name, using trigrams for fuzzy matching,
     ranked by relevance to the search term.
     """
-    return search_service.search_entities(db, search_term, search_type, paging)
+    page = search_service.search_entities(db, search_term, search_type,
+                                          paging)
+    set_next_cursor(response, page)
+    return page
+
+
+@router.get("/search/autocomplete",
+            response_model=List[out_sch.SearchResult])
+def autocomplete(
+        prefix: str = Query(..., min_length=1),
+        search_type: SearchType = Query(
+            SearchType.ALL,
+            description="Type of entity to complete: 'pharmacy' or 'mask'"
+        ),
+        limit: int = Query(10, ge=1, le=100),
+        db: Session = Depends(get_db)
+):
+    """
+    Complete a name prefix to pharmacies and masks, ignoring case, ordered
+    by name.
+    """
+    return search_service.autocomplete(db, prefix, search_type, limit)
+
+
+@router.post("/search/batch",
+             response_model=List[out_sch.SearchBatchResult])
+def search_batch(
+        batch: in_sch.SearchBatchRequest,
+        db: Session = Depends(get_db)
+):
+    """
+    Resolve many search terms in one request, returning the top-k matches of
+    each term, in the order the terms were given.
+    """
+    return search_service.search_batch(db, batch)
+
+
+@router.get("/search/cache", response_model=out_sch.SearchCacheStats)
+def get_search_cache_stats():
+    """
+    Get the hit, miss, eviction and invalidation counters of the search
+    cache.
+    """
+    return search_service.get_cache_stats()
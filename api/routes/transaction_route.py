@@ -6,15 +6,42 @@ This module provides API endpoints for interacting with transactions
 and user amounts.
 """
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Query
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from api.database.database import get_db
+from api.enums import ExportFormat
 from api.services import transaction_service
-from api.schemas import output_schema as out_sch
+from api.schemas import input_schema as in_sch, output_schema as out_sch
 
 router = APIRouter(tags=["Transactions"])
 
 
+# Declared before /transactions/{transaction_id}, which would otherwise
+# match "export" as an id.
+@router.get("/transactions/export", response_class=StreamingResponse,
+            responses={200: {"content": {
+                media_type: {} for media_type
+                in transaction_service.EXPORT_MEDIA_TYPES.values()}}})
+def export_transactions(
+        date_range: in_sch.DateRange = Depends(in_sch.get_date_range),
+        filters: in_sch.TransactionFilterParams = Depends(),
+        export_format: ExportFormat = Query(ExportFormat.CSV, alias="format"),
+        db: Session = Depends(get_db)
+):
+    """
+    Stream the transactions within a date range, in date order, as CSV or
+    NDJSON.
+    """
+    return StreamingResponse(
+        transaction_service.export_transactions(db, date_range, filters,
+                                                export_format),
+        media_type=transaction_service.EXPORT_MEDIA_TYPES[export_format],
+        headers={"Content-Disposition": f'attachment; filename='
+                                        f'"transactions.{export_format.value}"'}
+    )
+
+
 @router.get("/transactions/{transaction_id}",
             response_model=out_sch.Transaction)
 def read_transaction(transaction_id: int, db: Session = Depends(get_db)):
@@ -8,8 +8,10 @@ required for the various API endpoints.
 """
 
 from datetime import datetime, time
+from typing import List, Optional
 from fastapi import Query
 from pydantic import BaseModel, PositiveInt, Field, conint
+from api.enums import SearchType
 from api.schemas.base_schema import (PharmacyBase, MaskBase, TransactionBase,
                                      UserBase, PharmacyMaskBase,
                                      PharmacyHourBase)
@@ -40,6 +42,24 @@ def get_time(
     return TimeQuery(query_time=query_time)
 
 
+class TimeRange(BaseModel):
+    """
+    Represents a range of times within a day, which may end on the next day.
+    """
+    start_time: time
+    end_time: time
+
+
+def get_time_range(
+        start_time: time = Query(..., example="22:00:00"),
+        end_time: time = Query(..., example="02:00:00")
+) -> TimeRange:
+    """
+    Dependency function to get a time range from query parameters.
+    """
+    return TimeRange(start_time=start_time, end_time=end_time)
+
+
 class DateRange(BaseModel):
     """
     Represents a date range with start and end dates.
@@ -64,6 +84,28 @@ class PagingParams(BaseModel):
     """
     skip: conint(ge=0) = Field(default=0)
     limit: PositiveInt = Field(default=10)
+    cursor: Optional[str] = Field(
+        default=None,
+        description="X-Next-Cursor of the previous page; replaces skip"
+    )
+
+
+class MaskFilterParams(BaseModel):
+    """
+    Represents mask attribute filters.
+    """
+    brand: Optional[str] = None
+    color: Optional[str] = None
+    pack_size: Optional[PositiveInt] = None
+
+
+class TransactionFilterParams(BaseModel):
+    """
+    Represents optional filters on the parties of transactions.
+    """
+    user_id: Optional[PositiveInt] = None
+    pharmacy_id: Optional[PositiveInt] = None
+    mask_id: Optional[PositiveInt] = None
 
 
 class CountRangeParams(BaseModel):
@@ -86,6 +128,7 @@ class PharmacyCreate(PharmacyBase):
     """
     Represents the creation of a new pharmacy.
     """
+    cash_balance: float
 
 
 class PharmacyHourCreate(PharmacyHourBase):
@@ -122,3 +165,20 @@ class UserCreate(UserBase):
     """
     Represents the creation of a new user.
     """
+
+
+class OpenStatusRequest(BaseModel):
+    """
+    Represents the pharmacies whose open status is asked at a time.
+    """
+    pharmacy_ids: List[int] = Field(..., min_length=1, max_length=1000)
+    at: datetime
+
+
+class SearchBatchRequest(BaseModel):
+    """
+    Represents a batch of search terms resolved in one request.
+    """
+    terms: List[str] = Field(..., min_length=1, max_length=10000)
+    search_type: SearchType = SearchType.ALL
+    top_k: conint(ge=1, le=100) = Field(default=5)
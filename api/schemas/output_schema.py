@@ -5,7 +5,8 @@ output_schema.py
 This module defines the Pydantic models for output schemas.
 """
 
-from typing import List
+from datetime import datetime
+from typing import List, Optional, Union
 from pydantic import BaseModel, conint, Field
 from api.schemas.base_schema import (PharmacyHourBase, PharmacyBase, MaskBase,
                                      PharmacyMaskBase, TransactionBase,
@@ -51,7 +52,10 @@ class PharmacyWithHours(Pharmacy):
     """
     Model representing a pharmacy with its hours.
     """
-    opening_hours: List[PharmacyHour] = []
+    opening_hours: List[PharmacyHour] = Field(
+        default=[],
+        description="Listed when asked for with include=opening_hours"
+    )
 
 
 class PharmacyWithCount(Pharmacy):
@@ -66,6 +70,9 @@ class Mask(OrmBase, MaskBase):
     Model representing a mask.
     """
     id: int
+    brand: Optional[str] = None
+    color: Optional[str] = None
+    pack_size: Optional[int] = None
 
 
 class MaskWithPrice(Mask):
@@ -73,6 +80,7 @@ class MaskWithPrice(Mask):
     Model representing a mask with its price.
     """
     price: float
+    unit_price: Optional[float] = None
 
 
 class PharmacyMask(OrmBase, PharmacyMaskBase):
@@ -101,7 +109,7 @@ class Transaction(OrmBase, TransactionBase):
     user_id: int
     pharmacy_id: int
     mask_id: int
-    mask: MaskWithPrice
+    mask: Mask
 
 
 class TransactionSummary(OrmBase, BaseModel):
@@ -137,7 +145,56 @@ class UserTransactionSummary(OrmBase, BaseModel):
     total_amount: float
 
 
+class FacetCount(BaseModel):
+    """
+    Model representing the number of masks with one attribute value.
+    """
+    value: Union[int, str]
+    count: int
+
+
+class MaskFacets(BaseModel):
+    """
+    Model representing the mask counts per brand, color and pack size.
+    """
+    brand: List[FacetCount]
+    color: List[FacetCount]
+    pack_size: List[FacetCount]
+
+
+class OpenStatus(BaseModel):
+    """
+    Model representing whether a pharmacy is open at a time. An open
+    pharmacy has the time it closes, a closed one the time it next opens;
+    neither is set when the state never changes.
+    """
+    pharmacy_id: int
+    is_open: bool
+    opens_at: Optional[datetime] = None
+    closes_at: Optional[datetime] = None
+
+
 class SearchResult(OrmBase, BaseModel):
     id: int
     name: str
     type: str
+
+
+class SearchBatchResult(BaseModel):
+    """
+    Model representing the matches of one term of a batch search.
+    """
+    term: str
+    matches: List[SearchResult]
+
+
+class SearchCacheStats(BaseModel):
+    """
+    Model representing the search cache counters.
+    """
+    entries: int
+    max_entries: int
+    hits: int
+    misses: int
+    evictions: int
+    invalidations: int
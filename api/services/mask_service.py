@@ -10,9 +10,10 @@ from sqlalchemy.orm import Session
 import api.crud.mask_crud
 import api.database.db_models as db_mod
 from api.crud import mask_crud
-from api.enums import SortType
-from api.schemas import input_schema as in_sch
-from api.utils.tools import exception_handler
+from api.enums import SearchType, SortType
+from api.schemas import input_schema as in_sch, output_schema as out_sch
+from api.services import report_service, search_service
+from api.utils.tools import exception_handler, parse_mask_name
 
 
 @exception_handler
@@ -28,8 +29,11 @@ def create_mask(db: Session, mask_data: in_sch.MaskCreate):
     """
     Create a new mask to the database.
     """
-    new_mask = db_mod.Mask(**mask_data.dict())
-    return mask_crud.create_mask(db, new_mask)
+    new_mask = db_mod.Mask(**mask_data.dict(),
+                           **parse_mask_name(mask_data.name)._asdict())
+    mask = mask_crud.create_mask(db, new_mask)
+    search_service.entity_created(SearchType.MASK, mask)
+    return mask
 
 
 @exception_handler
@@ -46,6 +50,26 @@ def list_pharmacy_masks(
                                                   paging)
 
 
+@exception_handler
+def list_masks(
+        db: Session,
+        filters: in_sch.MaskFilterParams,
+        paging: in_sch.PagingParams
+):
+    """
+    List the masks matching the brand, color and pack size filters.
+    """
+    return mask_crud.list_masks(db, filters, paging)
+
+
+@exception_handler
+def get_mask_facets(db: Session, filters: in_sch.MaskFilterParams):
+    """
+    Count the matching masks per brand, color and pack size.
+    """
+    return mask_crud.count_mask_facets(db, filters)
+
+
 @exception_handler
 def get_mask_summary(
         db: Session,
@@ -55,4 +79,7 @@ def get_mask_summary(
     Get the total amount of masks and dollar value of transactions within
     a date range.
     """
-    return api.crud.mask_crud.get_mask_summary(db, date_range)
+    return report_service.cached_report(
+        db, 'mask_summary', date_range, '',
+        lambda: api.crud.mask_crud.get_mask_summary(db, date_range),
+        out_sch.TransactionSummary)
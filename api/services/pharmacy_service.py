@@ -4,14 +4,44 @@ pharmacy_service.py
 
 This module provides service layer functions for managing pharmacy operations.
 """
-from datetime import time
+from collections import defaultdict
+from datetime import time, timedelta
+from typing import List
 
+import numpy as np
 from sqlalchemy.orm import Session
 from api.crud import pharmacy_crud
 import api.database.db_models as db_mod
-from api.enums import DayOfWeek, ComparisonType
+from api.enums import (DayOfWeek, ComparisonType, MaskCountBackend,
+                       PharmacyInclude, SearchType)
 from api.schemas import input_schema as in_sch
-from api.utils.tools import exception_handler
+from api.services import search_service
+from api.schemas import output_schema as out_sch
+from api.utils.cache import LRUCache
+from api.utils.loading import serialize_page
+from api.utils.pagination import decode_cursor
+from api.utils.price_snapshot import PriceSnapshot, build_price_snapshot
+from api.utils.schedule import WeeklySchedule, datetime_minute_of_week
+from api.utils.tools import (MINUTES_PER_WEEK, exception_handler,
+                             is_past_minute)
+from config.config import (MASK_COUNT_BACKEND, PRICE_SNAPSHOT_PATH,
+                           SCHEDULE_CACHE_SIZE, SCHEDULE_CACHE_TTL)
+
+# Weekly schedules by pharmacy id. Hours are only written by ETL, so entries
+# are not invalidated but expire.
+schedule_cache = LRUCache(SCHEDULE_CACHE_SIZE, SCHEDULE_CACHE_TTL)
+mask_count_backend = MaskCountBackend(MASK_COUNT_BACKEND)
+price_snapshot = PriceSnapshot(PRICE_SNAPSHOT_PATH)
+
+
+def _pharmacy_schema(include: List[PharmacyInclude]):
+    """
+    Choose the response model of listed pharmacies from the requested
+    relations.
+    """
+    if PharmacyInclude.OPENING_HOURS in include:
+        return out_sch.PharmacyWithHours
+    return out_sch.Pharmacy
 
 
 @exception_handler
@@ -25,12 +55,15 @@ def get_pharmacy_details(db: Session, pharmacy_id: int):
 @exception_handler
 def list_pharmacies(
         db: Session,
-        paging: in_sch.PagingParams
+        paging: in_sch.PagingParams,
+        include: List[PharmacyInclude] = ()
 ):
     """
     Get a list of pharmacies with pagination.
     """
-    return pharmacy_crud.list_pharmacies(db, paging)
+    schema = _pharmacy_schema(include)
+    return serialize_page(
+        pharmacy_crud.list_pharmacies(db, paging, schema), schema)
 
 
 @exception_handler
@@ -39,12 +72,86 @@ def list_pharmacies_open_at(
         query_time: time,
         day_of_week: DayOfWeek,
         paging: in_sch.PagingParams,
+        include: List[PharmacyInclude] = ()
 ):
     """
     Retrieve pharmacies open at a specific time and day of the week.
     """
-    return pharmacy_crud.list_pharmacies_open_at(db, query_time, day_of_week,
-                                                 paging)
+    schema = _pharmacy_schema(include)
+    return serialize_page(pharmacy_crud.list_pharmacies_open_at(
+        db, query_time, day_of_week, paging, schema), schema)
+
+
+@exception_handler
+def list_pharmacies_open_during(
+        db: Session,
+        day_of_week: DayOfWeek,
+        time_range: in_sch.TimeRange,
+        paging: in_sch.PagingParams,
+        include: List[PharmacyInclude] = ()
+):
+    """
+    Retrieve pharmacies open at any moment of a time range on a day of the
+    week.
+    """
+    schema = _pharmacy_schema(include)
+    return serialize_page(pharmacy_crud.list_pharmacies_open_during(
+        db, day_of_week, time_range, paging, schema), schema)
+
+
+def _get_schedules(db: Session, pharmacy_ids):
+    """
+    Get the weekly schedules of some pharmacies, loading the ones not cached
+    in one query.
+    """
+    schedules = {}
+    for pharmacy_id in pharmacy_ids:
+        schedule = schedule_cache.get(pharmacy_id)
+        if schedule is not None:
+            schedules[pharmacy_id] = schedule
+
+    missing = [pharmacy_id for pharmacy_id in pharmacy_ids
+               if pharmacy_id not in schedules]
+    if missing:
+        spans = defaultdict(list)
+        for pharmacy_id, minutes in pharmacy_crud.list_open_intervals(
+                db, missing):
+            spans[pharmacy_id].append((minutes.lower, minutes.upper))
+        for pharmacy_id in missing:
+            schedules[pharmacy_id] = WeeklySchedule(spans[pharmacy_id])
+            schedule_cache.put(pharmacy_id, schedules[pharmacy_id])
+    return schedules
+
+
+@exception_handler
+def get_open_statuses(db: Session, status_request: in_sch.OpenStatusRequest):
+    """
+    Tell for each pharmacy whether it is open at a time, and when it next
+    closes or opens.
+    """
+    past_minute = is_past_minute(status_request.at)
+    at = status_request.at.replace(second=0, microsecond=0)
+    minute = datetime_minute_of_week(at)
+    pharmacy_ids = list(dict.fromkeys(status_request.pharmacy_ids))
+    schedules = _get_schedules(db, pharmacy_ids)
+
+    statuses = []
+    for pharmacy_id in pharmacy_ids:
+        start = at
+        is_open, minutes = schedules[pharmacy_id].status(minute)
+        if past_minute and is_open and minutes == 1:
+            # Past the start of the closing minute, the pharmacy has closed.
+            start = at + timedelta(minutes=1)
+            is_open, minutes = schedules[pharmacy_id].status(
+                (minute + 1) % MINUTES_PER_WEEK)
+        status = out_sch.OpenStatus(pharmacy_id=pharmacy_id, is_open=is_open)
+        if minutes is not None and is_open:
+            # The span ends after the last open minute, the closing time.
+            status.closes_at = start + timedelta(minutes=minutes - 1)
+        elif minutes is not None:
+            status.opens_at = start + timedelta(minutes=minutes)
+        statuses.append(status)
+    return statuses
 
 
 @exception_handler
@@ -58,10 +165,59 @@ def list_pharmacies_by_mask_count(
     """
     List all pharmacies with more or less than x mask products within a price range.
     """
+    if mask_count_backend == MaskCountBackend.SNAPSHOT:
+        page = _page_snapshot_mask_counts(db, comparison, count, price_range,
+                                          paging)
+        if page is not None:
+            return page
     return pharmacy_crud.list_pharmacies_by_mask_count(db, comparison, count,
                                                        price_range, paging)
 
 
+def _page_snapshot_mask_counts(
+        db: Session,
+        comparison: ComparisonType,
+        count: int,
+        price_range: in_sch.PriceRangeParams,
+        paging: in_sch.PagingParams
+):
+    """
+    Count, filter and page the pharmacies in the price snapshot, so that
+    only the pharmacies of the page are read from the database.
+
+    Return None when the cursor's pharmacy is no longer in the snapshot,
+    which leaves the page to Postgres.
+    """
+    pharmacy_ids, mask_counts = price_snapshot.count_masks_by_name(
+        price_range.min_price, price_range.max_price)
+    if comparison == ComparisonType.MORE:
+        keep = mask_counts > count
+    else:
+        keep = (mask_counts > 0) & (mask_counts < count)
+
+    start = paging.skip
+    if paging.cursor:
+        key = decode_cursor(paging.cursor, pharmacy_crud.PHARMACY_SORT_KEYS)
+        last_id = pharmacy_crud.get_pharmacy_id_by_name(db, key['name'])
+        last = np.flatnonzero(pharmacy_ids == last_id)
+        if not len(last):
+            return None
+        start = int(np.count_nonzero(keep[:last[0] + 1]))
+    page = np.flatnonzero(keep)[start:start + paging.limit]
+    return pharmacy_crud.list_pharmacies_with_mask_counts(
+        db, list(zip(pharmacy_ids[page].tolist(),
+                     mask_counts[page].tolist())), paging.limit)
+
+
+def rebuild_price_snapshot(db: Session, reuse_running: bool = False):
+    """
+    Rewrite the price snapshot file from pharmacy_masks. Every worker maps
+    the new file on its next count. With ``reuse_running``, a rebuild
+    already running in another process is waited for and kept.
+    """
+    build_price_snapshot(db, price_snapshot.path, reuse_running)
+
+
 @exception_handler
 def create_pharmacy(
         db: Session,
@@ -71,4 +227,6 @@ def create_pharmacy(
     Create a new pharmacy to the database.
     """
     new_pharmacy = db_mod.Pharmacy(**pharmacy_data.dict())
-    return pharmacy_crud.create_pharmacy(db, new_pharmacy)
+    pharmacy = pharmacy_crud.create_pharmacy(db, new_pharmacy)
+    search_service.entity_created(SearchType.PHARMACY, pharmacy)
+    return pharmacy
@@ -0,0 +1,58 @@
+"""
+report_service.py
+-----------------
+
+This module provides a database-backed cache for the results of date-range
+reports, shared by every worker and kept across restarts.
+"""
+from datetime import datetime, time, timedelta
+from typing import Callable, List, Type
+
+from pydantic import BaseModel
+from sqlalchemy.orm import Session
+
+from api.crud import report_cache_crud
+from api.schemas import input_schema as in_sch
+from config.config import REPORT_CACHE_ENABLED, REPORT_CACHE_TTL
+
+report_cache_enabled = REPORT_CACHE_ENABLED
+report_cache_ttl = REPORT_CACHE_TTL
+
+
+def cached_report(
+        db: Session,
+        report: str,
+        date_range: in_sch.DateRange,
+        params: str,
+        compute: Callable[[], List[BaseModel]],
+        schema: Type[BaseModel]
+):
+    """
+    Return the cached result of a report, or compute and cache it.
+
+    Ranges ending before today cover closed days, so their results are kept
+    until the transactions of those days change. Ranges reaching today or
+    later expire after the cache TTL.
+    """
+    start, end = date_range.start_date, date_range.end_date
+    if not report_cache_enabled or start.tzinfo or end.tzinfo:
+        return compute()
+    now = datetime.now()
+    closed = end < datetime.combine(now.date(), time())
+    if not closed and report_cache_ttl <= 0:
+        return compute()
+
+    if closed:
+        report_cache_crud.lock_for_caching(db)
+    result = report_cache_crud.get_report(db, report, start, end, params,
+                                          now)
+    if result is not None:
+        db.commit()
+        return [schema(**row) for row in result]
+
+    rows = compute()
+    report_cache_crud.save_report(
+        db, report, start, end, params, [row.model_dump() for row in rows],
+        None if closed else now + timedelta(seconds=report_cache_ttl))
+    db.commit()
+    return rows
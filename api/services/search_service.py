@@ -4,12 +4,158 @@ search_service.py
 
 This module provides service layer functions for managing search operations.
 """
-from sqlalchemy import desc
+from sqlalchemy import (REAL, Integer, String, and_, cast, column, literal,
+                        or_, select, true, tuple_, union_all, values)
 from sqlalchemy.orm import Session
 
 from api.crud import mask_crud, pharmacy_crud
-from api.enums import SearchType
+from api.database import db_models as db_mod
+from api.enums import SearchBackend, SearchType
 from api.schemas import input_schema as in_sch
+from api.utils.cache import LRUCache
+from api.utils.pagination import Page, decode_cursor, encode_cursor
+from api.utils.prefix_index import PrefixIndex
+from api.utils.tools import set_similarity_threshold
+from api.utils.trigram_index import TrigramIndex, normalize, similarity
+from config.config import (SEARCH_BACKEND, SEARCH_CACHE_SIZE,
+                           SEARCH_CACHE_TTL, SIMILARITY_THRESHOLD)
+
+search_backend = SearchBackend(SEARCH_BACKEND)
+search_index = TrigramIndex()
+prefix_index = PrefixIndex()
+search_cache = LRUCache(SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL)
+# Ranking key of a search result: similarity descending, then pharmacies
+# before masks, then id.
+SEARCH_CURSOR_KEYS = ['similarity', 'type', 'id']
+
+
+def rebuild_search_index(db: Session):
+    """
+    Load every pharmacy and mask name into the in-memory search and prefix
+    indexes.
+    """
+    pharmacies = db.query(db_mod.Pharmacy.id, db_mod.Pharmacy.name).all()
+    masks = db.query(db_mod.Mask.id, db_mod.Mask.name).all()
+    entities = (
+        [(SearchType.PHARMACY.value, id_, name) for id_, name in pharmacies]
+        + [(SearchType.MASK.value, id_, name) for id_, name in masks]
+    )
+    search_index.rebuild(entities)
+    prefix_index.rebuild(entities)
+
+
+def _entity_types(search_type: SearchType):
+    """
+    List the entity types a search covers, in the order that breaks ranking
+    ties: pharmacies before masks.
+    """
+    return [entity_type
+            for entity_type in (SearchType.PHARMACY, SearchType.MASK)
+            if search_type in {entity_type, SearchType.ALL}]
+
+
+def entity_created(entity_type: SearchType, entity):
+    """
+    Add a newly committed pharmacy or mask to the in-memory indexes and
+    drop the cached searches whose results it could change.
+    """
+    if search_backend == SearchBackend.MEMORY and search_index.loaded:
+        search_index.add(entity_type.value, entity.id, entity.name)
+        prefix_index.add(entity_type.value, entity.id, entity.name)
+
+    search_cache.invalidate(
+        lambda key: key[1] in {entity_type, SearchType.ALL}
+        and similarity(key[0], entity.name) > SIMILARITY_THRESHOLD
+    )
+
+
+def get_cache_stats():
+    """
+    Get the search cache counters.
+    """
+    return search_cache.stats()
+
+
+def _ranked_matches(db: Session, search_term, search_type: SearchType):
+    """
+    Build the union of the trigram searches a search type covers, with the
+    type_order column that breaks similarity ties.
+    """
+    searches = {
+        SearchType.PHARMACY: pharmacy_crud.search_pharmacies,
+        SearchType.MASK: mask_crud.search_masks,
+    }
+    return union_all(*[
+        searches[entity_type](db, search_term).add_columns(
+            literal(order).label('type_order')).statement
+        for order, entity_type in enumerate(_entity_types(search_type))
+    ])
+
+
+def _search_page(results, paging: in_sch.PagingParams):
+    """
+    Wrap search results in a page, with a cursor holding the ranking key of
+    the last result when the page is full.
+    """
+    next_cursor = None
+    if len(results) == paging.limit:
+        last = results[-1]
+        next_cursor = encode_cursor({name: last[name]
+                                     for name in SEARCH_CURSOR_KEYS})
+    return Page(results, next_cursor)
+
+
+def _search_in_memory(
+        db: Session,
+        search_term: str,
+        search_type: SearchType,
+        paging: in_sch.PagingParams
+):
+    if not search_index.loaded:
+        rebuild_search_index(db)
+
+    entity_types = [entity_type.value
+                    for entity_type in _entity_types(search_type)]
+    if paging.cursor:
+        after = decode_cursor(paging.cursor, SEARCH_CURSOR_KEYS)
+        return search_index.search(
+            search_term, entity_types, SIMILARITY_THRESHOLD, paging.limit,
+            after=tuple(after.values()))
+    results = search_index.search(search_term, entity_types,
+                                  SIMILARITY_THRESHOLD,
+                                  paging.skip + paging.limit)
+    return results[paging.skip:]
+
+
+def _search_postgres(
+        db: Session,
+        search_term: str,
+        search_type: SearchType,
+        paging: in_sch.PagingParams
+):
+    set_similarity_threshold(db, SIMILARITY_THRESHOLD)
+
+    matches = _ranked_matches(db, search_term, search_type).subquery()
+    query = select(
+        matches.c.id, matches.c.name, matches.c.similarity, matches.c.type
+    ).order_by(matches.c.similarity.desc(), matches.c.type_order,
+               matches.c.id)
+    if paging.cursor:
+        after = decode_cursor(paging.cursor, SEARCH_CURSOR_KEYS)
+        # Compare as real, the type similarity() returns.
+        similarity = cast(literal(after['similarity']), REAL)
+        type_order = {entity_type.value: order for order, entity_type
+                      in enumerate(_entity_types(search_type))}
+        query = query.where(or_(
+            matches.c.similarity < similarity,
+            and_(matches.c.similarity == similarity,
+                 tuple_(matches.c.type_order, matches.c.id) > tuple_(
+                     type_order.get(after['type'], -1), after['id']))
+        ))
+    else:
+        query = query.offset(paging.skip)
+
+    return [row._asdict() for row in db.execute(query.limit(paging.limit))]
 
 
 def search_entities(
@@ -18,18 +164,97 @@ def search_entities(
         search_type: SearchType,
         paging: in_sch.PagingParams
 ):
-    queries = []
-    if search_type in {SearchType.PHARMACY, SearchType.ALL}:
-        pharmacies = pharmacy_crud.search_pharmacies(db, search_term)
-        queries.append(pharmacies)
+    # Terms with the same trigrams give the same results.
+    key = (normalize(search_term), search_type, paging.skip, paging.limit,
+           paging.cursor)
+    results = search_cache.get(key)
+    if results is not None:
+        return results
+
+    if search_backend == SearchBackend.MEMORY:
+        results = _search_in_memory(db, search_term, search_type, paging)
+    else:
+        results = _search_postgres(db, search_term, search_type, paging)
+    results = _search_page(results, paging)
+    search_cache.put(key, results)
+    return results
+
+
+def autocomplete(
+        db: Session,
+        prefix: str,
+        search_type: SearchType,
+        limit: int
+):
+    """
+    Complete a name prefix to pharmacies and masks ordered by name, breaking
+    ties like search results.
+    """
+    entity_types = _entity_types(search_type)
+    if search_backend == SearchBackend.MEMORY:
+        if not prefix_index.loaded:
+            rebuild_search_index(db)
+        return prefix_index.search(
+            prefix, [entity_type.value for entity_type in entity_types], limit)
+
+    autocompletes = {
+        SearchType.PHARMACY: pharmacy_crud.autocomplete_pharmacies,
+        SearchType.MASK: mask_crud.autocomplete_masks,
+    }
+    queries = [
+        autocompletes[entity_type](db, prefix, limit).add_columns(
+            literal(order).label('type_order'))
+        for order, entity_type in enumerate(entity_types)
+    ]
+    results = queries[0].union_all(*queries[1:]).order_by(
+        'sort_name', 'type_order', 'id').limit(limit)
+    return [{'id': row.id, 'name': row.name, 'type': row.type}
+            for row in results]
+
+
+def _search_batch_statement(
+        db: Session,
+        search_terms: list,
+        search_type: SearchType,
+        top_k: int
+):
+    """
+    Build one statement finding the top-k matches of every term: the terms
+    are a VALUES list joined LATERAL to the trigram-indexed searches.
+    """
+    terms = values(column('position', Integer), column('term', String),
+                   name='terms').data(list(enumerate(search_terms)))
+    matches = _ranked_matches(db, terms.c.term, search_type)
+    ranking = matches.selected_columns
+    matches = matches.order_by(
+        ranking.similarity.desc(), ranking.type_order, ranking.id
+    ).limit(top_k).lateral('matches')
+    return select(terms.c.position, matches).select_from(terms).join(
+        matches, true()).order_by(terms.c.position)
 
-    if search_type in {SearchType.MASK, SearchType.ALL}:
-        masks = mask_crud.search_masks(db, search_term)
-        queries.append(masks)
 
-    results = []
-    if queries:
-        results = queries[0].union_all(*queries[1:]).order_by(
-            desc('similarity')).offset(paging.skip).limit(paging.limit)
+def search_batch(db: Session, batch: in_sch.SearchBatchRequest):
+    """
+    Resolve many search terms at once, returning the top-k matches of each
+    term ranked like search results.
+    """
+    results = [{'term': term, 'matches': []} for term in batch.terms]
+    if search_backend == SearchBackend.MEMORY:
+        if not search_index.loaded:
+            rebuild_search_index(db)
+        entity_types = [entity_type.value
+                        for entity_type in _entity_types(batch.search_type)]
+        for result in results:
+            result['matches'] = search_index.search(
+                result['term'], entity_types, SIMILARITY_THRESHOLD,
+                batch.top_k)
+        return results
 
+    set_similarity_threshold(db, SIMILARITY_THRESHOLD)
+    rows = db.execute(_search_batch_statement(
+        db, batch.terms, batch.search_type, batch.top_k))
+    for row in rows:
+        results[row.position]['matches'].append(
+            {'id': row.id, 'name': row.name, 'similarity': row.similarity,
+             'type': row.type})
     return results
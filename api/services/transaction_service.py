@@ -5,11 +5,52 @@ transactions_service.py
 This module provides service layer functions for managing transaction operations.
 """
 
+import csv
+import io
+import json
+from datetime import date
+from itertools import islice
+
 from sqlalchemy.orm import Session
 from api.crud import transaction_crud
 import api.database.db_models as db_mod
+from api.enums import ExportFormat
 from api.schemas import input_schema as in_sch
+from api.services import user_service
 from api.utils.tools import exception_handler
+from config.config import (EXPORT_BATCH_SIZE,
+                           TRANSACTION_PARTITION_MONTHS_AHEAD)
+
+EXPORT_COLUMNS = ['id', 'user_id', 'pharmacy_id', 'mask_id',
+                  'transaction_amount', 'date']
+EXPORT_MEDIA_TYPES = {
+    ExportFormat.CSV: 'text/csv',
+    ExportFormat.NDJSON: 'application/x-ndjson',
+}
+
+# Months known to have a partition, so that most purchases skip the check.
+partitioned_months = set()
+
+
+def ensure_partitions(db: Session, transaction_date: date, today: date = None):
+    """
+    Create the monthly partitions when the month of a transaction, or the
+    last month kept ahead of today, has none yet.
+    """
+    month = (today or date.today()).replace(day=1)
+    for _ in range(TRANSACTION_PARTITION_MONTHS_AHEAD):
+        month = transaction_crud.next_month(month)
+    months = {month, transaction_date.replace(day=1)}
+    if months <= partitioned_months:
+        return
+    partitioned_months.update(transaction_crud.list_partitions(db))
+    legacy_end = transaction_crud.get_legacy_partition_end(db)
+    partitioned_months.update(
+        month for month in months if legacy_end and month < legacy_end)
+    if not months <= partitioned_months:
+        transaction_crud.create_partitions(
+            db, TRANSACTION_PARTITION_MONTHS_AHEAD, today)
+        partitioned_months.update(transaction_crud.list_partitions(db))
 
 
 @exception_handler
@@ -29,4 +70,49 @@ def create_transaction(
     Create a new transaction to the database.
     """
     new_transaction = db_mod.Transaction(**transaction_data.dict())
-    return transaction_crud.create_transaction(db, new_transaction)
+    transaction, rollup_version = transaction_crud.create_transaction(
+        db, new_transaction)
+    ensure_partitions(db, transaction.date.date())
+    user_service.transaction_created(transaction, rollup_version)
+    return transaction
+
+
+def _csv_chunk(rows) -> str:
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator='\n').writerows(
+        (*row[:-1], row[-1].isoformat()) for row in rows)
+    return buffer.getvalue()
+
+
+def _ndjson_chunk(rows) -> str:
+    return ''.join(
+        json.dumps(dict(zip(EXPORT_COLUMNS, (
+            *row[:4], float(row[4]), row[5].isoformat()
+        ))), separators=(',', ':')) + '\n'
+        for row in rows)
+
+
+def export_transactions(
+        db: Session,
+        date_range: in_sch.DateRange,
+        filters: in_sch.TransactionFilterParams,
+        export_format: ExportFormat,
+        batch_size: int = EXPORT_BATCH_SIZE
+):
+    """
+    Generate the transactions within a date range as CSV or NDJSON text,
+    one chunk per batch of rows.
+
+    The rows come from a server-side cursor on a session of the generator's
+    own, which stays open while the response streams. A CSV header is sent
+    before the query runs.
+    """
+    if export_format == ExportFormat.CSV:
+        yield ','.join(EXPORT_COLUMNS) + '\n'
+    chunk = _csv_chunk if export_format == ExportFormat.CSV \
+        else _ndjson_chunk
+    with Session(bind=db.get_bind()) as export_db:
+        rows = iter(transaction_crud.list_transactions_for_export(
+            export_db, date_range, filters, batch_size))
+        while batch := list(islice(rows, batch_size)):
+            yield chunk(batch)
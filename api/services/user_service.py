@@ -5,11 +5,71 @@ user_service.py
 This module provides service layer functions for managing user operations.
 """
 
+import threading
+
 from sqlalchemy.orm import Session
 
-from api.crud import user_crud
-from api.schemas import input_schema as in_sch
+import api.database.db_models as db_mod
+from api.crud import transaction_crud, user_crud
+from api.enums import TopUsersBackend
+from api.schemas import input_schema as in_sch, output_schema as out_sch
+from api.services import report_service
+from api.utils.leaderboard import Leaderboard
 from api.utils.tools import exception_handler
+from config.config import LEADERBOARD_WINDOW_DAYS, TOP_USERS_BACKEND
+
+top_users_backend = TopUsersBackend(TOP_USERS_BACKEND)
+leaderboard = Leaderboard(LEADERBOARD_WINDOW_DAYS)
+# Held by the request rebuilding the leaderboard; other requests meanwhile
+# go to Postgres rather than wait.
+leaderboard_rebuild_lock = threading.Lock()
+
+
+def rebuild_leaderboard(db: Session):
+    """
+    Load the user totals, all time and per day of the sliding window, into
+    the in-memory leaderboard, reading them in one snapshot together with
+    the rollup version they reflect.
+    """
+    engine = db.get_bind().execution_options(
+        isolation_level='REPEATABLE READ')
+    with Session(bind=engine) as snapshot:
+        version = transaction_crud.get_rollup_version(snapshot)
+        leaderboard.rebuild(
+            user_crud.list_user_totals(snapshot),
+            user_crud.list_user_daily_totals(snapshot,
+                                             leaderboard.first_day()),
+            transaction_crud.get_date_range(snapshot),
+            version
+        )
+
+
+def transaction_created(transaction: db_mod.Transaction, version: int):
+    """
+    Count a newly committed transaction, committed as the given rollup
+    version, in the in-memory leaderboard.
+    """
+    if top_users_backend == TopUsersBackend.LEADERBOARD:
+        leaderboard.add(transaction.user_id, transaction.transaction_amount,
+                        transaction.date, version)
+
+
+def _top_from_leaderboard(db: Session, date_range: in_sch.DateRange,
+                          limit: int):
+    """
+    Rank the users with the leaderboard, rebuilding it first if the daily
+    rollups changed since, or return None to leave the ranking to Postgres.
+    """
+    version = transaction_crud.get_rollup_version(db)
+    if not leaderboard.is_current(version):
+        if not leaderboard_rebuild_lock.acquire(blocking=False):
+            return None
+        try:
+            rebuild_leaderboard(db)
+        finally:
+            leaderboard_rebuild_lock.release()
+    return leaderboard.top(date_range.start_date, date_range.end_date,
+                           limit, version)
 
 
 @exception_handler
@@ -22,4 +82,19 @@ def list_top_users_by_transaction_amount(
     Retrieve the top x users by total transaction amount of masks within
     a date range.
     """
-    return user_crud.list_top_users_by_transaction_amount(db, date_range, limit)
+    if top_users_backend == TopUsersBackend.LEADERBOARD:
+        top = _top_from_leaderboard(db, date_range, limit)
+        if top is not None:
+            names = user_crud.get_user_names(
+                db, [user_id for user_id, _ in top])
+            return [out_sch.UserTransactionSummary(
+                id=user_id,
+                name=names[user_id],
+                total_amount=amount)
+                for user_id, amount in top]
+
+    return report_service.cached_report(
+        db, 'top_users', date_range, f'limit={limit}',
+        lambda: user_crud.list_top_users_by_transaction_amount(
+            db, date_range, limit),
+        out_sch.UserTransactionSummary)
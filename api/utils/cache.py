@@ -0,0 +1,83 @@
+"""
+cache.py
+--------
+
+This module provides a thread-safe LRU cache whose entries also expire
+after a time to live.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    Cache holding at most ``max_entries`` values, each for at most
+    ``ttl`` seconds. A ``max_entries`` of 0 disables caching.
+    """
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        """
+        Return the cached value for the key, or None on a miss.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                del self._entries[key]
+                self.evictions += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        """
+        Store a value, evicting the least recently used entries when full.
+        """
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, predicate=None):
+        """
+        Drop the entries whose key matches the predicate, or all of them.
+        """
+        with self._lock:
+            if predicate is None:
+                keys = list(self._entries)
+            else:
+                keys = [key for key in self._entries if predicate(key)]
+            for key in keys:
+                del self._entries[key]
+            self.invalidations += len(keys)
+
+    def stats(self):
+        """
+        Return the cache counters and current size.
+        """
+        with self._lock:
+            return {'entries': len(self._entries),
+                    'max_entries': self.max_entries,
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'invalidations': self.invalidations}
@@ -0,0 +1,187 @@
+"""
+leaderboard.py
+--------------
+
+This module provides an in-memory leaderboard of the users with the
+highest transaction amount, all time and over a sliding window of days,
+kept in step with the daily rollups.
+"""
+
+import threading
+from bisect import bisect_left, insort
+from datetime import date, datetime, time, timedelta
+
+
+class _Board:
+    """
+    Transaction count and amount per user, with the users kept sorted by
+    amount descending and then by id.
+    """
+
+    def __init__(self):
+        self.totals = {}
+        self.order = []
+
+    def add(self, user_id: int, count: int, amount):
+        """
+        Add to the count and amount of a user, dropping the user once no
+        transaction is left.
+        """
+        total = self.totals.pop(user_id, None)
+        if total is not None:
+            del self.order[bisect_left(self.order, (-total[1], user_id))]
+            count, amount = total[0] + count, total[1] + amount
+        if count:
+            self.totals[user_id] = (count, amount)
+            insort(self.order, (-amount, user_id))
+
+    def top(self, limit: int):
+        return [(user_id, -amount) for amount, user_id in self.order[:limit]]
+
+
+class Leaderboard:
+    """
+    Top users by transaction amount over all transactions and over those
+    dated within the last ``window_days`` days, today included.
+
+    Window days are kept as buckets of per-user totals, subtracted from the
+    window board as they expire. The leaderboard holds the version of the
+    daily rollups it was built from, and applies a purchase only when it
+    carries the next version. Any other change, such as a purchase in
+    another process or an ETL load, leaves it stale until it is rebuilt.
+    """
+
+    def __init__(self, window_days: int, today=date.today,
+                 max_pending: int = 1024):
+        self.window_days = window_days
+        self._today = today
+        self._lock = threading.Lock()
+        self._all_time = _Board()
+        self._window = _Board()
+        self._days = {}
+        self._first_day = None
+        self._dates = None
+        self._version = None
+        self._pending = {}
+        self._max_pending = max_pending
+
+    def first_day(self) -> date:
+        """
+        Return the first day of the sliding window as of today.
+        """
+        return self._today() - timedelta(days=self.window_days - 1)
+
+    def is_current(self, version: int) -> bool:
+        """
+        Tell whether the leaderboard covers the given rollup version.
+        """
+        with self._lock:
+            return self._version is not None and self._version >= version
+
+    def _advance(self):
+        first_day = self.first_day()
+        if self._first_day is not None and first_day <= self._first_day:
+            return
+        for day in [day for day in self._days if day < first_day]:
+            for user_id, (count, amount) in self._days.pop(day).items():
+                self._window.add(user_id, -count, -amount)
+        self._first_day = first_day
+
+    def _add(self, day: date, user_id: int, count: int, amount,
+             all_time: bool = True):
+        if all_time:
+            self._all_time.add(user_id, count, amount)
+        if day >= self._first_day:
+            bucket = self._days.setdefault(day, {})
+            total = bucket.get(user_id, (0, 0))
+            bucket[user_id] = (total[0] + count, total[1] + amount)
+            self._window.add(user_id, count, amount)
+
+    def _replay(self):
+        """
+        Apply the pending purchases that follow the current version.
+        """
+        for version in [version for version in self._pending
+                        if version <= self._version]:
+            del self._pending[version]
+        while self._version + 1 in self._pending:
+            user_id, amount, transaction_date = self._pending.pop(
+                self._version + 1)
+            self._advance()
+            if self._dates is None:
+                self._dates = (transaction_date, transaction_date)
+            else:
+                self._dates = (min(self._dates[0], transaction_date),
+                               max(self._dates[1], transaction_date))
+            if user_id is not None:
+                self._add(transaction_date.date(), user_id, 1, amount)
+            self._version += 1
+
+    def rebuild(self, user_totals, daily_totals, dates, version: int):
+        """
+        Replace the whole leaderboard with the (user_id, count, amount)
+        totals of all transactions, their (day, user_id, count, amount)
+        totals per day from the window's first day on, and the (first,
+        last) transaction dates, all read as of one rollup version.
+
+        A rebuild older than the leaderboard is ignored, and purchases
+        added while it was read are applied after it.
+        """
+        with self._lock:
+            if self._version is not None and version <= self._version:
+                return
+            self._all_time = _Board()
+            self._window = _Board()
+            self._days = {}
+            self._first_day = None
+            self._advance()
+            for user_id, count, amount in user_totals:
+                self._all_time.add(user_id, count, amount)
+            for day, user_id, count, amount in daily_totals:
+                self._add(day, user_id, count, amount, all_time=False)
+            self._dates = dates if dates[0] is not None else None
+            self._version = version
+            self._replay()
+
+    def add(self, user_id: int, amount, transaction_date: datetime,
+            version: int):
+        """
+        Count a new purchase, committed as the given rollup version. It is
+        held until the leaderboard reaches the version before it.
+        """
+        with self._lock:
+            if self._version is not None and version <= self._version:
+                return
+            self._pending[version] = (user_id, amount, transaction_date)
+            if len(self._pending) > self._max_pending:
+                # Far behind; the next rebuild catches up instead.
+                del self._pending[min(self._pending)]
+            if self._version is not None:
+                self._replay()
+
+    def top(self, start: datetime, end: datetime, limit: int,
+            version: int = None):
+        """
+        Return the (user_id, amount) of the top ``limit`` users within a
+        date range, both ends included, or None if the leaderboard does not
+        cover the given rollup version or the range selects other
+        transactions than all of them or the window's.
+        """
+        if start.tzinfo or end.tzinfo or limit < 0:
+            return None
+        with self._lock:
+            if self._version is None or (version is not None
+                                         and self._version < version):
+                return None
+            self._advance()
+            if self._dates is None:
+                return []
+            first, last = self._dates
+            if end < last:
+                return None
+            if start <= first:
+                return self._all_time.top(limit)
+            if self.first_day() == self._first_day \
+                    and start == datetime.combine(self._first_day, time()):
+                return self._window.top(limit)
+            return None
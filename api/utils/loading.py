@@ -0,0 +1,64 @@
+"""
+loading.py
+----------
+
+This module chooses how the relationships of ORM rows are loaded from the
+response model they are serialized to.
+"""
+
+from typing import Optional, Type, get_args
+
+from pydantic import BaseModel
+from sqlalchemy import inspect
+from sqlalchemy.orm import joinedload, selectinload
+
+from api.utils.pagination import Page
+
+
+def _nested_model(annotation) -> Optional[Type[BaseModel]]:
+    """
+    Find the model nested in a field annotation such as List[Model] or
+    Optional[Model].
+    """
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        return annotation
+    for argument in get_args(annotation):
+        model = _nested_model(argument)
+        if model is not None:
+            return model
+    return None
+
+
+def eager_load(entity, schema: Type[BaseModel]):
+    """
+    Build the loader options fetching every relationship the response model
+    serializes, so serialization sends no query per row.
+
+    Collections use selectinload, one extra query for all rows. Single
+    related rows use joinedload, joined into the same query.
+    """
+    relationships = inspect(entity).relationships
+    options = []
+    for name, field in schema.model_fields.items():
+        if name not in relationships:
+            continue
+        relationship = relationships[name]
+        attribute = getattr(entity, name)
+        loader = (selectinload(attribute) if relationship.uselist
+                  else joinedload(attribute))
+        nested = _nested_model(field.annotation)
+        if nested is not None:
+            nested_options = eager_load(relationship.mapper.class_, nested)
+            if nested_options:
+                loader = loader.options(*nested_options)
+        options.append(loader)
+    return options
+
+
+def serialize_page(page: Page, schema: Type[BaseModel]) -> Page:
+    """
+    Convert a page of rows to a response model while the session is open,
+    reading only the relationships the model has.
+    """
+    return Page([schema.model_validate(row) for row in page],
+                page.next_cursor)
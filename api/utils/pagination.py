@@ -0,0 +1,109 @@
+"""
+pagination.py
+-------------
+
+This module provides keyset (cursor) pagination for list queries.
+
+A cursor is an opaque token encoding the sort key of the last row of a
+page. The next page starts right after that key, so it costs the same
+however deep it is and does not shift when rows are inserted before it.
+"""
+
+import base64
+import binascii
+import json
+
+from fastapi import HTTPException, Response
+from sqlalchemy import and_, literal, or_, tuple_
+
+from api.schemas import input_schema as in_sch
+
+NEXT_CURSOR_HEADER = 'X-Next-Cursor'
+
+
+class Page(list):
+    """
+    A page of rows, with the cursor of the next page if there may be one.
+    """
+
+    def __init__(self, rows, next_cursor=None):
+        super().__init__(rows)
+        self.next_cursor = next_cursor
+
+
+def encode_cursor(key: dict) -> str:
+    """
+    Encode the sort key of a row as an opaque cursor.
+    """
+    payload = json.dumps(key, default=str, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str, names) -> dict:
+    """
+    Decode a cursor, checking that it holds a key for the given sort.
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        key = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        key = None
+    if not isinstance(key, dict) or list(key) != list(names):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return key
+
+
+def after_key(columns, values):
+    """
+    Build the condition selecting the rows sorted after the given key, for
+    columns sorted ascending with NULLs last.
+
+    Without nullable columns this is a row comparison, which a composite
+    index on the same columns serves directly.
+    """
+    if not any(getattr(column, 'nullable', False) for column in columns):
+        return tuple_(*columns) > tuple_(*(
+            literal(value, column.type)
+            for column, value in zip(columns, values)
+        ))
+
+    column, value = columns[0], values[0]
+    if len(columns) == 1:
+        return column.is_(None) if value is None else or_(
+            column > literal(value, column.type), column.is_(None))
+    rest = after_key(columns[1:], values[1:])
+    if value is None:
+        return and_(column.is_(None), rest)
+    return or_(column > literal(value, column.type), column.is_(None),
+               and_(column == literal(value, column.type), rest))
+
+
+def paginate(query, sort_keys: dict, paging: in_sch.PagingParams) -> Page:
+    """
+    Order a query by ``sort_keys``, a map from the row attribute to the
+    column to sort by (the last one unique), and fetch one page of it:
+    after ``paging.cursor`` if given, else after ``paging.skip`` rows.
+    """
+    columns = list(sort_keys.values())
+    query = query.order_by(*columns)
+    if paging.cursor:
+        key = decode_cursor(paging.cursor, sort_keys)
+        query = query.filter(after_key(columns, list(key.values())))
+    else:
+        query = query.offset(paging.skip)
+
+    rows = query.limit(paging.limit).all()
+    next_cursor = None
+    if len(rows) == paging.limit:
+        next_cursor = encode_cursor(
+            {name: getattr(rows[-1], name) for name in sort_keys})
+    return Page(rows, next_cursor)
+
+
+def set_next_cursor(response: Response, page):
+    """
+    Expose the cursor of the next page, if any, in a response header.
+    """
+    next_cursor = getattr(page, 'next_cursor', None)
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
@@ -0,0 +1,73 @@
+"""
+prefix_index.py
+---------------
+
+This module provides an in-memory index answering name prefix lookups from
+sorted arrays.
+"""
+
+import heapq
+import threading
+from bisect import bisect_left, insort
+from itertools import islice, takewhile
+
+
+class PrefixIndex:
+    """
+    Sorted (lower-cased name, id, name) arrays, one per entity type.
+
+    Names are compared by code point, which is the order Postgres uses for
+    the "C" collation. The index is local to the process, so it only sees
+    writes made through this process.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._names = {}
+        self.loaded = False
+
+    def add(self, entity_type: str, entity_id: int, name: str):
+        """
+        Insert an entity, keeping its type's array sorted.
+        """
+        with self._lock:
+            insort(self._names.setdefault(entity_type, []),
+                   (name.lower(), entity_id, name))
+
+    def rebuild(self, entities):
+        """
+        Replace the whole index with (type, id, name) entities.
+        """
+        names = {}
+        for entity_type, entity_id, name in entities:
+            names.setdefault(entity_type, []).append(
+                (name.lower(), entity_id, name))
+        for entries in names.values():
+            entries.sort()
+        with self._lock:
+            self._names = names
+            self.loaded = True
+
+    def search(self, prefix: str, entity_types, limit: int):
+        """
+        Return up to ``limit`` entities of the given types whose name starts
+        with the prefix, ignoring case, ordered by name, then by position of
+        the type in ``entity_types``, then by id.
+        """
+        prefix = prefix.lower()
+        with self._lock:
+            matches = []
+            for order, entity_type in enumerate(entity_types):
+                entries = self._names.get(entity_type, [])
+                start = bisect_left(entries, (prefix,))
+                # Matches are contiguous, so the first ``limit`` entries
+                # from the insertion point hold every candidate.
+                matches.append([
+                    (lower_name, order, entity_id, name, entity_type)
+                    for lower_name, entity_id, name in takewhile(
+                        lambda entry: entry[0].startswith(prefix),
+                        entries[start:start + limit])
+                ])
+        return [{'id': entity_id, 'name': name, 'type': entity_type}
+                for _, _, entity_id, name, entity_type in islice(
+                    heapq.merge(*matches), limit)]
@@ -0,0 +1,157 @@
+"""
+price_snapshot.py
+-----------------
+
+This module provides a read-only columnar snapshot of pharmacy_masks, kept
+in a memory-mapped NumPy file that every worker process shares.
+"""
+
+import os
+import tempfile
+import threading
+from decimal import ROUND_CEILING, ROUND_FLOOR, Decimal
+
+import numpy as np
+from sqlalchemy import text
+
+# Rows of the snapshot array, each sorted by pharmacy and then by price.
+# NAME_RANK is the position of the pharmacy when sorted by name.
+PHARMACY_ID, MASK_ID, PRICE_CENTS, SORT_KEY, NAME_RANK = range(5)
+# Advisory lock serializing snapshot builds across processes.
+PRICE_SNAPSHOT_LOCK_KEY = 0x70726963
+# A price in cents fits in the low bits of the sort key: numeric(10, 2)
+# stays below 2 ** 34 cents, leaving 29 bits for the pharmacy id.
+PRICE_BITS = 34
+# Snapshots are read by worker processes that may run as other users.
+SNAPSHOT_MODE = 0o644
+
+
+def _cents(price: float, rounding) -> int:
+    """
+    Convert a price bound to whole cents, rounding towards the inside of
+    the range.
+    """
+    return int((Decimal(str(price)) * 100).to_integral_value(rounding))
+
+
+def build_price_snapshot(db, path: str, reuse_running: bool = False):
+    """
+    Write the (pharmacy_id, mask_id, price) rows of pharmacy_masks, with
+    the rank of the pharmacy's name, to a snapshot file, replacing the
+    previous one atomically, and commit.
+
+    Builds hold an advisory lock, so processes write the file one at a time,
+    each from the rows as of its turn. With ``reuse_running``, a build that
+    finds another one running waits for it and keeps its file instead, as
+    workers starting together do.
+    """
+    lock = {'key': PRICE_SNAPSHOT_LOCK_KEY}
+    if not db.execute(text('SELECT pg_try_advisory_xact_lock(:key)'),
+                      lock).scalar():
+        db.execute(text('SELECT pg_advisory_xact_lock(:key)'), lock)
+        if reuse_running and os.path.exists(path):
+            db.commit()
+            return
+    rows = db.execute(text(
+        'SELECT pharmacy_id, mask_id, (price * 100)::bigint, name_rank '
+        'FROM pharmacy_masks JOIN ('
+        '  SELECT id, row_number() OVER (ORDER BY name) AS name_rank '
+        '  FROM pharmacies'
+        ') AS ranked ON ranked.id = pharmacy_masks.pharmacy_id '
+        'ORDER BY pharmacy_id, price'
+    )).all()
+    columns = np.zeros((5, len(rows)), dtype=np.int64)
+    if rows:
+        columns[[PHARMACY_ID, MASK_ID, PRICE_CENTS, NAME_RANK]] = np.array(
+            rows, dtype=np.int64).T
+    columns[SORT_KEY] = (columns[PHARMACY_ID] << PRICE_BITS) \
+        | columns[PRICE_CENTS]
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=directory, suffix='.npy',
+                                     delete=False) as snapshot_file:
+        try:
+            np.save(snapshot_file, columns)
+        except BaseException:
+            snapshot_file.close()
+            os.unlink(snapshot_file.name)
+            raise
+    try:
+        # NamedTemporaryFile creates the file readable by its owner only.
+        os.chmod(snapshot_file.name, SNAPSHOT_MODE)
+        os.replace(snapshot_file.name, path)
+    except BaseException:
+        os.unlink(snapshot_file.name)
+        raise
+    db.commit()
+
+
+class PriceSnapshot:
+    """
+    Memory map of a snapshot file, remapped when the file is replaced.
+
+    The mapped pages are shared by every process reading the same file;
+    only the list of distinct pharmacy ids and their name order are computed
+    per process.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._version = None
+        self._columns = None
+        self._pharmacy_ids = None
+        self._by_name = None
+
+    def _load(self):
+        stat = os.stat(self.path)
+        version = (stat.st_ino, stat.st_mtime_ns)
+        with self._lock:
+            if version != self._version:
+                columns = np.load(self.path, mmap_mode='r')
+                pharmacy_ids = columns[PHARMACY_ID]
+                firsts = np.flatnonzero(np.diff(pharmacy_ids)) + 1
+                if len(pharmacy_ids):
+                    firsts = np.concatenate(([0], firsts))
+                self._pharmacy_ids = np.asarray(pharmacy_ids[firsts])
+                self._by_name = np.argsort(columns[NAME_RANK][firsts])
+                self._columns = columns
+                self._version = version
+            return self._columns, self._pharmacy_ids, self._by_name
+
+    @staticmethod
+    def _count(columns, pharmacy_ids, min_price: float, max_price: float):
+        low = max(_cents(min_price, ROUND_CEILING), 0)
+        high = min(_cents(max_price, ROUND_FLOOR), (1 << PRICE_BITS) - 1)
+        if low > high or not len(pharmacy_ids):
+            return np.zeros(len(pharmacy_ids), dtype=np.int64)
+
+        keys = pharmacy_ids << PRICE_BITS
+        sort_key = columns[SORT_KEY]
+        return (np.searchsorted(sort_key, keys | high, side='right')
+                - np.searchsorted(sort_key, keys | low, side='left'))
+
+    def count_masks(self, min_price: float, max_price: float):
+        """
+        Count the masks of each pharmacy priced within the range, both ends
+        included. Pharmacies with none in the range are left out.
+
+        Return the pharmacy ids and their counts, as two arrays.
+        """
+        columns, pharmacy_ids, _ = self._load()
+        counts = self._count(columns, pharmacy_ids, min_price, max_price)
+        in_range = counts > 0
+        return pharmacy_ids[in_range], counts[in_range]
+
+    def count_masks_by_name(self, min_price: float, max_price: float):
+        """
+        Count the masks of every pharmacy of the snapshot priced within the
+        range, both ends included, with the pharmacies sorted by name as of
+        the snapshot.
+
+        Return the pharmacy ids and their counts, as two arrays.
+        """
+        columns, pharmacy_ids, by_name = self._load()
+        counts = self._count(columns, pharmacy_ids, min_price, max_price)
+        return pharmacy_ids[by_name], counts[by_name]
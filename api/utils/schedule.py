@@ -0,0 +1,65 @@
+"""
+schedule.py
+-----------
+
+This module provides the weekly opening schedule of a pharmacy, built from
+its minute-of-week open intervals.
+"""
+
+from bisect import bisect_right
+from datetime import datetime
+
+from api.utils.tools import MINUTES_PER_DAY, MINUTES_PER_WEEK
+
+
+def datetime_minute_of_week(at: datetime) -> int:
+    """
+    Count the minutes from Monday 00:00 to the wall-clock time of a datetime.
+    """
+    return at.weekday() * MINUTES_PER_DAY + at.hour * 60 + at.minute
+
+
+class WeeklySchedule:
+    """
+    Sorted, non-overlapping half-open minute-of-week spans of one pharmacy.
+
+    Overlapping and touching spans are merged. A span open at Sunday
+    midnight is joined with the one continuing from Monday 00:00, so it
+    may end past the end of the week.
+    """
+
+    def __init__(self, spans):
+        merged = []
+        for start, stop in sorted(spans):
+            if merged and start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], stop)
+            else:
+                merged.append([start, stop])
+        self.always_open = (len(merged) == 1 and merged[0][0] == 0
+                            and merged[0][1] >= MINUTES_PER_WEEK)
+        if (len(merged) > 1 and merged[0][0] == 0
+                and merged[-1][1] == MINUTES_PER_WEEK):
+            merged[-1][1] += merged.pop(0)[1]
+        self._spans = [tuple(span) for span in merged]
+        self._starts = [start for start, _ in merged]
+
+    def status(self, minute: int):
+        """
+        Tell whether the pharmacy is open at a minute of the week, and how
+        many minutes after it the current span ends or the next one starts.
+        The count is None when the state never changes.
+        """
+        if not self._spans:
+            return False, None
+        if self.always_open:
+            return True, None
+        # A span joined across Sunday midnight holds the early Monday
+        # minutes one week later.
+        for shifted in (minute, minute + MINUTES_PER_WEEK):
+            index = bisect_right(self._starts, shifted) - 1
+            if index >= 0 and shifted < self._spans[index][1]:
+                return True, self._spans[index][1] - shifted
+        index = bisect_right(self._starts, minute)
+        if index == len(self._starts):
+            return False, self._starts[0] + MINUTES_PER_WEEK - minute
+        return False, self._starts[index] - minute
@@ -7,9 +7,16 @@ This module contains utility functions for the application.
 
 import json
 import logging
+import re
+from datetime import date, datetime, time, timedelta
+from decimal import ROUND_HALF_UP, Decimal
+from functools import lru_cache
+from typing import List, NamedTuple, Optional, Tuple
 from fastapi import HTTPException
 from sqlalchemy import text
 
+from api.enums import DayOfWeek
+
 
 def exception_handler(func):
     """
@@ -40,6 +47,186 @@ def install_pg_trgm(engine):
             connection.commit()
 
 
+def set_similarity_threshold(db, threshold: float):
+    """
+    Set the pg_trgm similarity threshold used by the % operator for the
+    current transaction.
+    """
+    db.execute(
+        text("SELECT set_config('pg_trgm.similarity_threshold', "
+             ":threshold, true)"),
+        {'threshold': str(threshold)}
+    )
+
+
+def escape_like(value: str, escape: str = '\\') -> str:
+    """
+    Escape the LIKE wildcards in a value so it matches literally.
+    """
+    return (value.replace(escape, escape * 2)
+            .replace('%', escape + '%').replace('_', escape + '_'))
+
+
+MASK_NAME_PATTERN = re.compile(
+    r'^(?P<brand>.+?) \((?P<color>[^()]+)\) \((?P<pack_size>\d+) per pack\)$'
+)
+
+
+class MaskAttributes(NamedTuple):
+    """
+    Attributes encoded in a mask name.
+    """
+    brand: Optional[str]
+    color: Optional[str]
+    pack_size: Optional[int]
+
+
+@lru_cache(maxsize=4096)
+def parse_mask_name(name: str) -> MaskAttributes:
+    """
+    Parse a "Brand (color) (N per pack)" mask name into its attributes. Names
+    that do not follow the pattern have no attributes.
+    """
+    match = MASK_NAME_PATTERN.match(name)
+    if not match:
+        return MaskAttributes(None, None, None)
+    return MaskAttributes(match['brand'], match['color'],
+                          int(match['pack_size']))
+
+
+def get_unit_price(price: float, mask_name: str) -> Optional[Decimal]:
+    """
+    Compute the price per mask of a pack, if the pack size is known, rounded
+    like Postgres round(numeric, 4).
+    """
+    pack_size = parse_mask_name(mask_name).pack_size
+    if not pack_size:
+        return None
+    return (Decimal(str(price)) / pack_size).quantize(
+        Decimal('0.0001'), rounding=ROUND_HALF_UP)
+
+
+MINUTES_PER_DAY = 24 * 60
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+
+
+def minute_of_week(day_of_week: str, at: time) -> int:
+    """
+    Count the minutes from Monday 00:00 to a time on a day of the week.
+    """
+    day = list(DayOfWeek).index(DayOfWeek(day_of_week))
+    return day * MINUTES_PER_DAY + at.hour * 60 + at.minute
+
+
+def is_past_minute(at) -> bool:
+    """
+    Tell whether a time or datetime lies past the start of its minute.
+    """
+    return bool(at.second or at.microsecond)
+
+
+def _split_at_week_end(first: int, stop: int) -> List[Tuple[int, int]]:
+    """
+    Split a half-open minute range running past Sunday midnight in two, the
+    second part starting at Monday 00:00.
+    """
+    if first >= MINUTES_PER_WEEK:
+        first, stop = first - MINUTES_PER_WEEK, stop - MINUTES_PER_WEEK
+    if stop <= MINUTES_PER_WEEK:
+        return [(first, stop)]
+    return [(first, MINUTES_PER_WEEK), (0, stop - MINUTES_PER_WEEK)]
+
+
+def _span_length(start: time, end: time) -> int:
+    """
+    Count the minutes from ``start`` to ``end``, both included, an end
+    before the start being on the next day.
+    """
+    return (end.hour * 60 + end.minute
+            - start.hour * 60 - start.minute) % MINUTES_PER_DAY + 1
+
+
+def week_minute_ranges(day_of_week: str, start: time,
+                       end: time) -> List[Tuple[int, int]]:
+    """
+    Convert the minutes from ``start`` to ``end``, both included, on a day
+    of the week to half-open minute-of-week ranges.
+
+    An end before the start is on the next day. A span running past Sunday
+    midnight is split in two, the second part starting at Monday 00:00.
+    """
+    first = minute_of_week(day_of_week, start)
+    return _split_at_week_end(first, first + _span_length(start, end))
+
+
+def minutes_open_during(day_of_week: str, start: time,
+                        end: time) -> List[Tuple[int, int]]:
+    """
+    Return the half-open minute-of-week ranges that an open interval must
+    overlap to be open at some moment from ``start`` to ``end``.
+
+    These are the week_minute_ranges, except that a start past the start of
+    its minute begins at the next minute, since an interval ending with that
+    minute has closed by then. The ranges may then be empty; a pharmacy
+    open at ``start`` itself is found with minutes_open_at.
+    """
+    first = minute_of_week(day_of_week, start)
+    length = _span_length(start, end)
+    if is_past_minute(start):
+        first, length = first + 1, length - 1
+    if not length:
+        return []
+    return _split_at_week_end(first, first + length)
+
+
+def minutes_open_at(day_of_week: str, at: time) -> List[Tuple[int, int]]:
+    """
+    Return the half-open minute-of-week ranges a pharmacy's open intervals
+    must contain for it to be open at a time of a day of the week.
+
+    An open interval ends with the close minute, and is open only at the
+    start of that minute, so a time past the start of a minute needs the
+    next minute open too. Across Sunday midnight the two minutes fall in
+    separate intervals.
+    """
+    minute = minute_of_week(day_of_week, at)
+    if not is_past_minute(at):
+        return [(minute, minute + 1)]
+    return _split_at_week_end(minute, minute + 2)
+
+
+def whole_days(start: datetime,
+               end: datetime) -> Optional[Tuple[datetime, datetime]]:
+    """
+    Return the midnights bounding the days that lie wholly between ``start``
+    and ``end``, both included; the second midnight is excluded. Return None
+    when no day is whole, or for datetimes with a time zone, which Postgres
+    compares in its own session time zone.
+    """
+    if start.tzinfo is not None or end.tzinfo is not None:
+        return None
+    first = datetime.combine(start.date(), time())
+    if first < start:
+        first += timedelta(days=1)
+    stop = datetime.combine((end + timedelta(microseconds=1)).date(), time())
+    if first >= stop:
+        return None
+    return first, stop
+
+
+def day_spans(days) -> List[List[date]]:
+    """
+    Group days into the [first, last] days of runs of consecutive days.
+    """
+    spans = []
+    for day in sorted(set(days)):
+        if spans and spans[-1][1] + timedelta(days=1) == day:
+            spans[-1][1] = day
+        else:
+            spans.append([day, day])
+    return spans
+
+
 def generate_openapi_json(app):
     """
     Generate the OpenAPI JSON file for the application.
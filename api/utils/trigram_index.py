@@ -0,0 +1,171 @@
+"""
+trigram_index.py
+----------------
+
+This module provides an in-memory trigram index over entity names, scoring
+matches the same way as the pg_trgm similarity() function.
+"""
+
+import heapq
+import struct
+import threading
+from collections import Counter, defaultdict
+
+
+def _words(text: str):
+    """
+    Split a string into the lower-cased alphanumeric words pg_trgm uses.
+    """
+    word = []
+    for char in text.lower() + ' ':
+        if char.isalnum():
+            word.append(char)
+        elif word:
+            yield ''.join(word)
+            word = []
+
+
+def normalize(text: str) -> str:
+    """
+    Normalize a string so that strings with the same trigrams compare equal.
+    """
+    return ' '.join(_words(text))
+
+
+def trigrams(text: str) -> frozenset:
+    """
+    Extract the set of trigrams of a string as pg_trgm does: lower-case it,
+    split it into alphanumeric words and pad each word with two spaces in
+    front and one behind.
+    """
+    result = set()
+    for word in _words(text):
+        padded = '  ' + word + ' '
+        result.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return frozenset(result)
+
+
+def _to_float4(value: float) -> float:
+    """
+    Round a float to float4 precision.
+    """
+    return struct.unpack('f', struct.pack('f', value))[0]
+
+
+def _float4_text(value: float) -> float:
+    """
+    Return the shortest decimal that reads back as the same float4, which
+    is what Postgres sends for a real column.
+    """
+    for digits in range(1, 10):
+        shortest = float(f'{value:.{digits}g}')
+        if _to_float4(shortest) == value:
+            return shortest
+    return value
+
+
+def _similarity(shared: int, count1: int, count2: int) -> float:
+    """
+    Compute the trigram similarity with pg_trgm's float4 precision, so
+    values compare against thresholds exactly as in Postgres.
+    """
+    if not count1 or not count2:
+        return 0.0
+    return _to_float4(shared / (count1 + count2 - shared))
+
+
+def similarity(text1: str, text2: str) -> float:
+    """
+    Return the pg_trgm similarity of two strings, as read from Postgres.
+    """
+    trigrams1 = trigrams(text1)
+    trigrams2 = trigrams(text2)
+    return _float4_text(_similarity(len(trigrams1 & trigrams2),
+                                    len(trigrams1), len(trigrams2)))
+
+
+class TrigramIndex:
+    """
+    Inverted index from trigrams to the entities whose names contain them.
+
+    Entities are keyed by (type, id). The index is local to the process, so
+    it only sees writes made through this process.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._names = {}
+        self._postings = defaultdict(set)
+        self.loaded = False
+
+    def _remove(self, key):
+        name, name_trigrams = self._names.pop(key)
+        for trigram in name_trigrams:
+            postings = self._postings[trigram]
+            postings.discard(key)
+            if not postings:
+                del self._postings[trigram]
+
+    def add(self, entity_type: str, entity_id: int, name: str):
+        """
+        Add an entity, replacing any earlier entry with the same key.
+        """
+        key = (entity_type, entity_id)
+        name_trigrams = trigrams(name)
+        with self._lock:
+            if key in self._names:
+                self._remove(key)
+            self._names[key] = (name, name_trigrams)
+            for trigram in name_trigrams:
+                self._postings[trigram].add(key)
+
+    def rebuild(self, entities):
+        """
+        Replace the whole index with (type, id, name) entities.
+        """
+        names = {}
+        postings = defaultdict(set)
+        for entity_type, entity_id, name in entities:
+            key = (entity_type, entity_id)
+            names[key] = (name, trigrams(name))
+            for trigram in names[key][1]:
+                postings[trigram].add(key)
+        with self._lock:
+            self._names = names
+            self._postings = postings
+            self.loaded = True
+
+    def search(self, term: str, entity_types, threshold: float,
+               limit: int = None, after: tuple = None):
+        """
+        Return the entities of the given types whose similarity to the term
+        is above the threshold, most similar first, keeping at most
+        ``limit`` of them. ``after`` is the (similarity, type, id) of a
+        previous match to continue from.
+        """
+        term_trigrams = trigrams(term)
+        order = {entity_type: i for i, entity_type in enumerate(entity_types)}
+        if after is not None:
+            after = (-_to_float4(after[0]), order.get(after[1], -1), after[2])
+        with self._lock:
+            shared = Counter()
+            for trigram in term_trigrams:
+                shared.update(self._postings.get(trigram, ()))
+            matches = []
+            for key, count in shared.items():
+                if key[0] not in order:
+                    continue
+                score = _similarity(count, len(term_trigrams),
+                                    len(self._names[key][1]))
+                match = (-score, order[key[0]], key[1], key)
+                if score > threshold and (after is None
+                                          or match[:3] > after):
+                    matches.append(match)
+            if limit is None:
+                matches.sort()
+            else:
+                matches = heapq.nsmallest(limit, matches)
+            return [{'id': entity_id, 'name': self._names[key][0],
+                     'similarity': _float4_text(-score),
+                     'type': key[0]}
+                    for score, _, entity_id, key in matches]
@@ -0,0 +1,237 @@
+"""
+benchmark_etl.py
+----------------
+
+Measure the throughput and memory use of the ETL loaders against the test
+database.
+
+Every loader runs in a fresh process on an empty schema built by the
+migrations, and is split into stages: extract (JSON decoding), transform
+(parsing) and load for the in-memory loaders, and a single interleaved
+stage for the streaming ones.
+Each stage reports rows/sec and the peak RSS of the loader process. The
+input is either a directory written by generate_data.py or the bundled data
+replicated ``--scale`` times. Never point this at a database you care about.
+"""
+
+import argparse
+import json
+import os
+import resource
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session
+
+import ETL
+from api.database.database import recreate_schema
+import api.database.db_models as db_mod
+from config.config import TEST_DATABASE_URL
+
+
+class StageMeter:
+    """
+    Context manager timing a stage and sampling the process RSS while it
+    runs, so each stage gets its own peak.
+    """
+    _page_size = os.sysconf('SC_PAGE_SIZE')
+
+    def __init__(self, name, results):
+        self.name = name
+        self.results = results
+        self.rows = 0
+        self.peak_rss = 0
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._sample, daemon=True)
+
+    def _current_rss(self):
+        try:
+            with open('/proc/self/statm') as f:
+                return int(f.read().split()[1]) * self._page_size
+        except OSError:
+            # ru_maxrss is the process-wide peak, in KiB on Linux.
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    def _sample(self):
+        while not self._stop.wait(0.005):
+            self.peak_rss = max(self.peak_rss, self._current_rss())
+
+    def __enter__(self):
+        self.peak_rss = self._current_rss()
+        self._started = time.perf_counter()
+        self._sampler.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter() - self._started
+        self._stop.set()
+        self._sampler.join()
+        self.peak_rss = max(self.peak_rss, self._current_rss())
+        self.results.append((self.name, self.rows, elapsed, self.peak_rss))
+
+
+def _count_rows(engine):
+    with engine.connect() as connection:
+        return sum(
+            connection.execute(
+                text(f'SELECT count(*) FROM {model.__tablename__}')
+            ).scalar()
+            for model in (db_mod.Pharmacy, db_mod.PharmacyHour,
+                          db_mod.PharmacyOpenInterval, db_mod.Mask,
+                          db_mod.PharmacyMask, db_mod.User,
+                          db_mod.Transaction)
+        )
+
+
+def _run_in_memory(loader, engine, pharmacies_path, users_path, results):
+    with StageMeter('extract', results) as meter:
+        pharmacy_raw = ETL.load_data(pharmacies_path)
+        user_raw = ETL.load_data(users_path)
+        meter.rows = len(pharmacy_raw) + len(user_raw)
+
+    with StageMeter('transform', results) as meter:
+        pharmacies, pharmacy_hours, masks, prices = ETL.parse_pharmacies(
+            pharmacy_raw)
+        users, transactions = ETL.parse_users(user_raw)
+        meter.rows = (len(pharmacies) + len(pharmacy_hours) + len(masks)
+                      + len(prices) + len(users) + len(transactions))
+    del pharmacy_raw, user_raw
+
+    with StageMeter('load', results) as meter:
+        loader(Session(bind=engine), pharmacies, pharmacy_hours, masks,
+               prices, users, transactions)
+        meter.rows = _count_rows(engine)
+
+
+def _run_streaming(loader, engine, pharmacies_path, users_path, results):
+    with StageMeter('stream', results) as meter:
+        loader(Session(bind=engine), pharmacies_path, users_path)
+        meter.rows = _count_rows(engine)
+
+
+def _benchmark_loader(name, pharmacies_path, users_path, workers,
+                      batch_size):
+    engine = create_engine(TEST_DATABASE_URL)
+    recreate_schema(engine)
+
+    results = []
+    if name == 'orm':
+        _run_in_memory(ETL.insert_data, engine, pharmacies_path,
+                       users_path, results)
+    elif name == 'bulk':
+        _run_in_memory(ETL.bulk_insert_data, engine, pharmacies_path,
+                       users_path, results)
+    elif name == 'stream':
+        _run_streaming(
+            lambda db, *paths: ETL.stream_insert_data(db, *paths, batch_size),
+            engine, pharmacies_path, users_path, results)
+    elif name == 'parallel':
+        _run_streaming(
+            lambda db, *paths: ETL.parallel_insert_data(
+                db, *paths, workers, batch_size),
+            engine, pharmacies_path, users_path, results)
+    elif name == 'incremental':
+        _run_streaming(
+            lambda db, *paths: ETL.incremental_insert_data(
+                db, *paths, batch_size),
+            engine, pharmacies_path, users_path, results)
+
+    recreate_schema(engine, upgrade=False)
+    engine.dispose()
+    return results
+
+
+LOADERS = ['orm', 'bulk', 'stream', 'parallel', 'incremental']
+
+
+def scale_data(pharmacy_raw, user_raw, scale):
+    """
+    Replicate the raw records ``scale`` times, suffixing every name with the
+    copy number so pharmacies, masks and users stay unique.
+    """
+    if scale == 1:
+        return pharmacy_raw, user_raw
+
+    pharmacies = []
+    users = []
+    for copy in range(scale):
+        suffix = f' #{copy}'
+        for pharmacy in pharmacy_raw:
+            pharmacies.append({
+                **pharmacy,
+                'name': pharmacy['name'] + suffix,
+                'masks': [{**mask, 'name': mask['name'] + suffix}
+                          for mask in pharmacy['masks']]
+            })
+        for user in user_raw:
+            users.append({
+                **user,
+                'name': user['name'] + suffix,
+                'purchaseHistories': [{
+                    **history,
+                    'pharmacyName': history['pharmacyName'] + suffix,
+                    'maskName': history['maskName'] + suffix
+                } for history in user['purchaseHistories']]
+            })
+    return pharmacies, users
+
+
+def benchmark(loader_names, data_dir, workers, batch_size):
+    """
+    Run each loader in its own process and print per-stage results.
+    """
+    pharmacies_path = os.path.join(data_dir, 'pharmacies.json')
+    users_path = os.path.join(data_dir, 'users.json')
+
+    print(f'{"loader":<12}{"stage":<11}{"rows":>12}{"seconds":>10}'
+          f'{"rows/sec":>12}{"peak RSS MB":>13}')
+    for name in loader_names:
+        # A fresh process per loader keeps memory freed by one run from
+        # hiding the peak of the next.
+        with ProcessPoolExecutor(max_workers=1,
+                                 mp_context=get_context('spawn')) as pool:
+            results = pool.submit(_benchmark_loader, name, pharmacies_path,
+                                  users_path, workers, batch_size).result()
+        for stage, rows, elapsed, peak_rss in results:
+            print(f'{name:<12}{stage:<11}{rows:>12}{elapsed:>10.3f}'
+                  f'{rows / elapsed:>12.0f}{peak_rss / 2 ** 20:>13.1f}')
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(
+        description='Measure ETL throughput and peak memory per stage.'
+    )
+    arg_parser.add_argument(
+        '--data-dir',
+        help='Directory with pharmacies.json and users.json, e.g. written '
+             'by generate_data.py. Defaults to the bundled data files '
+             'replicated --scale times.'
+    )
+    arg_parser.add_argument('--scale', type=int, default=100,
+                            help='How many copies of the bundled data to load.')
+    arg_parser.add_argument('--loaders', nargs='+', choices=LOADERS,
+                            default=LOADERS)
+    arg_parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                            help='Processes for the parallel loader.')
+    arg_parser.add_argument('--batch-size', type=int, default=1000)
+    args = arg_parser.parse_args()
+
+    if args.data_dir:
+        benchmark(args.loaders, args.data_dir, args.workers, args.batch_size)
+    else:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            pharmacy_raw, user_raw = scale_data(
+                ETL.load_data('data/pharmacies.json'),
+                ETL.load_data('data/users.json'),
+                args.scale
+            )
+            for file_name, records in (('pharmacies.json', pharmacy_raw),
+                                       ('users.json', user_raw)):
+                with open(os.path.join(tmp_dir, file_name), 'w') as f:
+                    json.dump(records, f)
+            del pharmacy_raw, user_raw
+            benchmark(args.loaders, tmp_dir, args.workers, args.batch_size)
@@ -0,0 +1,115 @@
+"""
+benchmark_search.py
+-------------------
+
+Compare the latency of the Postgres and in-memory /search and
+/search/autocomplete backends against the test database.
+
+The schema is rebuilt by the migrations, with the trigram and prefix indexes
+production has, and filled with synthetic pharmacy and mask names. Then the
+same query mix is sent to both backends through search_service.
+Each backend reports p50, p99 and mean latency per query. Never point this
+at a database you care about.
+"""
+
+import argparse
+import random
+import statistics
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+import api.database.db_models as db_mod
+from api.database.database import recreate_schema
+from api.enums import SearchBackend, SearchType
+from api.schemas import input_schema as in_sch
+from api.services import search_service
+from api.utils.cache import LRUCache
+from config.config import TEST_DATABASE_URL
+from generate_data import PHARMACY_PREFIXES, PHARMACY_SUFFIXES, mask_catalog
+
+TERMS = ['mask', 'care', 'rx', 'blue', 'health', 'pack', 'true barrier',
+         'medlife', 'wellpoint 42', 'smile']
+PREFIXES = ['c', 'ca', 'care', 'carepoint 1', 'm', 'med', 'true b', 'w',
+            'well', 'x']
+ENDPOINTS = {
+    'search': lambda db, term, search_type, paging:
+        search_service.search_entities(db, term, search_type, paging),
+    'autocomplete': lambda db, term, search_type, paging:
+        search_service.autocomplete(db, term, search_type, paging.limit),
+}
+
+
+def _fill_database(engine, pharmacy_count, mask_count, seed):
+    rng = random.Random(seed)
+    with Session(bind=engine) as db:
+        db.add_all(
+            db_mod.Pharmacy(
+                name=(f'{rng.choice(PHARMACY_PREFIXES)}'
+                      f'{rng.choice(PHARMACY_SUFFIXES)} {index}'),
+                cash_balance=0
+            ) for index in range(pharmacy_count)
+        )
+        db.add_all(db_mod.Mask(name=name) for name in mask_catalog(mask_count))
+        db.commit()
+
+
+def _measure(endpoint, db, queries, paging):
+    latencies = []
+    for term, search_type in queries:
+        started = time.perf_counter()
+        list(ENDPOINTS[endpoint](db, term, search_type, paging))
+        latencies.append(time.perf_counter() - started)
+        db.rollback()
+    return latencies
+
+
+def benchmark(endpoint, pharmacy_count, mask_count, query_count, seed):
+    """
+    Run the query mix on each backend and print latency percentiles.
+    """
+    engine = create_engine(TEST_DATABASE_URL)
+    recreate_schema(engine)
+    _fill_database(engine, pharmacy_count, mask_count, seed)
+
+    rng = random.Random(seed)
+    terms = PREFIXES if endpoint == 'autocomplete' else TERMS
+    queries = [(rng.choice(terms), rng.choice(list(SearchType)))
+               for _ in range(query_count)]
+    paging = in_sch.PagingParams()
+
+    print(f'{"backend":<10}{"p50 ms":>10}{"p99 ms":>10}{"mean ms":>10}')
+    # Measure the backends themselves, not the result cache.
+    search_service.search_cache = LRUCache(max_entries=0, ttl=0)
+    with Session(bind=engine) as db:
+        for backend in SearchBackend:
+            search_service.search_backend = backend
+            if backend == SearchBackend.MEMORY:
+                search_service.rebuild_search_index(db)
+            # Warm up caches and connections before measuring.
+            _measure(endpoint, db, queries[:10], paging)
+            latencies = sorted(_measure(endpoint, db, queries, paging))
+            p99 = latencies[min(len(latencies) - 1,
+                                int(len(latencies) * 0.99))]
+            print(f'{backend.value:<10}'
+                  f'{latencies[len(latencies) // 2] * 1000:>10.3f}'
+                  f'{p99 * 1000:>10.3f}'
+                  f'{statistics.mean(latencies) * 1000:>10.3f}')
+
+    recreate_schema(engine, upgrade=False)
+    engine.dispose()
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(
+        description='Compare p99 latency of the /search backends.'
+    )
+    arg_parser.add_argument('--endpoint', choices=ENDPOINTS, default='search')
+    arg_parser.add_argument('--pharmacies', type=int, default=10_000)
+    arg_parser.add_argument('--masks', type=int, default=45)
+    arg_parser.add_argument('--queries', type=int, default=2_000)
+    arg_parser.add_argument('--seed', type=int, default=0)
+    args = arg_parser.parse_args()
+
+    benchmark(args.endpoint, args.pharmacies, args.masks, args.queries, args.seed)
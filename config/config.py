@@ -35,3 +35,41 @@ TEST_DATABASE_URL = (f"postgresql://{POSTGRES_USER}:{POSTGRES_PASSWORD}@"
                      f"{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_TEST_DB}")
 
 SIMILARITY_THRESHOLD = float(os.getenv('SIMILARITY_THRESHOLD', 0.02))
+
+# Backend serving /search: "postgres" or the in-process "memory" index
+SEARCH_BACKEND = os.getenv('SEARCH_BACKEND', 'postgres')
+
+# Search results cache: maximum number of entries (0 disables it) and
+# seconds before an entry expires
+SEARCH_CACHE_SIZE = int(os.getenv('SEARCH_CACHE_SIZE', 1024))
+SEARCH_CACHE_TTL = float(os.getenv('SEARCH_CACHE_TTL', 60))
+
+# Weekly opening schedules cached per pharmacy: maximum number of entries
+# (0 disables it) and seconds before an entry expires
+SCHEDULE_CACHE_SIZE = int(os.getenv('SCHEDULE_CACHE_SIZE', 10000))
+SCHEDULE_CACHE_TTL = float(os.getenv('SCHEDULE_CACHE_TTL', 300))
+
+# Backend counting masks per pharmacy for /pharmacies/filters/masks/count:
+# "postgres" or the memory-mapped price "snapshot" file shared by workers.
+# Workers on other hosts need the path on a volume they all mount.
+MASK_COUNT_BACKEND = os.getenv('MASK_COUNT_BACKEND', 'postgres')
+PRICE_SNAPSHOT_PATH = os.getenv(
+    'PRICE_SNAPSHOT_PATH', str(root_path / 'data' / 'price_snapshot.npy'))
+
+# Backend ranking /users/transaction_amount: "postgres" or the in-process
+# "leaderboard", which answers all-time and sliding-window ranges
+TOP_USERS_BACKEND = os.getenv('TOP_USERS_BACKEND', 'postgres')
+LEADERBOARD_WINDOW_DAYS = int(os.getenv('LEADERBOARD_WINDOW_DAYS', 30))
+
+# Monthly partitions of transactions created ahead of the current month
+TRANSACTION_PARTITION_MONTHS_AHEAD = int(
+    os.getenv('TRANSACTION_PARTITION_MONTHS_AHEAD', 3))
+
+# Date-range reports cached in the database: ranges ending before today are
+# kept until their transactions change, others for REPORT_CACHE_TTL seconds
+# (0 leaves them uncached)
+REPORT_CACHE_ENABLED = os.getenv('REPORT_CACHE_ENABLED', 'true') == 'true'
+REPORT_CACHE_TTL = float(os.getenv('REPORT_CACHE_TTL', 60))
+
+# Transactions fetched from the database and sent per chunk of an export
+EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', 5000))
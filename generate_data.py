@@ -0,0 +1,159 @@
+"""
+generate_data.py
+----------------
+
+Generate synthetic pharmacies.json and users.json files at a configurable
+scale, in the same shape as the bundled data files.
+
+Mask names follow the "Brand (color) (N per pack)" pattern and opening hours
+mix the formats found in data/pharmacies.json (day ranges, day lists,
+several segments and overnight hours). The files are written one record at
+a time, so even very large outputs need little memory.
+"""
+
+import argparse
+import json
+import os
+import random
+from datetime import datetime, timedelta
+
+BRANDS = ['True Barrier', 'MaskT', 'Second Smile', 'Masquerade',
+          'Cotton Kiss']
+COLORS = ['black', 'blue', 'green']
+PACK_SIZES = [3, 6, 10]
+DAYS = ['Mon', 'Tue', 'Wed', 'Thur', 'Fri', 'Sat', 'Sun']
+PHARMACY_PREFIXES = ['Care', 'Health', 'Med', 'Well', 'Pharma', 'First',
+                     'Key', 'Blink', 'Acculife', 'Foundation']
+PHARMACY_SUFFIXES = ['point', ' Mart', 'life', 'track', ' Hope', ' Rx',
+                     ' Drug', ' Element', ' Warehouse', ' Pharmacy']
+FIRST_NAMES = ['Yvonne', 'Ada', 'Geneva', 'Lester', 'Violet', 'Eric',
+               'Wilbert', 'Marion', 'Mae', 'Timothy']
+LAST_NAMES = ['Guerrero', 'Larson', 'Floyd', 'Arnold', 'Bush', 'Underwood',
+              'Bishop', 'Dunn', 'Cunningham', 'Schultz']
+DATE_START = datetime(2021, 1, 1)
+DATE_SPAN_SECONDS = 365 * 24 * 60 * 60
+
+
+def mask_catalog(size):
+    """
+    Build ``size`` distinct mask names, adding numbered brands once the
+    bundled brands are used up.
+    """
+    names = []
+    brand_number = 0
+    while len(names) < size:
+        for brand in BRANDS:
+            if brand_number:
+                brand = f'{brand} {brand_number}'
+            for color in COLORS:
+                for pack_size in PACK_SIZES:
+                    names.append(f'{brand} ({color}) ({pack_size} per pack)')
+        brand_number += 1
+    return names[:size]
+
+
+def opening_hours(rng):
+    """
+    Build an openingHours string in one of the bundled formats.
+    """
+    def day_range():
+        start = rng.randrange(len(DAYS) - 1)
+        end = rng.randrange(start + 1, len(DAYS))
+        return f'{DAYS[start]} - {DAYS[end]}'
+
+    def day_list():
+        days = sorted(rng.sample(range(len(DAYS)), rng.randint(2, 3)))
+        return ', '.join(DAYS[day] for day in days)
+
+    def hours():
+        if rng.random() < 0.2:
+            return '20:00 - 02:00'
+        start = rng.randint(6, 10)
+        return f'{start:02d}:00 - {start + rng.choice([4, 8, 9]):02d}:00'
+
+    segments = [f'{rng.choice([day_range, day_list])()} {hours()}'
+                for _ in range(rng.choice([1, 1, 2]))]
+    return ' / '.join(segments)
+
+
+def _write_array(path, records):
+    """
+    Write an iterable of records as a JSON array, one record per line.
+    """
+    with open(path, 'w') as f:
+        f.write('[\n')
+        for index, record in enumerate(records):
+            if index:
+                f.write(',\n')
+            f.write(json.dumps(record))
+        f.write('\n]\n')
+
+
+def generate(out_dir, pharmacy_count, user_count, history_count, mask_count,
+             seed):
+    """
+    Write pharmacies.json and users.json into ``out_dir``.
+    """
+    rng = random.Random(seed)
+    masks = mask_catalog(mask_count)
+    base_prices = {mask: round(rng.uniform(3, 50), 2) for mask in masks}
+
+    pharmacies = []
+    for index in range(pharmacy_count):
+        name = (f'{rng.choice(PHARMACY_PREFIXES)}'
+                f'{rng.choice(PHARMACY_SUFFIXES)} {index}')
+        pharmacy_masks = rng.sample(masks, rng.randint(1, min(10, len(masks))))
+        pharmacies.append({
+            'name': name,
+            'cashBalance': round(rng.uniform(100, 1000), 2),
+            'openingHours': opening_hours(rng),
+            'masks': [{
+                'name': mask,
+                'price': round(base_prices[mask] * rng.uniform(0.8, 1.2), 2)
+            } for mask in pharmacy_masks]
+        })
+    _write_array(os.path.join(out_dir, 'pharmacies.json'), pharmacies)
+
+    def users():
+        per_user, remainder = divmod(history_count, user_count)
+        for index in range(user_count):
+            histories = []
+            for _ in range(per_user + (index < remainder)):
+                pharmacy = rng.choice(pharmacies)
+                mask = rng.choice(pharmacy['masks'])
+                date = DATE_START + timedelta(
+                    seconds=rng.randrange(DATE_SPAN_SECONDS))
+                histories.append({
+                    'pharmacyName': pharmacy['name'],
+                    'maskName': mask['name'],
+                    'transactionAmount': round(
+                        mask['price'] * rng.uniform(0.8, 1.2), 2),
+                    'transactionDate': date.strftime('%Y-%m-%d %H:%M:%S')
+                })
+            yield {
+                'name': (f'{rng.choice(FIRST_NAMES)} '
+                         f'{rng.choice(LAST_NAMES)} {index}'),
+                'cashBalance': round(rng.uniform(100, 1000), 2),
+                'purchaseHistories': histories
+            }
+
+    _write_array(os.path.join(out_dir, 'users.json'), users())
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(
+        description='Generate synthetic pharmacies.json and users.json files.'
+    )
+    arg_parser.add_argument('--out-dir', default='data/generated')
+    arg_parser.add_argument('--pharmacies', type=int, default=10_000)
+    arg_parser.add_argument('--users', type=int, default=1_000_000)
+    arg_parser.add_argument('--histories', type=int, default=50_000_000,
+                            help='Total purchase histories across all users.')
+    arg_parser.add_argument('--masks', type=int, default=45,
+                            help='Size of the mask catalog.')
+    arg_parser.add_argument('--seed', type=int, default=0)
+    args = arg_parser.parse_args()
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    generate(args.out_dir, args.pharmacies, args.users, args.histories,
+             args.masks, args.seed)
@@ -8,17 +8,15 @@ responsible for setting up and starting the FastAPI app.
 
 from contextlib import asynccontextmanager
 from fastapi import FastAPI
-from api.database import db_models
-from api.database.database import engine
+from api.database.database import SessionLocal
+from api.enums import MaskCountBackend, SearchBackend, TopUsersBackend
 from api.routes.pharmacy_route import router as pharmacy_router
 from api.routes.mask_route import router as mask_router
 from api.routes.user_route import router as user_router
 from api.routes.transaction_route import router as transaction_router
 from api.routes.search_route import router as search_router
-from api.utils.tools import install_pg_trgm, generate_openapi_json
-
-# Create database tables if they do not exist
-db_models.Base.metadata.create_all(bind=engine)
+from api.services import pharmacy_service, search_service, user_service
+from api.utils.tools import generate_openapi_json
 
 
 @asynccontextmanager
@@ -26,8 +24,17 @@ async def lifespan(_app: FastAPI):
     """
     Handle startup and shutdown events for the FastAPI app.
     """
-    install_pg_trgm(engine)
     generate_openapi_json(_app)
+    if search_service.search_backend == SearchBackend.MEMORY:
+        with SessionLocal() as db:
+            search_service.rebuild_search_index(db)
+    if pharmacy_service.mask_count_backend == MaskCountBackend.SNAPSHOT:
+        with SessionLocal() as db:
+            # Workers starting together share the first one's rebuild.
+            pharmacy_service.rebuild_price_snapshot(db, reuse_running=True)
+    if user_service.top_users_backend == TopUsersBackend.LEADERBOARD:
+        with SessionLocal() as db:
+            user_service.rebuild_leaderboard(db)
     yield
 
 
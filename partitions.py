@@ -0,0 +1,48 @@
+"""
+partitions.py
+-------------
+
+Maintain the monthly partitions of the transactions table.
+
+"create" adds the partitions of the coming months, and of any month whose
+transactions landed in the default partition; run it daily, for example
+from cron. "detach" takes the partitions of old months out of the table,
+keeping them as standalone tables unless --drop is given.
+"""
+
+import argparse
+from datetime import date
+
+from api.crud import transaction_crud
+from api.database.database import SessionLocal
+from config.config import TRANSACTION_PARTITION_MONTHS_AHEAD
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(
+        description='Create or detach monthly transactions partitions.'
+    )
+    commands = arg_parser.add_subparsers(dest='command', required=True)
+    create_parser = commands.add_parser(
+        'create', help='Create the partitions of the coming months.')
+    create_parser.add_argument(
+        '--months-ahead', type=int,
+        default=TRANSACTION_PARTITION_MONTHS_AHEAD,
+        help='Number of months after the current one to create.')
+    detach_parser = commands.add_parser(
+        'detach', help='Detach the partitions of the months before a day.')
+    detach_parser.add_argument(
+        '--before', type=date.fromisoformat, required=True,
+        help='Detach the months ending on or before this day (YYYY-MM-DD).')
+    detach_parser.add_argument(
+        '--drop', action='store_true',
+        help='Drop the detached partitions instead of keeping them.')
+    args = arg_parser.parse_args()
+
+    with SessionLocal() as db:
+        if args.command == 'create':
+            names = transaction_crud.create_partitions(db, args.months_ahead)
+        else:
+            names = transaction_crud.detach_partitions(db, args.before,
+                                                       args.drop)
+    for name in names:
+        print(f'{args.command}: {name}')
@@ -2,14 +2,17 @@ import datetime
 
 import pytest
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.dialects.postgresql import Range
 from sqlalchemy.orm import sessionmaker
 
-from api.database.database import Base, get_db
+from api.crud import transaction_crud
+from api.database.database import get_db, recreate_schema
 import api.database.db_models as db_mod
 from api.enums import DayOfWeek
 from main import app
-from api.utils.tools import install_pg_trgm
+from api.utils.pagination import NEXT_CURSOR_HEADER
+from api.utils.tools import week_minute_ranges
 from config.config import TEST_DATABASE_URL
 
 engine = create_engine(TEST_DATABASE_URL)
@@ -30,9 +33,7 @@ app.dependency_overrides[get_db] = override_get_db
 
 @pytest.fixture(scope="session", autouse=True)
 def setup_database():
-    install_pg_trgm(engine)
-    Base.metadata.drop_all(bind=engine)
-    Base.metadata.create_all(bind=engine)
+    recreate_schema(engine)
     db = TestingSessionLocal()
     try:
         pharmacy1 = db_mod.Pharmacy(name="Pharmacy One", cash_balance=150.00)
@@ -83,6 +84,8 @@ def setup_database():
         ]
         db.add_all(transactions)
         db.commit()
+        transaction_crud.create_partitions(db, 0)
+        transaction_crud.rebuild_daily_rollups(db)
 
         pharmacy_hours = [
             db_mod.PharmacyHour(pharmacy_id=pharmacy1.id,
@@ -100,11 +103,31 @@ def setup_database():
         ]
         db.add_all(pharmacy_hours)
         db.commit()
+        db.add_all(
+            db_mod.PharmacyOpenInterval(pharmacy_id=hours.pharmacy_id,
+                                        minutes=Range(start, stop))
+            for hours in pharmacy_hours
+            for start, stop in week_minute_ranges(
+                hours.day_of_week, hours.open_time, hours.close_time)
+        )
+        db.commit()
+
+        # The plans the EXPLAIN tests check depend on table statistics, so
+        # keep autovacuum from analyzing the tables halfway through a run.
+        # Partitioned tables have no storage of their own to set it on.
+        tables = db.execute(text(
+            "SELECT relname FROM pg_class "
+            "WHERE relnamespace = CAST(current_schema() AS regnamespace) "
+            "AND relkind = 'r'")).scalars().all()
+        for table in tables:
+            db.execute(
+                text(f'ALTER TABLE {table} SET (autovacuum_enabled = off)'))
+        db.commit()
 
         yield
     finally:
         db.close()
-        Base.metadata.drop_all(bind=engine)
+        recreate_schema(engine, upgrade=False)
 
 
 @pytest.fixture(scope="class")
@@ -114,6 +137,84 @@ def db_session():
     session.close()
 
 
+@pytest.fixture
+def explain(db_session):
+    """
+    Return a function giving the EXPLAIN output of a query, with sequential
+    scans disabled so the plan shows whether an index can serve it.
+    """
+    def _explain(query):
+        if isinstance(query, tuple):
+            sql, params = query
+        else:
+            statement = getattr(query, 'statement', query)
+            compiled = statement.compile(dialect=engine.dialect)
+            sql, params = str(compiled), compiled.params
+        cursor = db_session.connection().connection.cursor()
+        try:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute('EXPLAIN ' + sql, params)
+            return '\n'.join(row[0] for row in cursor.fetchall())
+        finally:
+            cursor.close()
+            db_session.rollback()
+
+    return _explain
+
+
+@pytest.fixture
+def sql_statements():
+    """
+    Record the (statement, parameters) of every SQL statement sent to the
+    test database, for queries built and run inside one call.
+    """
+    statements = []
+
+    def _record(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    event.listen(engine, 'before_cursor_execute', _record)
+    yield statements
+    event.remove(engine, 'before_cursor_execute', _record)
+
+
+@pytest.fixture
+def count_statements(client, sql_statements):
+    """
+    Return a function sending a GET request and giving the number of SQL
+    statements it ran.
+    """
+    def _count_statements(url, params=None):
+        sql_statements.clear()
+        response = client.get(url, params=params)
+        assert response.status_code == 200
+        return len(sql_statements)
+
+    return _count_statements
+
+
+@pytest.fixture
+def walk_pages(client):
+    """
+    Return a function fetching every page of a list endpoint by following
+    the next cursor header, giving the pages fetched.
+    """
+    def _walk_pages(url, params):
+        pages = []
+        params = dict(params)
+        while True:
+            response = client.get(url, params=params)
+            assert response.status_code == 200
+            pages.append(response.json())
+            cursor = response.headers.get(NEXT_CURSOR_HEADER)
+            if cursor is None:
+                return pages
+            assert len(pages) <= 100
+            params["cursor"] = cursor
+
+    return _walk_pages
+
+
 @pytest.fixture(scope="class")
 def client():
     with TestClient(app) as c:
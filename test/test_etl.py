@@ -0,0 +1,531 @@
+import copy
+import json
+import re
+from collections import Counter
+from datetime import time
+
+import pytest
+from dateutil.parser import parse
+from sqlalchemy import create_engine, func, text
+from sqlalchemy.orm import Session
+
+import ETL
+import generate_data
+import api.database.db_models as db_mod
+from api.crud import transaction_crud
+from api.database.database import Base
+from api.schemas import input_schema as in_sch
+from api.utils.tools import (get_unit_price, parse_mask_name,
+                             week_minute_ranges)
+
+
+def _cleanup_etl_data(db_session, pharmacy_raw, user_raw):
+    pharmacy_names = [pharmacy['name'] for pharmacy in pharmacy_raw]
+    mask_names = {mask['name'] for pharmacy in pharmacy_raw
+                  for mask in pharmacy['masks']}
+    user_names = [user['name'] for user in user_raw]
+
+    pharmacy_ids = db_session.query(db_mod.Pharmacy.id).filter(
+        db_mod.Pharmacy.name.in_(pharmacy_names)
+    )
+    user_ids = db_session.query(db_mod.User.id).filter(
+        db_mod.User.name.in_(user_names)
+    )
+    db_session.query(db_mod.Transaction).filter(
+        db_mod.Transaction.user_id.in_(user_ids.scalar_subquery())
+    ).delete(synchronize_session=False)
+    for model in (db_mod.PharmacyMask, db_mod.PharmacyHour,
+                  db_mod.PharmacyOpenInterval):
+        db_session.query(model).filter(
+            model.pharmacy_id.in_(pharmacy_ids.scalar_subquery())
+        ).delete(synchronize_session=False)
+    db_session.query(db_mod.Pharmacy).filter(
+        db_mod.Pharmacy.name.in_(pharmacy_names)
+    ).delete(synchronize_session=False)
+    db_session.query(db_mod.Mask).filter(
+        db_mod.Mask.name.in_(mask_names)
+    ).delete(synchronize_session=False)
+    db_session.query(db_mod.User).filter(
+        db_mod.User.name.in_(user_names)
+    ).delete(synchronize_session=False)
+    db_session.query(db_mod.EtlRecord).delete(synchronize_session=False)
+    db_session.query(db_mod.EtlCheckpoint).delete(synchronize_session=False)
+    db_session.commit()
+
+
+def _load_bulk(db, pharmacies_path, users_path):
+    pharmacies, pharmacy_hours, masks, prices = ETL.parse_pharmacies(
+        ETL.load_data(pharmacies_path))
+    users, transactions = ETL.parse_users(ETL.load_data(users_path))
+    ETL.bulk_insert_data(db, pharmacies, pharmacy_hours, masks, prices,
+                         users, transactions)
+
+
+def _load_stream(db, pharmacies_path, users_path):
+    ETL.stream_insert_data(db, pharmacies_path, users_path, batch_size=7)
+
+
+def _load_parallel(db, pharmacies_path, users_path):
+    ETL.parallel_insert_data(db, pharmacies_path, users_path, workers=3,
+                             batch_size=4)
+
+
+@pytest.mark.parametrize("read_size", [1, 10, 1 << 16])
+def test_iter_json_array(read_size):
+    expected = ETL.load_data('data/users.json')
+    assert list(ETL.iter_json_array('data/users.json', read_size)) == expected
+
+
+@pytest.mark.parametrize("content", [
+    '[1.5, 2]',
+    '["a", 1.5]',
+    '[-12.25e-1 , {"amount": 3.75}, 100, 0.5]',
+    ' [ 1e10,2.0 ] ',
+])
+def test_iter_json_array_numbers(tmp_path, content):
+    path = tmp_path / 'numbers.json'
+    path.write_text(content)
+    expected = json.loads(content)
+    for read_size in range(1, len(content) + 2):
+        assert list(ETL.iter_json_array(path, read_size)) == expected
+
+
+@pytest.mark.parametrize("content", ['[1 2]', '[1.5', '[1.5,'])
+def test_iter_json_array_invalid(tmp_path, content):
+    path = tmp_path / 'invalid.json'
+    path.write_text(content)
+    for read_size in range(1, len(content) + 2):
+        with pytest.raises(ValueError):
+            list(ETL.iter_json_array(path, read_size))
+
+
+@pytest.mark.parametrize("value", [
+    "2021-01-04 15:18:51",
+    "2021-01-04",
+    "2021/01/04 15:18:51",
+    "2021-01-04T15:18:51",
+    "Jan 4 2021 3:18 PM",
+])
+def test_parse_date_matches_dateutil(value):
+    assert ETL.parse_date(value) == parse(value)
+
+
+def test_parse_date_bundled_data():
+    for user in ETL.load_data('data/users.json'):
+        for history in user['purchaseHistories']:
+            value = history['transactionDate']
+            assert ETL.parse_date(value) == parse(value)
+
+
+@pytest.mark.parametrize("opening_hours, expected", [
+    ("Mon - Wed 08:00 - 17:00",
+     (("Mon", "08:00", "17:00"), ("Tue", "08:00", "17:00"),
+      ("Wed", "08:00", "17:00"))),
+    ("Mon, Wed, Fri 08:00 - 12:00 / Tue, Thur 14:00 - 18:00",
+     (("Mon", "08:00", "12:00"), ("Wed", "08:00", "12:00"),
+      ("Fri", "08:00", "12:00"), ("Tue", "14:00", "18:00"),
+      ("Thur", "14:00", "18:00"))),
+    ("Fri - Sun 20:00 - 02:00",
+     (("Fri", "20:00", "02:00"), ("Sat", "20:00", "02:00"),
+      ("Sun", "20:00", "02:00"))),
+])
+def test_parse_opening_hours(opening_hours, expected):
+    assert ETL.parse_opening_hours(opening_hours) == expected
+
+
+def _parse_pharmacies_per_row(data):
+    """
+    Parse pharmacies the way ETL did before the batched parser, building
+    every row as its own model.
+    """
+    pharmacies, masks, prices, pharmacy_hours = [], {}, [], []
+    for pharmacy in data:
+        pharmacies.append(in_sch.PharmacyCreate(
+            name=pharmacy.get('name'),
+            cash_balance=pharmacy.get('cashBalance')))
+        for mask in pharmacy.get('masks'):
+            masks[mask.get('name')] = 1
+            prices.append(in_sch.PharmacyMaskCreate(
+                pharmacy=pharmacy.get('name'), mask=mask.get('name'),
+                price=mask.get('price')))
+        for segment in pharmacy.get('openingHours').split('/'):
+            days_part, open_time, close_time = re.match(
+                r'(.+?) (\d{2}:\d{2}) - (\d{2}:\d{2})', segment).groups()
+            for day in ETL.expand_days(days_part):
+                pharmacy_hours.append(in_sch.PharmacyHourCreate(
+                    pharmacy=pharmacy.get('name'), day_of_week=day,
+                    open_time=open_time, close_time=close_time))
+    return pharmacies, pharmacy_hours, list(masks), prices
+
+
+def _parse_users_per_row(data):
+    users, transactions = [], []
+    for user in data:
+        users.append(in_sch.UserCreate(name=user.get('name'),
+                                       cash_balance=user.get('cashBalance')))
+        for transaction in user.get('purchaseHistories'):
+            transactions.append(in_sch.TransactionCreate(
+                user=user.get('name'),
+                pharmacy=transaction.get('pharmacyName'),
+                mask=transaction.get('maskName'),
+                transaction_amount=transaction.get('transactionAmount'),
+                date=parse(transaction.get('transactionDate'))))
+    return users, transactions
+
+
+def test_parsers_match_per_row_models():
+    pharmacy_raw = ETL.load_data('data/pharmacies.json')
+    user_raw = ETL.load_data('data/users.json')
+    assert ETL.parse_pharmacies(pharmacy_raw) == \
+        _parse_pharmacies_per_row(pharmacy_raw)
+    assert ETL.parse_users(user_raw) == _parse_users_per_row(user_raw)
+
+
+def test_generate_data(tmp_path):
+    generate_data.generate(tmp_path, pharmacy_count=30, user_count=20,
+                           history_count=101, mask_count=50, seed=1)
+
+    pharmacies, pharmacy_hours, masks, prices = ETL.parse_pharmacies(
+        ETL.iter_json_array(tmp_path / 'pharmacies.json'))
+    users, transactions = ETL.parse_users(
+        ETL.iter_json_array(tmp_path / 'users.json'))
+
+    assert len({pharmacy.name for pharmacy in pharmacies}) == 30
+    assert len({user.name for user in users}) == 20
+    assert len(transactions) == 101
+    assert set(masks) <= set(generate_data.mask_catalog(50))
+    assert pharmacy_hours
+    prices_by_key = {(price.pharmacy, price.mask) for price in prices}
+    assert all((transaction.pharmacy, transaction.mask) in prices_by_key
+               for transaction in transactions)
+
+
+class TestBulkLoad:
+    @pytest.fixture(scope="class", autouse=True,
+                    params=[_load_bulk, _load_stream, _load_parallel])
+    def setup_class(self, request, db_session):
+        request.cls.db_session = db_session
+        request.cls.pharmacy_raw = ETL.load_data('data/pharmacies.json')
+        request.cls.user_raw = ETL.load_data('data/users.json')
+
+        self._cleanup_etl_test_data()
+        request.param(Session(bind=db_session.get_bind()),
+                      'data/pharmacies.json', 'data/users.json')
+        request.addfinalizer(self._cleanup_etl_test_data)
+
+    def _cleanup_etl_test_data(self):
+        _cleanup_etl_data(self.db_session, self.pharmacy_raw, self.user_raw)
+
+    def test_bulk_load_resolves_foreign_keys(self):
+        for user in self.user_raw:
+            expected = round(sum(history['transactionAmount']
+                                 for history in user['purchaseHistories']), 2)
+            total = self.db_session.query(
+                func.coalesce(func.sum(db_mod.Transaction.transaction_amount),
+                              0)
+            ).join(db_mod.User).filter(
+                db_mod.User.name == user['name']
+            ).scalar()
+            assert float(total) == expected
+
+    def test_bulk_load_prices_and_hours(self):
+        pharmacy = self.pharmacy_raw[0]
+        row = self.db_session.query(db_mod.Pharmacy).filter(
+            db_mod.Pharmacy.name == pharmacy['name']
+        ).one()
+        assert float(row.cash_balance) == pharmacy['cashBalance']
+        prices = {
+            (price.mask.name, float(price.price))
+            for price in row.pharmacy_masks
+        }
+        assert prices == {(mask['name'], mask['price'])
+                          for mask in pharmacy['masks']}
+        assert len(row.opening_hours) > 0
+
+    def test_bulk_load_open_intervals(self):
+        names = {pharmacy['name']: pharmacy['openingHours']
+                 for pharmacy in self.pharmacy_raw}
+        rows = self.db_session.query(
+            db_mod.Pharmacy.name, db_mod.PharmacyOpenInterval.minutes
+        ).join(db_mod.PharmacyOpenInterval).filter(
+            db_mod.Pharmacy.name.in_(names)
+        ).all()
+        loaded = {(name, minutes.lower, minutes.upper)
+                  for name, minutes in rows}
+        expected = {
+            (name, start, stop)
+            for name, opening_hours in names.items()
+            for day, open_time, close_time in ETL.parse_opening_hours(
+                opening_hours)
+            for start, stop in week_minute_ranges(
+                day, time.fromisoformat(open_time),
+                time.fromisoformat(close_time))
+        }
+        assert loaded == expected
+        # Sunday night hours wrap around to Monday morning.
+        assert any(start == 0 for _, start, _ in loaded)
+
+    def test_bulk_load_mask_attributes(self):
+        pharmacy = self.db_session.query(db_mod.Pharmacy).filter(
+            db_mod.Pharmacy.name == self.pharmacy_raw[0]['name']
+        ).one()
+        for price in pharmacy.pharmacy_masks:
+            attributes = parse_mask_name(price.mask.name)
+            assert attributes.pack_size
+            assert (price.mask.brand, price.mask.color,
+                    price.mask.pack_size) == attributes
+            assert price.unit_price == get_unit_price(price.price,
+                                                      price.mask.name)
+
+
+def test_incremental_refuses_untracked_transactions(db_session):
+    db_session.query(db_mod.EtlRecord).delete(synchronize_session=False)
+    db_session.commit()
+
+    with pytest.raises(RuntimeError, match='without recording'):
+        ETL.incremental_insert_data(Session(bind=db_session.get_bind()),
+                                    'data/pharmacies.json', 'data/users.json')
+
+    names = [pharmacy['name']
+             for pharmacy in ETL.load_data('data/pharmacies.json')]
+    assert db_session.query(db_mod.Pharmacy).filter(
+        db_mod.Pharmacy.name.in_(names)).count() == 0
+
+
+class TestIncrementalLoad:
+    @pytest.fixture(scope="class", autouse=True)
+    def setup_class(self, request, db_session, tmp_path_factory):
+        request.cls.db_session = db_session
+        request.cls.pharmacy_raw = ETL.load_data('data/pharmacies.json')
+        request.cls.user_raw = ETL.load_data('data/users.json')
+        request.cls.data_dir = tmp_path_factory.mktemp('incremental')
+
+        _cleanup_etl_data(db_session, self.pharmacy_raw, self.user_raw)
+        request.cls.first_stats = self._load(self.pharmacy_raw,
+                                             self.user_raw)
+        request.addfinalizer(
+            lambda: _cleanup_etl_data(db_session, self.pharmacy_raw,
+                                      self.user_raw)
+        )
+
+    def _load(self, pharmacy_raw, user_raw):
+        pharmacies_path = self.data_dir / 'pharmacies.json'
+        users_path = self.data_dir / 'users.json'
+        pharmacies_path.write_text(json.dumps(pharmacy_raw))
+        users_path.write_text(json.dumps(user_raw))
+        # The test database holds transactions of its own.
+        return ETL.incremental_insert_data(
+            Session(bind=self.db_session.get_bind()),
+            str(pharmacies_path), str(users_path), batch_size=7, force=True
+        )
+
+    def test_first_run_inserts_everything(self):
+        mask_names = {mask['name'] for pharmacy in self.pharmacy_raw
+                      for mask in pharmacy['masks']}
+        histories = sum(len(user['purchaseHistories'])
+                        for user in self.user_raw)
+        assert self.first_stats['pharmacies']['inserted'] == len(
+            self.pharmacy_raw)
+        assert self.first_stats['masks']['inserted'] == len(mask_names)
+        assert self.first_stats['users']['inserted'] == len(self.user_raw)
+        assert self.first_stats['transactions']['inserted'] == histories
+
+    def test_rerun_only_loads_changes(self):
+        pharmacy_raw = copy.deepcopy(self.pharmacy_raw)
+        user_raw = copy.deepcopy(self.user_raw)
+        pharmacy_raw[0]['cashBalance'] = 1.5
+        pharmacy_raw[0]['masks'][0]['price'] = 99.99
+        user_raw[0]['purchaseHistories'].append(
+            dict(user_raw[0]['purchaseHistories'][0]))
+
+        stats = self._load(pharmacy_raw, user_raw)
+
+        histories = sum(len(user['purchaseHistories'])
+                        for user in self.user_raw)
+        assert stats['pharmacies'] == Counter(
+            updated=1, unchanged=len(pharmacy_raw) - 1)
+        assert stats['masks'] == Counter()
+        assert stats['users'] == Counter(unchanged=len(user_raw))
+        assert stats['transactions'] == Counter(inserted=1,
+                                                unchanged=histories)
+
+        pharmacy = self.db_session.query(db_mod.Pharmacy).filter(
+            db_mod.Pharmacy.name == pharmacy_raw[0]['name']
+        ).one()
+        self.db_session.refresh(pharmacy)
+        assert float(pharmacy.cash_balance) == 1.5
+        assert len(pharmacy.pharmacy_masks) == len(pharmacy_raw[0]['masks'])
+        assert 99.99 in {float(price.price)
+                         for price in pharmacy.pharmacy_masks}
+
+    def test_rerun_with_repeated_names(self):
+        pharmacy_raw = copy.deepcopy(self.pharmacy_raw)
+        user_raw = copy.deepcopy(self.user_raw)
+        pharmacy = dict(pharmacy_raw[1], cashBalance=2.5)
+        pharmacy_raw.insert(2, pharmacy)
+        user_raw.insert(2, dict(user_raw[1], cashBalance=3.5,
+                                purchaseHistories=[]))
+
+        stats = self._load(pharmacy_raw, user_raw)
+
+        # The first pharmacy changes back from the previous test.
+        assert stats['pharmacies']['updated'] == 2
+        assert stats['users']['updated'] == 1
+        self.db_session.expire_all()
+        assert float(self.db_session.query(db_mod.Pharmacy).filter(
+            db_mod.Pharmacy.name == pharmacy['name']
+        ).one().cash_balance) == 2.5
+        assert float(self.db_session.query(db_mod.User).filter(
+            db_mod.User.name == user_raw[1]['name']
+        ).one().cash_balance) == 3.5
+        assert self.db_session.query(db_mod.PharmacyMask).join(
+            db_mod.Pharmacy).filter(
+            db_mod.Pharmacy.name == pharmacy['name']
+        ).count() == len(pharmacy['masks'])
+
+
+class TestResumableLoad:
+    @pytest.fixture(scope="class", autouse=True)
+    def setup_class(self, request, db_session):
+        request.cls.db_session = db_session
+        request.cls.pharmacy_raw = ETL.load_data('data/pharmacies.json')
+        request.cls.user_raw = ETL.load_data('data/users.json')
+
+        _cleanup_etl_data(db_session, self.pharmacy_raw, self.user_raw)
+        request.addfinalizer(
+            lambda: _cleanup_etl_data(db_session, self.pharmacy_raw,
+                                      self.user_raw)
+        )
+
+    def _count(self, model, names):
+        return self.db_session.query(model).filter(
+            model.name.in_(names)).count()
+
+    def test_resume_after_failed_batch(self, tmp_path):
+        users_path = tmp_path / 'users.json'
+        broken = copy.deepcopy(self.user_raw)
+        broken[10]['purchaseHistories'][0]['pharmacyName'] = 'Nowhere'
+        users_path.write_text(json.dumps(broken))
+        user_names = [user['name'] for user in self.user_raw]
+
+        with pytest.raises(Exception):
+            ETL.resumable_insert_data(
+                Session(bind=self.db_session.get_bind()),
+                'data/pharmacies.json', str(users_path), batch_size=4)
+
+        # Batches 0 and 1 committed; batch 2 holds the broken record.
+        assert self._count(db_mod.User, user_names) == 8
+        checkpoint = self.db_session.get(db_mod.EtlCheckpoint,
+                                         str(users_path))
+        assert (checkpoint.record_index, checkpoint.batch_id) == (8, 2)
+
+        users_path.write_text(json.dumps(self.user_raw))
+        ETL.resumable_insert_data(
+            Session(bind=self.db_session.get_bind()),
+            'data/pharmacies.json', str(users_path), batch_size=4,
+            resume=True)
+
+        histories = sum(len(user['purchaseHistories'])
+                        for user in self.user_raw)
+        assert self._count(db_mod.Pharmacy, [
+            pharmacy['name'] for pharmacy in self.pharmacy_raw]) == 20
+        assert self._count(db_mod.User, user_names) == 20
+        assert self.db_session.query(db_mod.Transaction).join(
+            db_mod.User).filter(
+            db_mod.User.name.in_(user_names)).count() == histories
+
+
+class TestShadowLoad:
+    schema = 'etl_shadow_test'
+
+    @pytest.fixture(scope="class", autouse=True)
+    def setup_class(self, request, db_session):
+        engine = create_engine(
+            db_session.get_bind().url,
+            connect_args={'options': f'-csearch_path={self.schema},public'}
+        )
+        with engine.begin() as connection:
+            connection.execute(
+                text(f'DROP SCHEMA IF EXISTS {self.schema} CASCADE'))
+            connection.execute(text(f'CREATE SCHEMA {self.schema}'))
+        Base.metadata.create_all(bind=engine.execution_options(
+            schema_translate_map={None: self.schema}))
+        request.cls.engine = engine
+
+        def teardown():
+            with engine.begin() as connection:
+                connection.execute(text(f'DROP SCHEMA {self.schema} CASCADE'))
+            engine.dispose()
+
+        request.addfinalizer(teardown)
+
+    def _count(self, table):
+        with self.engine.connect() as connection:
+            return connection.execute(
+                text(f'SELECT count(*) FROM {table}')).scalar()
+
+    def test_shadow_load_swaps_in_data(self):
+        with self.engine.begin() as connection:
+            connection.execute(text(
+                "INSERT INTO user_daily_rollups VALUES ('2020-01-01', 1, 1, 1)"
+            ))
+            connection.execute(text(
+                "INSERT INTO report_cache (report, start_date, end_date, "
+                "params, result) VALUES ('top_users', '2020-01-01', "
+                "'2020-01-02', '', '[]')"
+            ))
+
+        ETL.shadow_insert_data(Session(bind=self.engine),
+                               'data/pharmacies.json', 'data/users.json')
+
+        histories = sum(len(user['purchaseHistories'])
+                        for user in ETL.load_data('data/users.json'))
+        assert self._count('pharmacies') == 20
+        assert self._count('users') == 20
+        assert self._count('transactions') == histories
+        with self.engine.connect() as connection:
+            schemas = connection.execute(text(
+                "SELECT nspname FROM pg_namespace WHERE nspname IN "
+                "('etl_staging', 'etl_retired')"
+            )).all()
+            indexes = connection.execute(text(
+                "SELECT indexname FROM pg_indexes "
+                "WHERE schemaname = current_schema() "
+                "AND tablename = 'pharmacies'"
+            )).scalars().all()
+        assert schemas == []
+        assert 'ix_pharmacies_name' in indexes
+
+        with self.engine.connect() as connection:
+            for key, model in transaction_crud.DAILY_ROLLUPS.items():
+                rollups = connection.execute(text(
+                    f'SELECT day, {key}, transaction_count, total_amount '
+                    f'FROM {model.__tablename__}')).all()
+                expected = connection.execute(text(
+                    f'SELECT CAST(date AS date), {key}, count(*), '
+                    f'sum(transaction_amount) FROM transactions '
+                    f'GROUP BY 1, 2')).all()
+                assert sorted(rollups) == sorted(expected)
+        assert self._count('report_cache') == 0
+
+    def test_incremental_run_after_shadow_load(self):
+        stats = ETL.incremental_insert_data(
+            Session(bind=self.engine),
+            'data/pharmacies.json', 'data/users.json')
+
+        histories = sum(len(user['purchaseHistories'])
+                        for user in ETL.load_data('data/users.json'))
+        assert stats['transactions'] == Counter(unchanged=histories)
+        assert stats['pharmacies'] == Counter(unchanged=20)
+        assert stats['users'] == Counter(unchanged=20)
+
+    def test_failed_sanity_check_keeps_live_data(self, tmp_path):
+        users_path = tmp_path / 'users.json'
+        users_path.write_text('[]')
+
+        with pytest.raises(RuntimeError):
+            ETL.shadow_insert_data(Session(bind=self.engine),
+                                   'data/pharmacies.json', str(users_path))
+
+        assert self._count('users') == 20
+        assert self._count('transactions') > 0
@@ -1,5 +1,10 @@
 import pytest
+
+import api.database.db_models as db_mod
+from api.crud import mask_crud
 from api.enums import SortType
+from api.schemas import input_schema as in_sch
+from api.utils.tools import get_unit_price, parse_mask_name
 
 
 class TestMaskRoutes:
@@ -72,3 +77,167 @@ class TestMaskRoutes:
         for i, mask_summary in enumerate(expected):
             for key, value in mask_summary.items():
                 assert data[i][key] == value
+
+
+@pytest.mark.parametrize("name, expected", [
+    ("True Barrier (green) (3 per pack)", ("True Barrier", "green", 3)),
+    ("MaskT (black) (10 per pack)", ("MaskT", "black", 10)),
+    ("Second Smile (blue) (6 per pack)", ("Second Smile", "blue", 6)),
+    ("Adult Mask", (None, None, None)),
+    ("Plain (blue)", (None, None, None)),
+])
+def test_parse_mask_name(name, expected):
+    assert parse_mask_name(name) == expected
+
+
+@pytest.mark.parametrize("price, name, expected", [
+    (20, "Acme (blue) (10 per pack)", "2.0000"),
+    (12.01, "Acme (blue) (8 per pack)", "1.5013"),
+    (10, "Acme (blue) (3 per pack)", "3.3333"),
+    (10, "Adult Mask", None),
+])
+def test_get_unit_price(price, name, expected):
+    unit_price = get_unit_price(price, name)
+    assert (unit_price if unit_price is None else str(unit_price)) == expected
+
+
+class TestMaskAttributes:
+    mask_names = ["Acme (blue) (10 per pack)", "Acme (black) (3 per pack)",
+                  "Zen (blue) (3 per pack)", "Zen (blue) (6 per pack)",
+                  "Loose mask"]
+
+    @pytest.fixture(scope="class", autouse=True)
+    def setup_class(self, request, client, db_session):
+        request.cls.client = client
+        request.cls.db_session = db_session
+
+        self._cleanup_mask_test_data()
+        for name in self.mask_names:
+            response = client.post("/masks", json={"name": name})
+            assert response.status_code == 200
+
+        pharmacy = db_mod.Pharmacy(name="Unit Price Pharmacy",
+                                   cash_balance=100)
+        db_session.add(pharmacy)
+        db_session.flush()
+        request.cls.pharmacy_id = pharmacy.id
+        masks = db_session.query(db_mod.Mask).filter(
+            db_mod.Mask.name.in_(self.mask_names)).all()
+        prices = {"Acme (blue) (10 per pack)": 20,
+                  "Acme (black) (3 per pack)": 9,
+                  "Zen (blue) (3 per pack)": 4.5,
+                  "Zen (blue) (6 per pack)": 15,
+                  "Loose mask": 4.5}
+        db_session.add_all(
+            db_mod.PharmacyMask(
+                pharmacy_id=pharmacy.id, mask_id=mask.id,
+                price=prices[mask.name],
+                unit_price=get_unit_price(prices[mask.name], mask.name)
+            ) for mask in masks
+        )
+        db_session.commit()
+        request.addfinalizer(self._cleanup_mask_test_data)
+
+    def _cleanup_mask_test_data(self):
+        mask_ids = self.db_session.query(db_mod.Mask.id).filter(
+            db_mod.Mask.name.in_(self.mask_names)
+        ).scalar_subquery()
+        self.db_session.query(db_mod.PharmacyMask).filter(
+            db_mod.PharmacyMask.mask_id.in_(mask_ids)
+        ).delete(synchronize_session=False)
+        self.db_session.query(db_mod.Pharmacy).filter(
+            db_mod.Pharmacy.name == "Unit Price Pharmacy"
+        ).delete(synchronize_session=False)
+        self.db_session.query(db_mod.Mask).filter(
+            db_mod.Mask.name.in_(self.mask_names)
+        ).delete(synchronize_session=False)
+        self.db_session.commit()
+
+    def test_create_mask_parses_attributes(self):
+        response = self.client.get("/masks", params={"brand": "Acme",
+                                                     "pack_size": 10})
+        assert response.status_code == 200
+        assert response.json() == [{
+            "id": response.json()[0]["id"],
+            "name": "Acme (blue) (10 per pack)",
+            "brand": "Acme", "color": "blue", "pack_size": 10
+        }]
+
+    @pytest.mark.parametrize("params, expected", [
+        ({"color": "blue"}, ["Acme (blue) (10 per pack)",
+                             "Zen (blue) (3 per pack)",
+                             "Zen (blue) (6 per pack)"]),
+        ({"brand": "Zen", "pack_size": 3}, ["Zen (blue) (3 per pack)"]),
+        ({"brand": "Zen", "color": "black"}, []),
+        ({"color": "blue", "skip": 1, "limit": 1},
+         ["Zen (blue) (3 per pack)"]),
+    ])
+    def test_list_masks(self, params, expected):
+        response = self.client.get("/masks", params=params)
+        assert response.status_code == 200
+        assert [mask["name"] for mask in response.json()] == expected
+
+    @pytest.mark.parametrize("params, expected", [
+        ({"brand": "Acme"}, {
+            "brand": [{"value": "Acme", "count": 2}],
+            "color": [{"value": "black", "count": 1},
+                      {"value": "blue", "count": 1}],
+            "pack_size": [{"value": 10, "count": 1},
+                          {"value": 3, "count": 1}],
+        }),
+        ({"color": "blue"}, {
+            "brand": [{"value": "Zen", "count": 2},
+                      {"value": "Acme", "count": 1}],
+            "color": [{"value": "blue", "count": 3}],
+            "pack_size": [{"value": 10, "count": 1},
+                          {"value": 3, "count": 1},
+                          {"value": 6, "count": 1}],
+        }),
+        ({"brand": "Nobody"}, {"brand": [], "color": [], "pack_size": []}),
+    ])
+    def test_mask_facets(self, params, expected):
+        response = self.client.get("/masks/facets", params=params)
+        assert response.status_code == 200
+        assert response.json() == expected
+
+    def test_sort_by_unit_price(self):
+        response = self.client.get(
+            f"/masks/pharmacies/{self.pharmacy_id}",
+            params={"sort_by": SortType.UNIT_PRICE.value})
+        assert response.status_code == 200
+        assert [(mask["name"], mask["unit_price"])
+                for mask in response.json()] == [
+            ("Zen (blue) (3 per pack)", 1.5),
+            ("Acme (blue) (10 per pack)", 2.0),
+            ("Zen (blue) (6 per pack)", 2.5),
+            ("Acme (black) (3 per pack)", 3.0),
+            ("Loose mask", None),
+        ]
+
+    @pytest.mark.parametrize("sort_by", list(SortType))
+    @pytest.mark.parametrize("limit", [1, 2])
+    def test_cursor_pages_match_offset_pages(self, walk_pages, sort_by,
+                                             limit):
+        url = f"/masks/pharmacies/{self.pharmacy_id}"
+        response = self.client.get(url, params={"sort_by": sort_by.value})
+        assert response.status_code == 200
+
+        pages = walk_pages(url, {"sort_by": sort_by.value, "limit": limit})
+        assert [mask for page in pages for mask in page] == response.json()
+
+    def test_cursor_of_other_sort_is_invalid(self):
+        url = f"/masks/pharmacies/{self.pharmacy_id}"
+        response = self.client.get(url, params={"sort_by": "price",
+                                                "limit": 1})
+        cursor = response.headers["X-Next-Cursor"]
+        response = self.client.get(url, params={"sort_by": "name",
+                                                "cursor": cursor})
+        assert response.status_code == 400
+
+    def test_unit_price_sort_uses_index(self, explain, sql_statements):
+        mask_crud.list_pharmacy_masks(
+            self.db_session, self.pharmacy_id, SortType.UNIT_PRICE,
+            in_sch.PagingParams(limit=2))
+        plan = explain(sql_statements[-1])
+        assert "ix_pharmacy_masks_pharmacy_unit_price_id" in plan
+        assert "Sort" not in plan
@@ -0,0 +1,218 @@
+import re
+from datetime import date, timedelta
+from pathlib import Path
+
+import pytest
+from alembic import command
+from alembic.autogenerate import compare_metadata
+from alembic.config import Config
+from alembic.migration import MigrationContext
+from sqlalchemy import create_engine, inspect, make_url, text
+from sqlalchemy.orm import Session
+
+from api.crud import transaction_crud
+from api.database.database import Base
+from config.config import TEST_DATABASE_URL
+
+# The migrations run in a database of their own, so they can be taken down
+# and up again without disturbing the test database.
+ALEMBIC_DIR = Path(__file__).resolve().parent.parent / 'alembic'
+TEST_URL = make_url(TEST_DATABASE_URL)
+MIGRATION_URL = TEST_URL.set(database=f'{TEST_URL.database}_migrations')
+
+
+def _recreate_database(drop_only=False):
+    engine = create_engine(TEST_URL, isolation_level='AUTOCOMMIT')
+    with engine.connect() as connection:
+        connection.execute(text(
+            f'DROP DATABASE IF EXISTS {MIGRATION_URL.database}'))
+        if not drop_only:
+            connection.execute(text(
+                f'CREATE DATABASE {MIGRATION_URL.database}'))
+    engine.dispose()
+
+
+class TestMigrations:
+    @pytest.fixture(scope="class", autouse=True)
+    def setup_class(self, request):
+        _recreate_database()
+        engine = create_engine(MIGRATION_URL)
+        connection = engine.connect()
+        request.cls.connection = connection
+
+        config = Config()
+        config.set_main_option('script_location', str(ALEMBIC_DIR))
+        config.attributes['connection'] = connection
+        request.cls.config = config
+        self._upgrade('head')
+
+        def cleanup():
+            connection.close()
+            engine.dispose()
+            _recreate_database(drop_only=True)
+
+        request.addfinalizer(cleanup)
+
+    def _migrate(self, step, revision):
+        # Alembic commits around CONCURRENTLY builds only in transactions it
+        # began itself.
+        self.connection.commit()
+        step(self.config, revision)
+        self.connection.commit()
+
+    def _upgrade(self, revision):
+        self._migrate(command.upgrade, revision)
+
+    def _downgrade(self, revision):
+        self._migrate(command.downgrade, revision)
+
+    @staticmethod
+    def _index_definitions(connection, schema='public'):
+        # Partitions differ by the months they were created for; their
+        # indexes follow from those of the partitioned table.
+        return {name: re.sub(rf' ON (ONLY )?{schema}\.', r' ON \1',
+                             definition)
+                for name, definition in connection.execute(text(
+                    "SELECT indexname, indexdef FROM pg_indexes "
+                    "JOIN pg_class ON pg_class.oid = CAST(quote_ident("
+                    "schemaname) || '.' || quote_ident(tablename) AS regclass) "
+                    "WHERE schemaname = :schema "
+                    "AND tablename != 'alembic_version' "
+                    "AND NOT relispartition"
+                ), {'schema': schema}).all()}
+
+    def _table_names(self):
+        return {name for name in inspect(self.connection).get_table_names()
+                if not transaction_crud.is_partition(name)}
+
+    def test_head_matches_models(self):
+        # Autogenerate cannot compare expression indexes, so indexes are
+        # compared by definition below.
+        context = MigrationContext.configure(self.connection, opts={
+            'include_object': lambda obj, name, type_, reflected, compare_to:
+                type_ != 'index' and not transaction_crud.is_partition(name)
+        })
+        assert compare_metadata(context, Base.metadata) == []
+
+    def test_head_indexes_match_models(self):
+        # The models are created in a schema of their own, which is rolled
+        # back afterwards.
+        with self.connection.engine.connect() as connection:
+            connection.execute(text('CREATE SCHEMA models'))
+            connection.execute(text('SET LOCAL search_path TO models, public'))
+            Base.metadata.create_all(connection.execution_options(
+                schema_translate_map={None: 'models'}))
+            assert self._index_definitions(connection) == \
+                self._index_definitions(connection, 'models')
+
+    def test_indexes_are_valid(self):
+        invalid = self.connection.execute(text(
+            'SELECT indexrelid::regclass::text FROM pg_index '
+            'JOIN pg_class ON pg_class.oid = indexrelid '
+            'JOIN pg_namespace ON pg_namespace.oid = relnamespace '
+            "WHERE nspname = 'public' AND NOT indisvalid"
+        )).scalars().all()
+        assert invalid == []
+
+    def test_downgrade_to_base_and_back(self):
+        self._downgrade('base')
+        assert inspect(self.connection).get_table_names() == \
+            ['alembic_version']
+        self._upgrade('head')
+        assert self._table_names() == \
+            set(Base.metadata.tables) | {'alembic_version'}
+
+    def test_duplicate_pharmacy_masks_stop_upgrade(self):
+        self._downgrade('b81c4f0a7d53')
+        self.connection.execute(text(
+            "INSERT INTO pharmacies (id, name, cash_balance) "
+            "VALUES (1, 'Pharmacy One', 0)"))
+        self.connection.execute(text(
+            "INSERT INTO masks (id, name) VALUES (1, 'Adult Mask')"))
+        self.connection.execute(text(
+            "INSERT INTO pharmacy_masks (pharmacy_id, mask_id, price) "
+            "VALUES (1, 1, 10), (1, 1, 12)"))
+        with pytest.raises(RuntimeError, match='priced more than once'):
+            self._upgrade('head')
+        self.connection.rollback()
+
+        self.connection.execute(text(
+            'DELETE FROM pharmacy_masks WHERE price = 12'))
+        self.connection.commit()
+        self._upgrade('head')
+        with pytest.raises(Exception, match='uq_pharmacy_masks_pharmacy_mask'):
+            self.connection.execute(text(
+                "INSERT INTO pharmacy_masks (pharmacy_id, mask_id, price) "
+                "VALUES (1, 1, 12)"))
+        self.connection.rollback()
+        for table in ('pharmacy_masks', 'masks', 'pharmacies'):
+            self.connection.execute(text(f'DELETE FROM {table}'))
+        self.connection.commit()
+
+    def test_partitioning_keeps_transactions(self):
+        self._downgrade('a4f7c3e9d215')
+        self.connection.execute(text(
+            "INSERT INTO pharmacies (id, name, cash_balance) "
+            "VALUES (1, 'Pharmacy One', 0)"))
+        self.connection.execute(text(
+            "INSERT INTO masks (id, name) VALUES (1, 'Adult Mask')"))
+        self.connection.execute(text(
+            "INSERT INTO users (id, name, cash_balance) "
+            "VALUES (1, 'User One', 0)"))
+        insert = text(
+            "INSERT INTO transactions "
+            "(user_id, pharmacy_id, mask_id, transaction_amount, date) "
+            "VALUES (1, 1, 1, 10, :date)")
+        self.connection.execute(insert, {'date': '2023-05-31 23:59'})
+        self.connection.execute(insert, {'date': '2023-07-01'})
+        self.connection.commit()
+        file_node = "SELECT pg_relation_filenode(CAST(:name AS regclass))"
+        old_file = self.connection.execute(
+            text(file_node), {'name': 'transactions'}).scalar()
+
+        self._upgrade('head')
+        # The old table is attached as it is, up to the month after this one.
+        assert self.connection.execute(
+            text(file_node), {'name': 'transactions_legacy'}).scalar() \
+            == old_file
+        end = transaction_crud.next_month(date.today().replace(day=1))
+        assert transaction_crud.get_legacy_partition_end(
+            Session(bind=self.connection)) == end
+        self.connection.execute(insert, {'date': '2023-07-02'})
+        self.connection.execute(insert, {'date': end})
+        rows = 'SELECT CAST(tableoid AS regclass)::text, id FROM transactions'
+        assert self.connection.execute(text(f'{rows} ORDER BY id')).all() \
+            == [('transactions_legacy', 1), ('transactions_legacy', 2),
+                ('transactions_legacy', 3),
+                (transaction_crud.partition_name(end), 4)]
+        self.connection.commit()
+
+        self._downgrade('a4f7c3e9d215')
+        self.connection.execute(insert, {'date': '2023-08-01'})
+        assert self.connection.execute(text(f'{rows} ORDER BY id')).all() \
+            == [('transactions', 1), ('transactions', 2),
+                ('transactions', 3), ('transactions', 4),
+                ('transactions', 5)]
+        self.connection.commit()
+
+        self._upgrade('head')
+        db = Session(bind=self.connection)
+        # The bound now leaves room for the latest transaction's month.
+        end = transaction_crud.next_month(end)
+        assert transaction_crud.get_legacy_partition_end(db) == end
+        # Months below the legacy bound get no partition of their own, and
+        # the legacy partition is detached once its bound has passed.
+        assert transaction_crud.create_partitions(
+            db, 0, today=date(2023, 5, 1)) == []
+        assert transaction_crud.detach_partitions(db, end - timedelta(days=1)) \
+            == []
+        assert transaction_crud.detach_partitions(db, end, drop=True) == \
+            ['transactions_legacy']
+        self.connection.commit()
+        assert self.connection.execute(text(
+            'SELECT count(*) FROM transactions')).scalar() == 0
+        assert transaction_crud.get_legacy_partition_end(db) is None
+
+        for table in ('transactions', 'users', 'masks', 'pharmacies'):
+            self.connection.execute(text(f'DELETE FROM {table}'))
+        self.connection.commit()
@@ -1,5 +1,24 @@
+import os
+import threading
+from datetime import time
+
 import pytest
-from api.enums import DayOfWeek, ComparisonType
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import Range
+from sqlalchemy.orm import Session
+
+import api.database.db_models as db_mod
+from api.crud import pharmacy_crud
+from api.enums import DayOfWeek, ComparisonType, MaskCountBackend
+from api.schemas import input_schema as in_sch
+from api.services import pharmacy_service
+from api.utils.pagination import encode_cursor
+from api.utils import price_snapshot
+from api.utils.price_snapshot import (PRICE_SNAPSHOT_LOCK_KEY, PriceSnapshot,
+                                      build_price_snapshot)
+from api.utils.schedule import WeeklySchedule
+from api.utils.tools import (minutes_open_at, minutes_open_during,
+                             week_minute_ranges)
 
 
 class TestPharmacyRoutes:
@@ -72,3 +91,403 @@ class TestPharmacyRoutes:
         for i, pharmacy in enumerate(expected):
             for key, value in pharmacy.items():
                 assert data[i][key] == value
+
+
+@pytest.mark.parametrize("day_of_week, start, end, expected", [
+    ("Mon", time(8), time(18), [(480, 1081)]),
+    ("Tue", time(9, 30), time(9, 30), [(2010, 2011)]),
+    ("Fri", time(20), time(2), [(6960, 7321)]),
+    ("Sun", time(20), time(2), [(9840, 10080), (0, 121)]),
+    ("Sun", time(0), time(23, 59), [(8640, 10080)]),
+])
+def test_week_minute_ranges(day_of_week, start, end, expected):
+    assert week_minute_ranges(day_of_week, start, end) == expected
+
+
+@pytest.mark.parametrize("day_of_week, at, expected", [
+    ("Mon", time(17), [(1020, 1021)]),
+    ("Mon", time(17, 0, 30), [(1020, 1022)]),
+    ("Sun", time(23, 59, 0, 1), [(10079, 10080), (0, 1)]),
+])
+def test_minutes_open_at(day_of_week, at, expected):
+    assert minutes_open_at(day_of_week, at) == expected
+
+
+@pytest.mark.parametrize("day_of_week, start, end, expected", [
+    ("Mon", time(8), time(18), [(480, 1081)]),
+    ("Mon", time(8, 0, 30), time(18), [(481, 1081)]),
+    ("Mon", time(8, 0, 30), time(8, 0, 45), []),
+    ("Sun", time(23, 59, 30), time(2), [(0, 121)]),
+])
+def test_minutes_open_during(day_of_week, start, end, expected):
+    assert minutes_open_during(day_of_week, start, end) == expected
+
+
+@pytest.mark.parametrize("spans, minute, expected", [
+    ([], 100, (False, None)),
+    ([(0, 10080)], 100, (True, None)),
+    ([(0, 5000), (4000, 10080)], 100, (True, None)),
+    ([(480, 1081), (1000, 1200)], 600, (True, 600)),
+    ([(480, 1081)], 1081, (False, 10080 - 601)),
+    ([(9840, 10080), (0, 121), (6960, 7321)], 60, (True, 61)),
+    ([(9840, 10080), (0, 121), (6960, 7321)], 10000, (True, 201)),
+    ([(9840, 10080), (0, 121), (6960, 7321)], 121, (False, 6839)),
+])
+def test_weekly_schedule(spans, minute, expected):
+    assert WeeklySchedule(spans).status(minute) == expected
+
+
+class TestOpenHours:
+    hours = [(DayOfWeek.FRI, time(20), time(2)),
+             (DayOfWeek.SUN, time(20), time(2)),
+             (DayOfWeek.WED, time(12), time(13))]
+
+    @pytest.fixture(scope="class", autouse=True)
+    def setup_class(self, request, client, db_session):
+        request.cls.client = client
+        request.cls.db_session = db_session
+
+        self._cleanup_hours_test_data()
+        pharmacy = db_mod.Pharmacy(name="Night Owl", cash_balance=10)
+        pharmacy.opening_hours = [
+            db_mod.PharmacyHour(day_of_week=day, open_time=start,
+                                close_time=end)
+            for day, start, end in self.hours
+        ]
+        pharmacy.open_intervals = [
+            db_mod.PharmacyOpenInterval(minutes=Range(first, stop))
+            for day, start, end in self.hours
+            for first, stop in week_minute_ranges(day, start, end)
+        ]
+        db_session.add(pharmacy)
+        db_session.commit()
+        request.addfinalizer(self._cleanup_hours_test_data)
+
+    def _cleanup_hours_test_data(self):
+        pharmacy = self.db_session.query(db_mod.Pharmacy).filter(
+            db_mod.Pharmacy.name == "Night Owl").first()
+        if pharmacy is not None:
+            self.db_session.delete(pharmacy)
+            self.db_session.commit()
+
+    @pytest.mark.parametrize("day_of_week, query_time, expected", [
+        (DayOfWeek.FRI, "19:59", []),
+        (DayOfWeek.FRI, "20:00", ["Night Owl"]),
+        (DayOfWeek.SAT, "01:30", ["Night Owl"]),
+        (DayOfWeek.SAT, "02:01", []),
+        (DayOfWeek.SUN, "23:59", ["Night Owl"]),
+        (DayOfWeek.MON, "02:00", ["Night Owl"]),
+        (DayOfWeek.MON, "14:30", ["Pharmacy One"]),
+        (DayOfWeek.WED, "12:30", ["Night Owl", "Pharmacy Two"]),
+        (DayOfWeek.MON, "18:00", ["Pharmacy One"]),
+        (DayOfWeek.MON, "18:00:30", []),
+        (DayOfWeek.WED, "13:00:05", ["Pharmacy Two"]),
+        (DayOfWeek.SAT, "02:00:01", []),
+        (DayOfWeek.SUN, "23:59:30", ["Night Owl"]),
+    ])
+    def test_open_at(self, day_of_week, query_time, expected):
+        response = self.client.get("/pharmacies/open/at", params={
+            "day_of_week": day_of_week.value, "query_time": query_time})
+        assert response.status_code == 200
+        assert [pharmacy["name"] for pharmacy in response.json()] == expected
+
+    @pytest.mark.parametrize("day_of_week, start_time, end_time, expected", [
+        (DayOfWeek.FRI, "18:00", "19:59", []),
+        (DayOfWeek.FRI, "18:00", "20:00", ["Night Owl"]),
+        (DayOfWeek.SUN, "23:00", "08:00", ["Night Owl", "Pharmacy One"]),
+        (DayOfWeek.SUN, "23:00", "07:59", ["Night Owl"]),
+        (DayOfWeek.MON, "03:00", "07:00", []),
+        (DayOfWeek.WED, "08:00", "12:00", ["Night Owl", "Pharmacy Two"]),
+        (DayOfWeek.SAT, "02:00", "03:00", ["Night Owl"]),
+        (DayOfWeek.SAT, "02:00:30", "03:00", []),
+        (DayOfWeek.WED, "12:59:10", "12:59:50", ["Night Owl",
+                                                 "Pharmacy Two"]),
+        (DayOfWeek.WED, "13:00:10", "13:00:50", ["Pharmacy Two"]),
+    ])
+    def test_open_during(self, day_of_week, start_time, end_time, expected):
+        response = self.client.get("/pharmacies/open/during", params={
+            "day_of_week": day_of_week.value, "start_time": start_time,
+            "end_time": end_time})
+        assert response.status_code == 200
+        assert [pharmacy["name"] for pharmacy in response.json()] == expected
+
+    # 2024-10-07 is a Monday.
+    @pytest.mark.parametrize("at, expected", [
+        ("2024-10-07T01:00:30", {"is_open": True, "opens_at": None,
+                                 "closes_at": "2024-10-07T02:00:00"}),
+        ("2024-10-07T02:00:30", {"is_open": False,
+                                 "opens_at": "2024-10-09T12:00:00",
+                                 "closes_at": None}),
+        ("2024-10-13T21:00:00", {"is_open": True, "opens_at": None,
+                                 "closes_at": "2024-10-14T02:00:00"}),
+        ("2024-10-07T03:00:00", {"is_open": False,
+                                 "opens_at": "2024-10-09T12:00:00",
+                                 "closes_at": None}),
+        ("2024-10-12T03:00:00", {"is_open": False,
+                                 "opens_at": "2024-10-13T20:00:00",
+                                 "closes_at": None}),
+    ])
+    def test_open_status(self, at, expected):
+        pharmacy_id = self.db_session.query(db_mod.Pharmacy.id).filter(
+            db_mod.Pharmacy.name == "Night Owl").scalar()
+        response = self.client.post("/pharmacies/open/status", json={
+            "pharmacy_ids": [pharmacy_id], "at": at})
+        assert response.status_code == 200
+        assert response.json() == [{"pharmacy_id": pharmacy_id, **expected}]
+
+    def test_open_status_batch(self, sql_statements):
+        pharmacy_service.schedule_cache.invalidate()
+        request = {"pharmacy_ids": [1, 999999, 1],
+                   "at": "2024-10-13T12:00:00"}
+        expected = [
+            {"pharmacy_id": 1, "is_open": False,
+             "opens_at": "2024-10-14T08:00:00", "closes_at": None},
+            {"pharmacy_id": 999999, "is_open": False, "opens_at": None,
+             "closes_at": None},
+        ]
+        response = self.client.post("/pharmacies/open/status", json=request)
+        assert response.status_code == 200
+        assert response.json() == expected
+        assert len(sql_statements) == 1
+
+        # The schedules are now cached.
+        response = self.client.post("/pharmacies/open/status", json=request)
+        assert response.json() == expected
+        assert len(sql_statements) == 1
+
+    def test_open_at_uses_interval_index(self, explain, sql_statements):
+        pharmacy_crud.list_pharmacies_open_at(
+            self.db_session, time(1, 30), DayOfWeek.SAT,
+            in_sch.PagingParams())
+        plan = explain(sql_statements[-1])
+        assert "ix_pharmacy_open_intervals_minutes" in plan
+
+
+class TestPharmacyPaging:
+    names = ["Paging Pharmacy A", "Paging Pharmacy B", "Paging Pharmacy C",
+             "Paging pharmacy"]
+
+    @pytest.fixture(scope="class", autouse=True)
+    def setup_class(self, request, client, db_session):
+        request.cls.client = client
+        request.cls.db_session = db_session
+
+        self._cleanup_paging_test_data()
+        db_session.add_all(db_mod.Pharmacy(name=name, cash_balance=10)
+                           for name in self.names)
+        db_session.commit()
+        request.addfinalizer(self._cleanup_paging_test_data)
+
+    def _cleanup_paging_test_data(self):
+        self.db_session.query(db_mod.Pharmacy).filter(
+            db_mod.Pharmacy.name.in_(self.names)
+        ).delete(synchronize_session=False)
+        self.db_session.commit()
+
+    @pytest.mark.parametrize("limit", [1, 2, 5])
+    def test_cursor_pages_match_offset_pages(self, walk_pages, limit):
+        response = self.client.get("/pharmacies", params={"limit": 100})
+        assert response.status_code == 200
+        pharmacies = response.json()
+        assert [pharmacy["name"] for pharmacy in pharmacies] == sorted(
+            pharmacy["name"] for pharmacy in pharmacies)
+
+        pages = walk_pages("/pharmacies", {"limit": limit})
+        assert all(len(page) <= limit for page in pages)
+        assert [pharmacy for page in pages for pharmacy in page] == \
+            pharmacies
+
+    @pytest.mark.parametrize("cursor", [
+        "not a cursor", encode_cursor({"id": 1}),
+        encode_cursor(["Pharmacy One"]),
+    ])
+    def test_invalid_cursor(self, cursor):
+        response = self.client.get("/pharmacies", params={"cursor": cursor})
+        assert response.status_code == 400
+        assert response.json() == {"detail": "Invalid cursor"}
+
+    def test_cursor_uses_index(self, explain, sql_statements):
+        cursor = encode_cursor({"name": "Paging Pharmacy A"})
+        pharmacy_crud.list_pharmacies(
+            self.db_session, in_sch.PagingParams(limit=2, cursor=cursor))
+        plan = explain(sql_statements[-1])
+        assert "ix_pharmacies_name" in plan
+        assert "Sort" not in plan
+
+
+class TestPriceSnapshot:
+    mask_names = ["Snapshot Mask A", "Snapshot Mask B", "Snapshot Mask C",
+                  "Snapshot Mask D"]
+    prices = [29.99, 30.00, 49.99, 50.01]
+
+    @pytest.fixture(scope="class", autouse=True)
+    def setup_class(self, request, client, db_session, tmp_path_factory):
+        request.cls.client = client
+        request.cls.db_session = db_session
+
+        self._cleanup_snapshot_test_data()
+        pharmacy = db_mod.Pharmacy(name="Snapshot Pharmacy", cash_balance=10)
+        masks = [db_mod.Mask(name=name) for name in self.mask_names]
+        db_session.add(pharmacy)
+        db_session.add_all(masks)
+        db_session.flush()
+        db_session.add_all(
+            db_mod.PharmacyMask(pharmacy_id=pharmacy.id, mask_id=mask.id,
+                                price=price)
+            for mask, price in zip(masks, self.prices)
+        )
+        db_session.commit()
+        request.cls.pharmacy_id = pharmacy.id
+
+        backend = pharmacy_service.mask_count_backend
+        snapshot = pharmacy_service.price_snapshot
+        pharmacy_service.price_snapshot = PriceSnapshot(
+            str(tmp_path_factory.mktemp("snapshot") / "prices.npy"))
+        pharmacy_service.rebuild_price_snapshot(db_session)
+
+        def restore():
+            pharmacy_service.mask_count_backend = backend
+            pharmacy_service.price_snapshot = snapshot
+            self._cleanup_snapshot_test_data()
+
+        request.addfinalizer(restore)
+
+    def _cleanup_snapshot_test_data(self):
+        mask_ids = self.db_session.query(db_mod.Mask.id).filter(
+            db_mod.Mask.name.in_(self.mask_names)
+        ).scalar_subquery()
+        self.db_session.query(db_mod.PharmacyMask).filter(
+            db_mod.PharmacyMask.mask_id.in_(mask_ids)
+        ).delete(synchronize_session=False)
+        self.db_session.query(db_mod.Mask).filter(
+            db_mod.Mask.name.in_(self.mask_names)
+        ).delete(synchronize_session=False)
+        self.db_session.query(db_mod.Pharmacy).filter(
+            db_mod.Pharmacy.name == "Snapshot Pharmacy"
+        ).delete(synchronize_session=False)
+        self.db_session.commit()
+
+    def _get_by_mask_count(self, backend, **params):
+        pharmacy_service.mask_count_backend = backend
+        response = self.client.get("/pharmacies/filters/masks/count",
+                                   params={"limit": 100, **params})
+        assert response.status_code == 200
+        return response.json()
+
+    @pytest.mark.parametrize("comparison", list(ComparisonType))
+    @pytest.mark.parametrize("count", [0, 1, 2, 4])
+    @pytest.mark.parametrize("min_price, max_price", [
+        (0, 100), (30, 50), (30.001, 49.999), (29.99, 29.99), (50, 30),
+        (0, 0), (50.01, 10 ** 12),
+    ])
+    def test_snapshot_matches_postgres(self, comparison, count, min_price,
+                                       max_price):
+        params = {"comparison": comparison.value, "count": count,
+                  "min_price": min_price, "max_price": max_price}
+        expected = self._get_by_mask_count(MaskCountBackend.POSTGRES,
+                                           **params)
+        assert self._get_by_mask_count(MaskCountBackend.SNAPSHOT,
+                                       **params) == expected
+
+    @pytest.mark.parametrize("comparison, count", [
+        (ComparisonType.MORE, 0), (ComparisonType.LESS, 3)])
+    def test_snapshot_pages_match_postgres(self, comparison, count):
+        params = {"comparison": comparison.value, "count": count,
+                  "min_price": 0, "max_price": 100, "limit": 1}
+        pages = {}
+        for backend in MaskCountBackend:
+            pharmacy_service.mask_count_backend = backend
+            rows, cursor = [], None
+            while True:
+                response = self.client.get(
+                    "/pharmacies/filters/masks/count",
+                    params={**params, **({"cursor": cursor} if cursor
+                                         else {})})
+                assert response.status_code == 200
+                rows.extend(response.json())
+                cursor = response.headers.get("X-Next-Cursor")
+                if not cursor:
+                    break
+            skipped = self._get_by_mask_count(backend, **params, skip=1)
+            pages[backend] = (rows, skipped)
+
+        rows, skipped = pages[MaskCountBackend.POSTGRES]
+        assert len(rows) > 1
+        assert skipped == rows[1:2]
+        assert pages[MaskCountBackend.SNAPSHOT] == (rows, skipped)
+
+    def test_snapshot_cursor_of_missing_pharmacy(self):
+        params = {"comparison": ComparisonType.MORE.value, "count": 0,
+                  "min_price": 0, "max_price": 100,
+                  "cursor": encode_cursor({"name": "M"})}
+        expected = self._get_by_mask_count(MaskCountBackend.POSTGRES,
+                                           **params)
+        assert expected
+        assert self._get_by_mask_count(MaskCountBackend.SNAPSHOT,
+                                       **params) == expected
+
+    def test_snapshot_counts_inclusive_bounds(self):
+        pharmacy_ids, counts = pharmacy_service.price_snapshot.count_masks(
+            30, 49.99)
+        assert dict(zip(pharmacy_ids.tolist(), counts.tolist()))[
+            self.pharmacy_id] == 2
+
+    @pytest.mark.parametrize("reuse_running", [True, False])
+    def test_rebuilds_wait_for_a_running_one(self, reuse_running):
+        path = pharmacy_service.price_snapshot.path
+        inode = os.stat(path).st_ino
+        engine = self.db_session.get_bind()
+
+        def rebuild():
+            with Session(bind=engine) as db:
+                build_price_snapshot(db, path, reuse_running)
+
+        with Session(bind=engine) as running:
+            running.execute(text('SELECT pg_advisory_xact_lock(:key)'),
+                            {'key': PRICE_SNAPSHOT_LOCK_KEY})
+            thread = threading.Thread(target=rebuild)
+            thread.start()
+            thread.join(0.2)
+            assert thread.is_alive()
+            assert os.stat(path).st_ino == inode
+        thread.join()
+
+        # A build of its own replaces the file with a new inode.
+        assert (os.stat(path).st_ino == inode) == reuse_running
+
+    def test_snapshot_is_world_readable(self):
+        path = pharmacy_service.price_snapshot.path
+        pharmacy_service.rebuild_price_snapshot(self.db_session)
+        assert os.stat(path).st_mode & 0o777 == 0o644
+
+    def test_failed_build_removes_its_temporary_file(self, monkeypatch):
+        path = pharmacy_service.price_snapshot.path
+        directory = os.path.dirname(os.path.abspath(path))
+        before = set(os.listdir(directory))
+
+        def fail(*args, **kwargs):
+            raise OSError('disk full')
+
+        monkeypatch.setattr(price_snapshot.np, 'save', fail)
+        with Session(bind=self.db_session.get_bind()) as db:
+            with pytest.raises(OSError):
+                build_price_snapshot(db, path)
+        assert set(os.listdir(directory)) == before
+
+    def test_rebuild_picks_up_price_changes(self):
+        params = {"comparison": ComparisonType.MORE.value, "count": 0,
+                  "min_price": 80, "max_price": 90}
+        assert self._get_by_mask_count(MaskCountBackend.SNAPSHOT,
+                                       **params) == []
+
+        self.db_session.query(db_mod.PharmacyMask).filter(
+            db_mod.PharmacyMask.pharmacy_id == self.pharmacy_id,
+            db_mod.PharmacyMask.price == 50.01
+        ).update({"price": 85}, synchronize_session=False)
+        self.db_session.commit()
+        pharmacy_service.rebuild_price_snapshot(self.db_session)
+
+        assert self._get_by_mask_count(MaskCountBackend.SNAPSHOT,
+                                       **params) == [
+            {"id": self.pharmacy_id, "name": "Snapshot Pharmacy",
+             "mask_count": 1}]
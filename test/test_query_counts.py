@@ -0,0 +1,58 @@
+import pytest
+
+
+# Each endpoint runs at most ``budget`` statements, however many rows it
+# returns, so a relation loaded per row fails here.
+@pytest.mark.parametrize("url, params, budget", [
+    ("/pharmacies", {}, 1),
+    ("/pharmacies", {"include": "opening_hours"}, 2),
+    ("/pharmacies/open/at", {"day_of_week": "Mon", "query_time": "14:30",
+                             "include": "opening_hours"}, 2),
+    ("/pharmacies/open/during", {"day_of_week": "Wed", "start_time": "00:00",
+                                 "end_time": "23:59",
+                                 "include": "opening_hours"}, 2),
+    ("/pharmacies/filters/masks/count", {"comparison": "more", "count": 0,
+                                         "min_price": 0,
+                                         "max_price": 100}, 1),
+    ("/masks", {}, 1),
+    ("/masks/pharmacies/1", {"sort_by": "price"}, 1),
+])
+def test_list_statements_do_not_grow_with_rows(count_statements, url, params,
+                                               budget):
+    single = count_statements(url, {**params, "limit": 1})
+    assert count_statements(url, {**params, "limit": 100}) == single
+    assert single <= budget
+
+
+@pytest.mark.parametrize("url, budget", [
+    ("/pharmacies/1", 2),
+    ("/transactions/1", 1),
+])
+def test_detail_statements(count_statements, url, budget):
+    assert count_statements(url) <= budget
+
+
+class TestIncludeOpeningHours:
+    @pytest.fixture(scope="class", autouse=True)
+    def setup_class(self, request, client):
+        request.cls.client = client
+
+    def test_hours_listed_only_when_included(self):
+        response = self.client.get("/pharmacies")
+        assert response.status_code == 200
+        assert all("opening_hours" not in pharmacy
+                   for pharmacy in response.json())
+
+        response = self.client.get("/pharmacies",
+                                   params={"include": "opening_hours"})
+        assert response.status_code == 200
+        hours = {pharmacy["name"]: [(hour["day_of_week"], hour["open_time"])
+                                    for hour in pharmacy["opening_hours"]]
+                 for pharmacy in response.json()}
+        assert sorted(hours["Pharmacy One"]) == [("Mon", "08:00:00"),
+                                                 ("Tue", "08:00:00")]
+
+    def test_transaction_includes_mask(self):
+        response = self.client.get("/transactions/1")
+        assert response.status_code == 200
+        assert response.json()["mask"]["name"] == "Adult Mask"
@@ -0,0 +1,197 @@
+import re
+from datetime import datetime, time
+
+import pytest
+from sqlalchemy import create_engine, text
+
+from api.crud import mask_crud, pharmacy_crud, transaction_crud, user_crud
+from api.enums import ComparisonType, DayOfWeek, SortType
+from api.schemas import input_schema as in_sch
+from config.config import TEST_DATABASE_URL
+
+PAGING = in_sch.PagingParams(limit=10)
+DATE_RANGE = in_sch.DateRange(start_date=datetime(2024, 10, 1),
+                              end_date=datetime(2024, 10, 31))
+
+
+@pytest.fixture(scope="module", autouse=True)
+def vacuum_tables():
+    # Index-only scans are costed by the pages VACUUM has marked all-visible.
+    engine = create_engine(TEST_DATABASE_URL, isolation_level="AUTOCOMMIT")
+    with engine.connect() as connection:
+        connection.execute(text("VACUUM pharmacy_masks, transactions"))
+    engine.dispose()
+
+
+@pytest.fixture(scope="module")
+def partition_indexes():
+    """
+    Map each index of a partitioned table to the indexes of its partitions,
+    which the plans name instead.
+    """
+    engine = create_engine(TEST_DATABASE_URL)
+    with engine.connect() as connection:
+        rows = connection.execute(text(
+            "SELECT parent.relname, child.relname FROM pg_inherits "
+            "JOIN pg_class parent ON parent.oid = inhparent "
+            "JOIN pg_class child ON child.oid = inhrelid "
+            "WHERE child.relkind = 'i'")).all()
+    engine.dispose()
+    indexes = {}
+    for parent, child in rows:
+        indexes.setdefault(parent, []).append(child)
+    return indexes
+
+
+def _with_partitions(names, partition_indexes):
+    names = (names,) if isinstance(names, str) else names
+    return tuple(names) + tuple(child for name in names
+                                for child in partition_indexes.get(name, ()))
+
+
+def _plan(explain, sql_statements, db_session, query):
+    sql_statements.clear()
+    query(db_session)
+    db_session.rollback()
+    plan = "\n".join(explain(statement) for statement in sql_statements
+                     if statement[0].lstrip().startswith("SELECT"))
+    assert plan
+    return plan
+
+
+# The primary keys are also indexed as ix_<table>_id, and the planner may
+# pick either index.
+PHARMACY_ID = ("pharmacies_pkey", "ix_pharmacies_id")
+MASK_ID = ("masks_pkey", "ix_masks_id")
+TRANSACTION_ID = ("transactions_pkey", "ix_transactions_id")
+
+
+# Each CRUD query, the indexes its plan must use (any one of a tuple) and
+# whether the first of them answers it without visiting the table. Plans are
+# taken with sequential scans disabled, so any "Seq Scan" left means no index
+# can serve the query.
+@pytest.mark.parametrize("query, indexes, index_only", [
+    pytest.param(lambda db: pharmacy_crud.get_pharmacy(db, 1),
+                 [PHARMACY_ID, "ix_pharmacy_hours_pharmacy_id"], False,
+                 id="get_pharmacy"),
+    pytest.param(lambda db: pharmacy_crud.list_pharmacies(db, PAGING),
+                 ["ix_pharmacies_name"], False, id="list_pharmacies"),
+    pytest.param(lambda db: pharmacy_crud.list_pharmacies_open_at(
+                     db, time(14, 30), DayOfWeek.MON, PAGING),
+                 ["ix_pharmacy_open_intervals_minutes"], False,
+                 id="list_pharmacies_open_at"),
+    pytest.param(lambda db: pharmacy_crud.list_pharmacies_open_during(
+                     db, DayOfWeek.SUN,
+                     in_sch.TimeRange(start_time=time(22), end_time=time(2)),
+                     PAGING),
+                 ["ix_pharmacy_open_intervals_minutes"], False,
+                 id="list_pharmacies_open_during"),
+    pytest.param(lambda db: pharmacy_crud.list_open_intervals(db, [1, 2]),
+                 ["ix_pharmacy_open_intervals_pharmacy_id"], False,
+                 id="list_open_intervals"),
+    pytest.param(lambda db: pharmacy_crud.list_pharmacies_by_mask_count(
+                     db, ComparisonType.MORE, 0,
+                     in_sch.PriceRangeParams(min_price=30, max_price=50),
+                     PAGING),
+                 ["ix_pharmacy_masks_price_pharmacy"], True,
+                 id="list_pharmacies_by_mask_count"),
+    pytest.param(lambda db: pharmacy_crud.list_pharmacies_with_mask_counts(
+                     db, [(1, 2), (2, 1)], PAGING),
+                 [PHARMACY_ID], False,
+                 id="list_pharmacies_with_mask_counts"),
+    pytest.param(lambda db: pharmacy_crud.search_pharmacies(
+                     db, "pharmacy").all(),
+                 ["ix_pharmacies_name_trgm"], False, id="search_pharmacies"),
+    pytest.param(lambda db: pharmacy_crud.autocomplete_pharmacies(
+                     db, "pha", 5).all(),
+                 ["ix_pharmacies_name_prefix"], False,
+                 id="autocomplete_pharmacies"),
+    pytest.param(lambda db: mask_crud.get_mask(db, 1), [MASK_ID], False,
+                 id="get_mask"),
+    pytest.param(lambda db: mask_crud.list_pharmacy_masks(
+                     db, 1, SortType.NAME, PAGING),
+                 ["uq_pharmacy_masks_pharmacy_mask", MASK_ID], False,
+                 id="list_pharmacy_masks_by_name"),
+    pytest.param(lambda db: mask_crud.list_pharmacy_masks(
+                     db, 1, SortType.PRICE, PAGING),
+                 ["ix_pharmacy_masks_pharmacy_price_id", MASK_ID], False,
+                 id="list_pharmacy_masks_by_price"),
+    pytest.param(lambda db: mask_crud.list_pharmacy_masks(
+                     db, 1, SortType.UNIT_PRICE, PAGING),
+                 ["ix_pharmacy_masks_pharmacy_unit_price_id", MASK_ID], False,
+                 id="list_pharmacy_masks_by_unit_price"),
+    pytest.param(lambda db: mask_crud.list_masks(
+                     db, in_sch.MaskFilterParams(), PAGING),
+                 ["ix_masks_name"], False, id="list_masks"),
+    pytest.param(lambda db: mask_crud.list_masks(
+                     db, in_sch.MaskFilterParams(brand="Acme"), PAGING),
+                 ["ix_masks_brand"], False, id="list_masks_by_brand"),
+    pytest.param(lambda db: mask_crud.count_mask_facets(
+                     db, in_sch.MaskFilterParams(color="blue")),
+                 ["ix_masks_color"], False, id="count_mask_facets"),
+    pytest.param(lambda db: mask_crud.get_mask_summary(db, DATE_RANGE),
+                 ["ix_transactions_date_mask", "mask_daily_rollups_pkey",
+                  MASK_ID], True, id="get_mask_summary"),
+    pytest.param(lambda db: mask_crud.get_mask_summary(db, DATE_RANGE,
+                                                       rollups=False),
+                 ["ix_transactions_date_mask", MASK_ID], True,
+                 id="get_mask_summary_without_rollups"),
+    pytest.param(lambda db: mask_crud.search_masks(db, "mask").all(),
+                 ["ix_masks_name_trgm"], False, id="search_masks"),
+    pytest.param(lambda db: mask_crud.autocomplete_masks(db, "adu", 5).all(),
+                 ["ix_masks_name_prefix"], False, id="autocomplete_masks"),
+    pytest.param(lambda db: user_crud.list_top_users_by_transaction_amount(
+                     db, DATE_RANGE, 5),
+                 ["ix_transactions_date_user_amount",
+                  "user_daily_rollups_pkey"], True,
+                 id="list_top_users_by_transaction_amount"),
+    pytest.param(lambda db: user_crud.list_top_users_by_transaction_amount(
+                     db, DATE_RANGE, 5, rollups=False),
+                 ["ix_transactions_date_user_amount"], True,
+                 id="list_top_users_without_rollups"),
+    pytest.param(lambda db: transaction_crud.get_transaction(db, 1),
+                 [TRANSACTION_ID, MASK_ID], False, id="get_transaction"),
+])
+def test_crud_query_plan(explain, sql_statements, db_session,
+                         partition_indexes, query, indexes, index_only):
+    plan = _plan(explain, sql_statements, db_session, query)
+    assert "Seq Scan" not in plan, plan
+    for names in indexes:
+        names = _with_partitions(names, partition_indexes)
+        assert any(f" {name} " in plan + " " for name in names), plan
+    if index_only:
+        assert any(f"Index Only Scan using {name} " in plan
+                   for name in _with_partitions(indexes[0],
+                                                partition_indexes)), plan
+
+
+@pytest.mark.parametrize("start_date, end_date, partitions", [
+    (datetime(2024, 10, 1), datetime(2024, 10, 31),
+     {"transactions_y2024m10"}),
+    (datetime(2024, 10, 15, 12), datetime(2024, 11, 20),
+     {"transactions_y2024m10", "transactions_y2024m11"}),
+    (datetime(2024, 11, 2), datetime(2024, 11, 3, 8),
+     {"transactions_y2024m11"}),
+])
+@pytest.mark.parametrize("query", [
+    pytest.param(lambda db, date_range, rollups: mask_crud.get_mask_summary(
+                     db, date_range, rollups), id="get_mask_summary"),
+    pytest.param(lambda db, date_range, rollups:
+                 user_crud.list_top_users_by_transaction_amount(
+                     db, date_range, 5, rollups),
+                 id="list_top_users_by_transaction_amount"),
+])
+@pytest.mark.parametrize("rollups", [True, False])
+def test_date_range_queries_prune_partitions(explain, sql_statements,
+                                             db_session, query, rollups,
+                                             start_date, end_date,
+                                             partitions):
+    date_range = in_sch.DateRange(start_date=start_date, end_date=end_date)
+    plan = _plan(explain, sql_statements, db_session,
+                 lambda db: query(db, date_range, rollups))
+    scanned = set(re.findall(r" on (transactions\w*)", plan))
+    if rollups:
+        # Only the partial days at the edges are read from transactions.
+        assert scanned <= partitions, plan
+    else:
+        assert scanned == partitions, plan
@@ -1,7 +1,14 @@
 import pytest
+from sqlalchemy import text
 
 import api.database.db_models as db_mod
-from api.enums import SearchType
+from api.crud import mask_crud, pharmacy_crud
+from api.enums import SearchBackend, SearchType
+from api.schemas import input_schema as in_sch
+from api.services import search_service
+from api.utils.cache import LRUCache
+from api.utils.prefix_index import PrefixIndex
+from api.utils.trigram_index import TrigramIndex, normalize, similarity
 
 
 class TestSearchRoutes:
@@ -12,6 +19,7 @@ class TestSearchRoutes:
 
         self._cleanup_search_test_data()
         self._prepare_search_test_data()
+        search_service.search_cache.invalidate()
         request.addfinalizer(self._cleanup_search_test_data)
 
     def _prepare_search_test_data(self):
@@ -68,3 +76,381 @@ class TestSearchRoutes:
         for item, expected in zip(data, expected_results):
             assert item["name"] == expected["name"]
             assert item["type"] == expected["type"]
+
+
+class TestSearchPlans:
+    @pytest.mark.parametrize("search, index_name", [
+        (pharmacy_crud.search_pharmacies, "ix_pharmacies_name_trgm"),
+        (mask_crud.search_masks, "ix_masks_name_trgm"),
+    ])
+    def test_search_uses_trigram_index(self, db_session, explain, search,
+                                       index_name):
+        plan = explain(search(db_session, "dog"))
+        assert "Seq Scan" not in plan
+        assert f"Bitmap Index Scan on {index_name}" in plan
+
+    def test_search_batch_uses_trigram_indexes(self, db_session, explain):
+        plan = explain(search_service._search_batch_statement(
+            db_session, ["dog", "cat"], SearchType.ALL, 5))
+        assert "Seq Scan on pharmacies" not in plan
+        assert "Seq Scan on masks" not in plan
+        assert "Bitmap Index Scan on ix_pharmacies_name_trgm" in plan
+        assert "Bitmap Index Scan on ix_masks_name_trgm" in plan
+
+    @pytest.mark.parametrize("autocomplete, index_name", [
+        (pharmacy_crud.autocomplete_pharmacies, "ix_pharmacies_name_prefix"),
+        (mask_crud.autocomplete_masks, "ix_masks_name_prefix"),
+    ])
+    def test_autocomplete_uses_prefix_index(self, db_session, explain,
+                                            autocomplete, index_name):
+        plan = explain(autocomplete(db_session, "wi", 10))
+        assert "Seq Scan" not in plan
+        assert index_name in plan
+
+
+@pytest.mark.parametrize("text1, text2", [
+    ("Wired dog", "dog"),
+    ("Wizard cat", "WW"),
+    ("N95", "NN"),
+    ("True Barrier (green) (3 per pack)", "barier grn"),
+    ("Second Smile (black) (10 per pack)", "smile-10"),
+    ("Pharmacy One", ""),
+    ("O'Brien's Rx & Co.", "obrien rx"),
+    ("a", "a b"),
+])
+def test_similarity_matches_pg_trgm(db_session, text1, text2):
+    expected = db_session.execute(
+        text("SELECT similarity(:text1, :text2)"),
+        {"text1": text1, "text2": text2}
+    ).scalar()
+    assert similarity(text1, text2) == expected
+
+
+class TestMemorySearch:
+    names = {"pharmacy": ["Wired dog", "Wizard cat", "Dog Rx"],
+             "mask": ["N95", "3M", "Dog mask (black)"]}
+
+    @pytest.fixture(scope="class", autouse=True)
+    def setup_class(self, request, client, db_session):
+        request.cls.client = client
+        request.cls.db_session = db_session
+
+        self._cleanup_search_test_data()
+        db_session.add_all(
+            [db_mod.Pharmacy(name=name, cash_balance=100)
+             for name in self.names["pharmacy"]]
+            + [db_mod.Mask(name=name) for name in self.names["mask"]]
+        )
+        db_session.commit()
+        search_service.search_backend = SearchBackend.MEMORY
+        search_service.search_index = TrigramIndex()
+        search_service.search_cache.invalidate()
+
+        def teardown():
+            search_service.search_backend = SearchBackend.POSTGRES
+            search_service.search_index = TrigramIndex()
+            self._cleanup_search_test_data()
+
+        request.addfinalizer(teardown)
+
+    def _cleanup_search_test_data(self):
+        self.db_session.query(db_mod.Pharmacy).filter(
+            db_mod.Pharmacy.name.in_(self.names["pharmacy"] + ["Dogwood"])
+        ).delete(synchronize_session=False)
+        self.db_session.query(db_mod.Mask).filter(
+            db_mod.Mask.name.in_(self.names["mask"] + ["Dogtooth"])
+        ).delete(synchronize_session=False)
+        self.db_session.commit()
+
+    @pytest.mark.parametrize("search_term", ["dog", "WW", "NN", "mask", "x"])
+    @pytest.mark.parametrize("search_type", list(SearchType))
+    def test_matches_postgres_backend(self, search_term, search_type):
+        paging = in_sch.PagingParams(skip=0, limit=100)
+        results = search_service._search_in_memory(
+            self.db_session, search_term, search_type, paging)
+        expected = search_service._search_postgres(
+            self.db_session, search_term, search_type, paging)
+        self.db_session.rollback()
+
+        def ranking(rows):
+            return sorted((-row["similarity"], row["type"], row["id"],
+                           row["name"]) for row in rows)
+
+        assert ranking(results) == ranking(expected)
+        assert [row["similarity"] for row in results] == sorted(
+            (row["similarity"] for row in expected), reverse=True)
+
+    def test_paging(self):
+        response = self.client.get(
+            "/search", params={"search_term": "dog", "skip": 1, "limit": 1})
+        assert response.status_code == 200
+        paged = response.json()
+        response = self.client.get("/search", params={"search_term": "dog"})
+        assert paged == response.json()[1:2]
+
+    @pytest.mark.parametrize("backend", list(SearchBackend))
+    @pytest.mark.parametrize("search_type", list(SearchType))
+    def test_cursor_pages_match_offset_pages(self, walk_pages, backend,
+                                             search_type):
+        search_service.search_backend = backend
+        params = {"search_term": "dog", "search_type": search_type.value}
+        try:
+            response = self.client.get("/search", params=params)
+            assert response.status_code == 200
+            pages = walk_pages("/search", {**params, "limit": 1})
+        finally:
+            search_service.search_backend = SearchBackend.MEMORY
+        assert [item for page in pages for item in page] == response.json()
+
+    def test_create_updates_index(self):
+        self.client.get("/search", params={"search_term": "dog"})
+        assert search_service.search_index.loaded
+
+        response = self.client.post(
+            "/pharmacies", json={"name": "Dogwood", "cash_balance": 10})
+        assert response.status_code == 200
+        response = self.client.post("/masks", json={"name": "Dogtooth"})
+        assert response.status_code == 200
+
+        response = self.client.get("/search", params={"search_term": "dog"})
+        names = {item["name"] for item in response.json()}
+        assert {"Dogwood", "Dogtooth"} <= names
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = LRUCache(max_entries=2, ttl=60)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats() == {"entries": 2, "max_entries": 2, "hits": 3,
+                             "misses": 1, "evictions": 1, "invalidations": 0}
+
+
+def test_lru_cache_expires_entries():
+    cache = LRUCache(max_entries=2, ttl=-1)
+    cache.put("a", 1)
+    assert cache.get("a") is None
+    assert cache.stats()["evictions"] == 1
+
+
+def test_normalize():
+    assert normalize("  Wired-DOG!! ") == "wired dog"
+    assert similarity(normalize("  Wired-DOG!! "), "Wired dog") == \
+        similarity("  Wired-DOG!! ", "Wired dog")
+
+
+class TestSearchCache:
+    @pytest.fixture(scope="class", autouse=True)
+    def setup_class(self, request, client, db_session):
+        request.cls.client = client
+        request.cls.db_session = db_session
+
+        self._cleanup_search_test_data()
+        db_session.add(db_mod.Pharmacy(name="Wired dog", cash_balance=100))
+        db_session.commit()
+        search_service.search_cache = LRUCache(max_entries=100, ttl=60)
+
+        def teardown():
+            search_service.search_cache.invalidate()
+            self._cleanup_search_test_data()
+
+        request.addfinalizer(teardown)
+
+    def _cleanup_search_test_data(self):
+        self.db_session.query(db_mod.Pharmacy).filter(
+            db_mod.Pharmacy.name.in_(["Wired dog", "Catnip"])
+        ).delete(synchronize_session=False)
+        self.db_session.commit()
+
+    def _search(self, search_term):
+        response = self.client.get("/search", params={
+            "search_term": search_term, "search_type": "pharmacy"})
+        assert response.status_code == 200
+        return [item["name"] for item in response.json()]
+
+    def test_cache_hits_on_normalized_term(self):
+        stats = search_service.get_cache_stats()
+        assert self._search("dog") == ["Wired dog"]
+        assert self._search("  DOG ") == ["Wired dog"]
+
+        response = self.client.get("/search/cache")
+        assert response.status_code == 200
+        data = response.json()
+        assert data["hits"] == stats["hits"] + 1
+        assert data["misses"] == stats["misses"] + 1
+
+    def test_create_invalidates_matching_entries(self):
+        assert "Catnip" not in self._search("cat")
+        self._search("dog")
+        invalidations = search_service.get_cache_stats()["invalidations"]
+
+        response = self.client.post(
+            "/pharmacies", json={"name": "Catnip", "cash_balance": 10})
+        assert response.status_code == 200
+
+        stats = search_service.get_cache_stats()
+        assert stats["invalidations"] == invalidations + 1
+        assert "Catnip" in self._search("cat")
+        assert self._search("dog") == ["Wired dog"]
+        assert search_service.get_cache_stats()["hits"] == stats["hits"] + 1
+
+
+class TestAutocomplete:
+    pharmacy_names = ["Care Rx", "care point", "Carefirst", "Blue Care",
+                      "100%_Pharma", "1000 Drugs"]
+    mask_names = ["Care Mask (blue)", "blue care"]
+
+    @pytest.fixture(scope="class", autouse=True)
+    def setup_class(self, request, client, db_session):
+        request.cls.client = client
+        request.cls.db_session = db_session
+
+        self._cleanup_search_test_data()
+        db_session.add_all(
+            [db_mod.Pharmacy(name=name, cash_balance=100)
+             for name in self.pharmacy_names]
+            + [db_mod.Mask(name=name) for name in self.mask_names]
+        )
+        db_session.commit()
+
+        def teardown():
+            search_service.search_backend = SearchBackend.POSTGRES
+            search_service.search_index = TrigramIndex()
+            search_service.prefix_index = PrefixIndex()
+            self._cleanup_search_test_data()
+
+        request.addfinalizer(teardown)
+
+    @pytest.fixture(params=list(SearchBackend))
+    def backend(self, request):
+        search_service.search_backend = request.param
+        search_service.search_index = TrigramIndex()
+        search_service.prefix_index = PrefixIndex()
+        yield request.param
+        search_service.search_backend = SearchBackend.POSTGRES
+
+    def _cleanup_search_test_data(self):
+        self.db_session.query(db_mod.Pharmacy).filter(
+            db_mod.Pharmacy.name.in_(self.pharmacy_names + ["Caremark"])
+        ).delete(synchronize_session=False)
+        self.db_session.query(db_mod.Mask).filter(
+            db_mod.Mask.name.in_(self.mask_names)
+        ).delete(synchronize_session=False)
+        self.db_session.commit()
+
+    def _autocomplete(self, prefix, search_type="all", limit=10):
+        response = self.client.get("/search/autocomplete", params={
+            "prefix": prefix, "search_type": search_type, "limit": limit})
+        assert response.status_code == 200
+        return [(item["name"], item["type"]) for item in response.json()]
+
+    @pytest.mark.parametrize("prefix, search_type, limit, expected", [
+        ("care", "all", 10,
+         [("Care Mask (blue)", "mask"), ("care point", "pharmacy"),
+          ("Care Rx", "pharmacy"), ("Carefirst", "pharmacy")]),
+        ("CARE ", "pharmacy", 10,
+         [("care point", "pharmacy"), ("Care Rx", "pharmacy")]),
+        ("care", "all", 2,
+         [("Care Mask (blue)", "mask"), ("care point", "pharmacy")]),
+        ("blue c", "all", 10,
+         [("Blue Care", "pharmacy"), ("blue care", "mask")]),
+        ("blue c", "mask", 10, [("blue care", "mask")]),
+        ("100%", "all", 10, [("100%_Pharma", "pharmacy")]),
+        ("100_", "all", 10, []),
+        ("zzz", "all", 10, []),
+    ])
+    def test_autocomplete(self, backend, prefix, search_type, limit,
+                          expected):
+        assert self._autocomplete(prefix, search_type, limit) == expected
+
+    def test_rejects_empty_prefix(self):
+        response = self.client.get("/search/autocomplete",
+                                   params={"prefix": ""})
+        assert response.status_code == 422
+
+    def test_create_updates_prefix_index(self, backend):
+        assert self._autocomplete("carem") == []
+        response = self.client.post(
+            "/pharmacies", json={"name": "Caremark", "cash_balance": 10})
+        assert response.status_code == 200
+        assert self._autocomplete("carem") == [("Caremark", "pharmacy")]
+        self._cleanup_search_test_data()
+        self.db_session.add(db_mod.Pharmacy(name="Care Rx", cash_balance=100))
+        self.db_session.commit()
+
+
+class TestSearchBatch:
+    pharmacy_names = ["Wired dog", "Wizard cat", "Dog Rx"]
+    mask_names = ["N95", "Dog mask (black)"]
+
+    @pytest.fixture(scope="class", autouse=True)
+    def setup_class(self, request, client, db_session):
+        request.cls.client = client
+        request.cls.db_session = db_session
+
+        self._cleanup_search_test_data()
+        db_session.add_all(
+            [db_mod.Pharmacy(name=name, cash_balance=100)
+             for name in self.pharmacy_names]
+            + [db_mod.Mask(name=name) for name in self.mask_names]
+        )
+        db_session.commit()
+
+        def teardown():
+            search_service.search_backend = SearchBackend.POSTGRES
+            search_service.search_index = TrigramIndex()
+            self._cleanup_search_test_data()
+
+        request.addfinalizer(teardown)
+
+    def _cleanup_search_test_data(self):
+        self.db_session.query(db_mod.Pharmacy).filter(
+            db_mod.Pharmacy.name.in_(self.pharmacy_names)
+        ).delete(synchronize_session=False)
+        self.db_session.query(db_mod.Mask).filter(
+            db_mod.Mask.name.in_(self.mask_names)
+        ).delete(synchronize_session=False)
+        self.db_session.commit()
+
+    def _search_batch(self, backend, **body):
+        search_service.search_backend = backend
+        search_service.search_index = TrigramIndex()
+        try:
+            response = self.client.post("/search/batch", json=body)
+        finally:
+            search_service.search_backend = SearchBackend.POSTGRES
+        assert response.status_code == 200
+        return response.json()
+
+    @pytest.mark.parametrize("search_type", list(SearchType))
+    @pytest.mark.parametrize("top_k", [1, 2, 10])
+    def test_backends_agree(self, search_type, top_k):
+        body = {"terms": ["dog", "NN", "xyz", "dog", "wizard"],
+                "search_type": search_type.value, "top_k": top_k}
+        results = self._search_batch(SearchBackend.POSTGRES, **body)
+        assert results == self._search_batch(SearchBackend.MEMORY, **body)
+        assert [result["term"] for result in results] == body["terms"]
+        assert all(len(result["matches"]) <= top_k for result in results)
+
+    def test_matches_search(self):
+        results = self._search_batch(
+            SearchBackend.POSTGRES, terms=["dog", "xyz"], search_type="all",
+            top_k=10)
+        expected = self.client.get(
+            "/search", params={"search_term": "dog", "limit": 10}).json()
+        assert sorted(item["name"] for item in results[0]["matches"]) == \
+            sorted(item["name"] for item in expected)
+        assert results[1]["matches"] == []
+
+    @pytest.mark.parametrize("body", [
+        {"terms": []},
+        {"terms": ["dog"], "top_k": 0},
+        {"terms": ["dog"], "search_type": "shop"},
+    ])
+    def test_rejects_invalid_batch(self, body):
+        response = self.client.post("/search/batch", json=body)
+        assert response.status_code == 422
@@ -0,0 +1,411 @@
+import csv
+import io
+import json
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import event, inspect, text
+
+import api.database.db_models as db_mod
+from api.crud import mask_crud, transaction_crud, user_crud
+from api.enums import ExportFormat
+from api.schemas import input_schema as in_sch
+from api.services import transaction_service
+from api.utils.tools import whole_days
+
+
+@pytest.mark.parametrize("start, end, expected", [
+    (datetime(2025, 3, 1), datetime(2025, 3, 4),
+     (datetime(2025, 3, 1), datetime(2025, 3, 4))),
+    (datetime(2025, 3, 1, 12), datetime(2025, 3, 3, 17, 45),
+     (datetime(2025, 3, 2), datetime(2025, 3, 3))),
+    (datetime(2025, 3, 1), datetime(2025, 3, 1, 23, 59, 59, 999999),
+     (datetime(2025, 3, 1), datetime(2025, 3, 2))),
+    (datetime(2025, 3, 1), datetime(2025, 3, 1, 23, 59, 59), None),
+    (datetime(2025, 3, 1, 6), datetime(2025, 3, 2, 6), None),
+    (datetime(2025, 3, 2), datetime(2025, 3, 1), None),
+])
+def test_whole_days(start, end, expected):
+    assert whole_days(start, end) == expected
+
+
+class TestDailyRollups:
+    user_names = ["Rollup User A", "Rollup User B"]
+    mask_names = ["Rollup Mask A", "Rollup Mask B"]
+    # (user, mask, amount, date) of each purchase.
+    purchases = [
+        (0, 0, "10.05", datetime(2025, 3, 1)),
+        (0, 1, "3.10", datetime(2025, 3, 1, 12)),
+        (1, 0, "7.25", datetime(2025, 3, 1, 23, 59, 59, 999999)),
+        (1, 1, "12.00", datetime(2025, 3, 2)),
+        (0, 0, "0.99", datetime(2025, 3, 2, 8, 30)),
+        (1, 0, "20.01", datetime(2025, 3, 3, 17, 45)),
+        (0, 1, "4.40", datetime(2025, 3, 4)),
+    ]
+
+    @pytest.fixture(scope="class", autouse=True)
+    def setup_class(self, request, db_session):
+        request.cls.db_session = db_session
+
+        self._cleanup_rollup_test_data()
+        pharmacy = db_mod.Pharmacy(name="Rollup Pharmacy", cash_balance=0)
+        users = [db_mod.User(name=name, cash_balance=100)
+                 for name in self.user_names]
+        masks = [db_mod.Mask(name=name) for name in self.mask_names]
+        db_session.add_all([pharmacy, *users, *masks])
+        db_session.commit()
+        for user, mask, amount, date in self.purchases:
+            transaction_crud.create_transaction(db_session, db_mod.Transaction(
+                user_id=users[user].id, pharmacy_id=pharmacy.id,
+                mask_id=masks[mask].id, transaction_amount=Decimal(amount),
+                date=date))
+        request.addfinalizer(self._cleanup_rollup_test_data)
+
+    def _cleanup_rollup_test_data(self):
+        user_ids = self.db_session.query(db_mod.User.id).filter(
+            db_mod.User.name.in_(self.user_names)
+        ).scalar_subquery()
+        self.db_session.query(db_mod.Transaction).filter(
+            db_mod.Transaction.user_id.in_(user_ids)
+        ).delete(synchronize_session=False)
+        self.db_session.commit()
+        transaction_crud.rebuild_daily_rollups(self.db_session)
+        for model, names in ((db_mod.User, self.user_names),
+                             (db_mod.Mask, self.mask_names),
+                             (db_mod.Pharmacy, ["Rollup Pharmacy"])):
+            self.db_session.query(model).filter(
+                model.name.in_(names)
+            ).delete(synchronize_session=False)
+        self.db_session.commit()
+
+    def _rollup_rows(self):
+        return {
+            model: sorted(tuple(row) for row in self.db_session.query(
+                model.day, getattr(model, key), model.transaction_count,
+                model.total_amount))
+            for key, model in transaction_crud.DAILY_ROLLUPS.items()
+        }
+
+    @pytest.mark.parametrize("start, end", [
+        (datetime(2025, 3, 1), datetime(2025, 3, 4)),
+        (datetime(2025, 3, 1, 12), datetime(2025, 3, 3, 17, 45)),
+        (datetime(2025, 3, 1, 12, 0, 0, 1), datetime(2025, 3, 3, 17, 44)),
+        (datetime(2025, 3, 1), datetime(2025, 3, 1, 23, 59, 59, 999999)),
+        (datetime(2025, 3, 1, 6), datetime(2025, 3, 1, 18)),
+        (datetime(2025, 3, 2), datetime(2025, 3, 1)),
+        (datetime(2025, 2, 1), datetime(2025, 4, 1)),
+    ])
+    def test_reports_match_raw_scan(self, start, end):
+        date_range = in_sch.DateRange(start_date=start, end_date=end)
+        assert mask_crud.get_mask_summary(self.db_session, date_range) == \
+            mask_crud.get_mask_summary(self.db_session, date_range,
+                                       rollups=False)
+        assert user_crud.list_top_users_by_transaction_amount(
+            self.db_session, date_range, 10) == \
+            user_crud.list_top_users_by_transaction_amount(
+                self.db_session, date_range, 10, rollups=False)
+
+    def test_mask_summary_with_partial_edge_day(self):
+        date_range = in_sch.DateRange(start_date=datetime(2025, 3, 1),
+                                      end_date=datetime(2025, 3, 4))
+        summary = {row.mask_name: (row.mask_count, row.total_value)
+                   for row in mask_crud.get_mask_summary(self.db_session,
+                                                         date_range)}
+        assert summary == {"Rollup Mask A": (4, 38.3),
+                           "Rollup Mask B": (3, 19.5)}
+
+    def test_rebuild_matches_purchases(self):
+        counted = self._rollup_rows()
+        transaction_crud.rebuild_daily_rollups(self.db_session)
+        assert self._rollup_rows() == counted
+        day = self.db_session.get(db_mod.MaskDailyRollup, (
+            datetime(2025, 3, 1).date(),
+            self.db_session.query(db_mod.Mask.id).filter(
+                db_mod.Mask.name == "Rollup Mask A").scalar()))
+        assert (day.transaction_count, day.total_amount) == \
+            (2, Decimal("17.30"))
+
+    def test_rebuild_of_loaded_days(self):
+        last_id = transaction_crud.get_last_transaction_id(self.db_session)
+        user_id, mask_id, pharmacy_id = self.db_session.query(
+            db_mod.Transaction.user_id, db_mod.Transaction.mask_id,
+            db_mod.Transaction.pharmacy_id
+        ).filter(db_mod.Transaction.id == last_id).one()
+        loaded = [db_mod.Transaction(
+            user_id=user_id, pharmacy_id=pharmacy_id, mask_id=mask_id,
+            transaction_amount=Decimal("1.00"), date=date
+        ) for date in (datetime(2025, 3, 2, 9), datetime(2025, 3, 5, 23))]
+        self.db_session.add_all(loaded)
+        self.db_session.commit()
+
+        days = transaction_crud.get_days_after(self.db_session, last_id)
+        assert days == {datetime(2025, 3, 2).date(),
+                        datetime(2025, 3, 5).date()}
+        transaction_crud.rebuild_daily_rollups(self.db_session, days)
+        counted = self._rollup_rows()
+        transaction_crud.rebuild_daily_rollups(self.db_session)
+        assert self._rollup_rows() == counted
+
+        for transaction in loaded:
+            self.db_session.delete(transaction)
+        self.db_session.commit()
+        transaction_crud.rebuild_daily_rollups(self.db_session, days)
+
+
+class TestPartitions:
+    created = ["transactions_y2023m05", "transactions_y2030m01",
+               "transactions_y2030m02"]
+    ensured = ["transactions_y2030m03", "transactions_y2030m04"]
+
+    @pytest.fixture(scope="class", autouse=True)
+    def setup_class(self, request, db_session):
+        request.cls.db_session = db_session
+        request.addfinalizer(self._cleanup_partition_test_data)
+
+    def _cleanup_partition_test_data(self):
+        self.db_session.rollback()
+        partitions = transaction_crud.list_partitions(self.db_session)
+        self.db_session.query(db_mod.Transaction).filter(
+            db_mod.Transaction.date < datetime(2023, 6, 1)
+        ).delete(synchronize_session=False)
+        transaction_service.partitioned_months.clear()
+        for name in self.created + self.ensured:
+            if name in partitions.values():
+                self.db_session.execute(text(
+                    f"ALTER TABLE transactions DETACH PARTITION {name}"))
+            self.db_session.execute(text(f"DROP TABLE IF EXISTS {name}"))
+        self.db_session.commit()
+        transaction_crud.rebuild_daily_rollups(self.db_session)
+
+    def _count(self, table):
+        return self.db_session.execute(
+            text(f"SELECT count(*) FROM {table} "
+                 f"WHERE date < '2023-06-01'")).scalar()
+
+    def test_create_partitions_moves_default_rows(self):
+        transaction_crud.create_transaction(self.db_session, db_mod.Transaction(
+            user_id=1, pharmacy_id=1, mask_id=1,
+            transaction_amount=Decimal("12.50"),
+            date=datetime(2023, 5, 31, 23, 59)))
+        assert self._count("transactions_default") == 1
+
+        created = transaction_crud.create_partitions(
+            self.db_session, 1, today=date(2030, 1, 15))
+        assert created == self.created
+        assert self._count("transactions_default") == 0
+        assert self._count("transactions_y2023m05") == 1
+        assert self._count("transactions") == 1
+        assert transaction_crud.create_partitions(
+            self.db_session, 1, today=date(2030, 1, 15)) == []
+
+    def test_detach_partitions_removes_rollup_days(self):
+        date_range = in_sch.DateRange(start_date=datetime(2023, 1, 1),
+                                      end_date=datetime(2023, 12, 31))
+        assert len(mask_crud.get_mask_summary(self.db_session,
+                                              date_range)) == 1
+
+        detached = transaction_crud.detach_partitions(self.db_session,
+                                                      date(2023, 6, 1))
+        assert detached == ["transactions_y2023m05"]
+        assert self._count("transactions") == 0
+        assert self._count("transactions_y2023m05") == 1
+        assert "transactions_y2023m05" in \
+            inspect(self.db_session.connection()).get_table_names()
+        assert self.db_session.query(db_mod.MaskDailyRollup).filter(
+            db_mod.MaskDailyRollup.day < date(2023, 6, 1)).count() == 0
+        assert mask_crud.get_mask_summary(self.db_session, date_range) == \
+            mask_crud.get_mask_summary(self.db_session, date_range,
+                                       rollups=False)
+
+    def test_ensure_partitions_keeps_months_ahead(self, monkeypatch):
+        monkeypatch.setattr(transaction_service,
+                            "TRANSACTION_PARTITION_MONTHS_AHEAD", 3)
+        transaction_service.partitioned_months.clear()
+        transaction_service.ensure_partitions(
+            self.db_session, date(2030, 2, 10), today=date(2029, 11, 20))
+        assert set(transaction_crud.list_partitions(self.db_session)) >= {
+            date(2030, 1, 1), date(2030, 2, 1)}
+        assert date(2030, 3, 1) not in transaction_crud.list_partitions(
+            self.db_session)
+
+        transaction_service.ensure_partitions(
+            self.db_session, date(2030, 1, 31), today=date(2030, 1, 1))
+        names = transaction_crud.list_partitions(self.db_session).values()
+        assert set(self.ensured) <= set(names)
+
+
+class TestReportCache:
+    summary_params = {"start_date": "2022-03-01", "end_date": "2022-03-31"}
+    users_params = {"start_date": "2022-03-01", "end_date": "2022-03-31",
+                    "limit": 5}
+
+    @pytest.fixture(scope="class", autouse=True)
+    def setup_class(self, request, client, db_session):
+        request.cls.client = client
+        request.cls.db_session = db_session
+
+        self._cleanup_report_cache_test_data()
+        for day, amount in ((3, "10.00"), (20, "5.25")):
+            self._purchase(datetime(2022, 3, day, 9), amount)
+        request.addfinalizer(self._cleanup_report_cache_test_data)
+
+    def _cleanup_report_cache_test_data(self):
+        self.db_session.query(db_mod.Transaction).filter(
+            db_mod.Transaction.date < datetime(2023, 1, 1),
+            db_mod.Transaction.date >= datetime(2022, 1, 1)
+        ).delete(synchronize_session=False)
+        self.db_session.query(db_mod.ReportCache).delete()
+        self.db_session.commit()
+        transaction_crud.rebuild_daily_rollups(self.db_session)
+
+    def _purchase(self, purchase_date, amount):
+        transaction_crud.create_transaction(self.db_session, db_mod.Transaction(
+            user_id=1, pharmacy_id=1, mask_id=1,
+            transaction_amount=Decimal(amount), date=purchase_date))
+
+    def _cached(self, report):
+        self.db_session.rollback()
+        return self.db_session.query(db_mod.ReportCache).filter(
+            db_mod.ReportCache.report == report,
+            db_mod.ReportCache.start_date == datetime(2022, 3, 1)
+        ).all()
+
+    def _summary(self):
+        response = self.client.get("/masks/transactions/summary",
+                                   params=self.summary_params)
+        assert response.status_code == 200
+        return response.json()
+
+    def test_closed_range_is_cached_without_expiry(self, sql_statements):
+        expected = [{"mask_id": 1, "mask_name": "Adult Mask",
+                     "mask_count": 2, "total_value": 15.25}]
+        assert self._summary() == expected
+        [entry] = self._cached("mask_summary")
+        assert entry.expires_at is None
+        assert entry.result == expected
+
+        sql_statements.clear()
+        assert self._summary() == expected
+        assert not any("transactions" in statement
+                       for statement, _ in sql_statements)
+
+    def test_open_range_expires(self):
+        start = datetime.combine(date.today(), datetime.min.time())
+        response = self.client.get("/users/transaction_amount", params={
+            "start_date": start.isoformat(),
+            "end_date": (start + timedelta(days=1)).isoformat()})
+        assert response.status_code == 200
+        [entry] = self.db_session.query(db_mod.ReportCache).filter(
+            db_mod.ReportCache.report == "top_users",
+            db_mod.ReportCache.start_date == start).all()
+        assert entry.expires_at is not None
+
+    def test_purchase_invalidates_its_days(self):
+        response = self.client.get("/users/transaction_amount",
+                                   params=self.users_params)
+        assert response.json() == [
+            {"id": 1, "name": "User One", "total_amount": 15.25}]
+        self._summary()
+        self.client.get("/masks/transactions/summary", params={
+            "start_date": "2022-04-01", "end_date": "2022-04-30"})
+
+        self._purchase(datetime(2022, 3, 31), "1.00")
+        assert self._cached("mask_summary") == []
+        assert self._cached("top_users") == []
+        assert self.db_session.query(db_mod.ReportCache).filter(
+            db_mod.ReportCache.start_date == datetime(2022, 4, 1)).count() == 1
+        assert self._summary()[0]["total_value"] == 16.25
+
+    def test_rollup_rebuild_invalidates_backfilled_days(self):
+        self._summary()
+        self.db_session.execute(text(
+            "INSERT INTO transactions "
+            "(user_id, pharmacy_id, mask_id, transaction_amount, date) "
+            "VALUES (1, 1, 2, 4.00, '2022-03-15 10:00')"))
+        self.db_session.commit()
+        # Until the backfill is recounted, the cached report stands.
+        assert len(self._summary()) == 1
+
+        transaction_crud.rebuild_daily_rollups(self.db_session)
+        assert self._cached("mask_summary") == []
+        assert [row["mask_id"] for row in self._summary()] == [1, 2]
+
+
+class TestTransactionExport:
+    params = {"start_date": "2024-10-01", "end_date": "2024-11-30"}
+
+    @pytest.fixture(scope="class", autouse=True)
+    def setup_class(self, request, client, db_session):
+        request.cls.client = client
+        request.cls.db_session = db_session
+
+    def _expected(self, **filters):
+        query = self.db_session.query(db_mod.Transaction).filter(
+            db_mod.Transaction.date.between(datetime(2024, 10, 1),
+                                            datetime(2024, 11, 30)))
+        for key, value in filters.items():
+            query = query.filter(getattr(db_mod.Transaction, key) == value)
+        return [[str(transaction.id), str(transaction.user_id),
+                 str(transaction.pharmacy_id), str(transaction.mask_id),
+                 str(transaction.transaction_amount),
+                 transaction.date.isoformat()]
+                for transaction in query.order_by(db_mod.Transaction.date,
+                                                  db_mod.Transaction.id)]
+
+    @pytest.mark.parametrize("filters", [
+        {}, {"user_id": 1}, {"pharmacy_id": 1, "mask_id": 2}, {"user_id": 99},
+    ])
+    def test_csv_export(self, filters):
+        response = self.client.get("/transactions/export",
+                                   params={**self.params, **filters})
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/csv")
+        assert "transactions.csv" in response.headers["content-disposition"]
+        header, *rows = csv.reader(io.StringIO(response.text))
+        assert header == transaction_service.EXPORT_COLUMNS
+        assert rows == self._expected(**filters)
+
+    def test_ndjson_export(self):
+        response = self.client.get("/transactions/export",
+                                   params={**self.params, "format": "ndjson"})
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/x-ndjson"
+        rows = [json.loads(line) for line in response.text.splitlines()]
+        assert [[str(value) for value in row.values()] for row in rows] == [
+            row[:4] + [str(float(row[4])), row[5]] for row in self._expected()]
+        assert rows[0] == {"id": 1, "user_id": 1, "pharmacy_id": 1,
+                           "mask_id": 1, "transaction_amount": 20.0,
+                           "date": "2024-10-01T00:00:00"}
+
+    def test_invalid_format(self):
+        response = self.client.get("/transactions/export",
+                                   params={**self.params, "format": "xml"})
+        assert response.status_code == 422
+
+    def test_export_streams_from_server_side_cursor(self):
+        engine = self.db_session.get_bind()
+        streamed = []
+
+        def _record(conn, cursor, statement, parameters, context,
+                    executemany):
+            if "FROM transactions" in statement:
+                streamed.append(context.execution_options.get(
+                    "stream_results"))
+
+        chunks = transaction_service.export_transactions(
+            self.db_session,
+            in_sch.DateRange(start_date=datetime(2024, 10, 1),
+                             end_date=datetime(2024, 11, 30)),
+            in_sch.TransactionFilterParams(), ExportFormat.CSV, batch_size=1)
+        event.listen(engine, "before_cursor_execute", _record)
+        try:
+            # The header is sent before the query runs.
+            assert next(chunks) == ",".join(
+                transaction_service.EXPORT_COLUMNS) + "\n"
+            assert streamed == []
+            rows = list(chunks)
+        finally:
+            event.remove(engine, "before_cursor_execute", _record)
+        assert streamed == [True]
+        assert len(rows) == len(self._expected())
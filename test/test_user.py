@@ -1,5 +1,15 @@
+from datetime import date, datetime
+from decimal import Decimal
+
 import pytest
 
+import api.database.db_models as db_mod
+from api.crud import transaction_crud, user_crud
+from api.enums import TopUsersBackend
+from api.schemas import input_schema as in_sch
+from api.services import user_service
+from api.utils.leaderboard import Leaderboard
+
 
 class TestUserRoutes:
     @pytest.fixture(scope="class", autouse=True)
@@ -36,3 +46,180 @@ class TestUserRoutes:
         for i, user_summary in enumerate(expected):
             for key, value in user_summary.items():
                 assert data[i][key] == value
+
+
+class TestLeaderboard:
+    user_names = ["Leaderboard User A", "Leaderboard User B"]
+    ranges = [
+        ("2024-01-01", "2030-01-01"),
+        ("2024-10-12", "2030-01-01"),
+        ("2024-10-14", "2030-01-01"),
+        ("2024-10-13", "2030-01-01"),
+        ("2024-10-01", "2024-10-31"),
+    ]
+
+    @pytest.fixture(scope="class", autouse=True)
+    def setup_class(self, request, client, db_session):
+        request.cls.client = client
+        request.cls.db_session = db_session
+
+        self._cleanup_leaderboard_test_data()
+        users = [db_mod.User(name=name, cash_balance=100)
+                 for name in self.user_names]
+        db_session.add_all(users)
+        db_session.commit()
+        request.cls.user_ids = [user.id for user in users]
+
+        backend = user_service.top_users_backend
+        leaderboard = user_service.leaderboard
+        request.cls.today = [date(2024, 11, 10)]
+        user_service.top_users_backend = TopUsersBackend.LEADERBOARD
+        user_service.leaderboard = Leaderboard(30, lambda: self.today[0])
+
+        def restore():
+            user_service.top_users_backend = backend
+            user_service.leaderboard = leaderboard
+            self._cleanup_leaderboard_test_data()
+
+        request.addfinalizer(restore)
+
+    def _cleanup_leaderboard_test_data(self):
+        user_ids = self.db_session.query(db_mod.User.id).filter(
+            db_mod.User.name.in_(self.user_names)
+        ).scalar_subquery()
+        self.db_session.query(db_mod.Transaction).filter(
+            db_mod.Transaction.user_id.in_(user_ids)
+        ).delete(synchronize_session=False)
+        self.db_session.commit()
+        transaction_crud.rebuild_daily_rollups(self.db_session)
+        self.db_session.query(db_mod.User).filter(
+            db_mod.User.name.in_(self.user_names)
+        ).delete(synchronize_session=False)
+        self.db_session.commit()
+
+    def _purchase(self, user, amount, purchase_date, notify=True):
+        transaction, version = transaction_crud.create_transaction(
+            self.db_session, db_mod.Transaction(
+                user_id=self.user_ids[user], pharmacy_id=1, mask_id=1,
+                transaction_amount=Decimal(amount), date=purchase_date))
+        if notify:
+            user_service.transaction_created(transaction, version)
+
+    def _assert_matches_sql(self):
+        for start_date, end_date in self.ranges:
+            for limit in (0, 1, 3, 10):
+                response = self.client.get("/users/transaction_amount",
+                                           params={"start_date": start_date,
+                                                   "end_date": end_date,
+                                                   "limit": limit})
+                assert response.status_code == 200
+                date_range = in_sch.DateRange(start_date=start_date,
+                                              end_date=end_date)
+                expected = user_crud.list_top_users_by_transaction_amount(
+                    self.db_session, date_range, limit, rollups=False)
+                assert response.json() == [user.model_dump()
+                                           for user in expected]
+
+    def test_serves_all_time_and_window(self):
+        self._assert_matches_sql()
+        leaderboard = user_service.leaderboard
+        assert leaderboard.top(datetime(2024, 1, 1),
+                               datetime(2030, 1, 1), 10) is not None
+        assert leaderboard.top(datetime(2024, 10, 12),
+                               datetime(2030, 1, 1), 10) == \
+            [(2, Decimal("50.00")), (1, Decimal("30.00"))]
+        assert leaderboard.top(datetime(2024, 10, 13),
+                               datetime(2030, 1, 1), 10) is None
+        assert leaderboard.top(datetime(2024, 1, 1),
+                               datetime(2024, 11, 7), 10) is None
+
+    def test_purchases_update_leaderboard(self):
+        self._purchase(0, "90.00", datetime(2024, 11, 9, 12))
+        self._purchase(1, "15.50", datetime(2024, 10, 12))
+        self._purchase(1, "0.25", datetime(2024, 10, 13, 23, 59))
+        self._assert_matches_sql()
+        assert user_service.leaderboard.top(
+            datetime(2024, 10, 12), datetime(2030, 1, 1), 2) == \
+            [(self.user_ids[0], Decimal("90.00")), (2, Decimal("50.00"))]
+
+    def test_window_expires_days(self):
+        self.today[0] = date(2024, 11, 12)
+        assert user_service.leaderboard.top(
+            datetime(2024, 10, 14), datetime(2030, 1, 1), 10) == \
+            [(self.user_ids[0], Decimal("90.00")), (2, Decimal("50.00")),
+             (1, Decimal("30.00"))]
+        self._assert_matches_sql()
+        self.today[0] = date(2024, 11, 10)
+        assert user_service.leaderboard.top(
+            datetime(2024, 10, 12), datetime(2030, 1, 1), 10) is None
+
+    def test_purchases_elsewhere_are_picked_up(self):
+        # A purchase made by another worker, which this one is not told of.
+        self._purchase(1, "200.00", datetime(2024, 11, 10, 8))
+        self._assert_matches_sql()
+        assert user_service.leaderboard.top(
+            datetime(2024, 1, 1), datetime(2030, 1, 1), 1) == \
+            [(self.user_ids[1], Decimal("215.75"))]
+
+        # Rows loaded around the API, as by ETL, then counted in the rollups.
+        self.db_session.add(db_mod.Transaction(
+            user_id=self.user_ids[0], pharmacy_id=1, mask_id=1,
+            transaction_amount=Decimal("500.00"),
+            date=datetime(2024, 11, 10, 9)))
+        self.db_session.commit()
+        transaction_crud.rebuild_daily_rollups(self.db_session)
+        self._assert_matches_sql()
+        assert user_service.leaderboard.top(
+            datetime(2024, 1, 1), datetime(2030, 1, 1), 1) == \
+            [(self.user_ids[0], Decimal("590.00"))]
+
+
+class TestLeaderboardVersions:
+    day = datetime(2024, 11, 10, 12)
+
+    def _leaderboard(self):
+        return Leaderboard(30, lambda: self.day.date())
+
+    def _top(self, leaderboard, version=None):
+        return leaderboard.top(datetime(2024, 1, 1), datetime(2030, 1, 1),
+                               10, version)
+
+    def test_purchase_during_first_load_is_replayed(self):
+        leaderboard = self._leaderboard()
+        leaderboard.add(1, Decimal("10"), self.day, 6)
+        assert self._top(leaderboard) is None
+
+        leaderboard.rebuild([(1, 1, Decimal("5"))], [], (self.day, self.day),
+                            5)
+        assert leaderboard.is_current(6)
+        assert self._top(leaderboard, 6) == [(1, Decimal("15"))]
+
+    def test_purchase_during_reload_is_kept(self):
+        leaderboard = self._leaderboard()
+        leaderboard.rebuild([(1, 1, Decimal("5"))], [], (self.day, self.day),
+                            5)
+        leaderboard.add(2, Decimal("7"), self.day, 6)
+        # A reload read as of version 6 already counts the purchase; one
+        # read before it is older than the leaderboard and ignored.
+        leaderboard.rebuild([(1, 1, Decimal("5"))], [], (self.day, self.day),
+                            5)
+        leaderboard.rebuild(
+            [(1, 1, Decimal("5")), (2, 1, Decimal("7"))], [],
+            (self.day, self.day), 6)
+        leaderboard.add(2, Decimal("7"), self.day, 6)
+        assert self._top(leaderboard, 6) == [(2, Decimal("7")),
+                                             (1, Decimal("5"))]
+
+    def test_gap_leaves_leaderboard_stale(self):
+        leaderboard = self._leaderboard()
+        leaderboard.rebuild([], [], (None, None), 5)
+        leaderboard.add(1, Decimal("10"), self.day, 7)
+        assert not leaderboard.is_current(7)
+        assert self._top(leaderboard, 7) is None
+        assert self._top(leaderboard, 5) == []
+
+        leaderboard.rebuild([(2, 1, Decimal("3"))], [],
+                            (self.day, self.day), 6)
+        assert leaderboard.is_current(7)
+        assert self._top(leaderboard, 7) == [(1, Decimal("10")),
+                                             (2, Decimal("3"))]